@@ -9,25 +9,51 @@ else:
     load_dotenv('.env')
     print("🔧 .env chargé")
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, timezone
 import os
+import json
+import hashlib
 import secrets
 from sqlalchemy.orm import joinedload
 
-from models import db, User, Product, Order, OrderItem, Category
+from models import db, User, Product, Order, OrderItem, Category, upgrade_schema, normalize_phone, normalize_stored_phones
 from forms import (
     RegistrationForm, LoginForm, ProfileUpdateForm, 
     EmailVerificationForm, OTPVerificationForm,
     ResetPasswordRequestForm, ResetPasswordForm, ActivateAccountForm
 )
 from utils import (
-    send_verification_email, send_activation_whatsapp,
-    send_order_confirmation_whatsapp, generate_invoice_pdf,
-    send_password_reset_email, generate_order_whatsapp_link,
-    send_activation_confirmation_whatsapp, send_otp_whatsapp
+    render_verification_email, render_password_reset_email,
+    format_order_whatsapp_message, format_activation_whatsapp_message,
+    format_order_confirmation_message, format_activation_confirmation_message,
+    build_whatsapp_url, ADMIN_WHATSAPP_PHONE
+)
+from catalog_cache import catalog_cache
+from search import apply_product_search, rebuild_search_index, search_index_is_empty
+from pagination import InvalidCursor, encode_cursor, decode_cursor, parse_limit
+from pricing import price_cart
+from invoice_cache import get_invoice_pdf
+from invoice_export import iter_export_orders, stream_invoice_zip
+from shortlinks import (
+    create_short_link, short_link_url, resolve_short_link, record_click, short_link_stats
+)
+from whatsapp_cloud import (
+    WHATSAPP_CLOUD_CONFIG, whatsapp_cloud_enabled, enqueue_whatsapp,
+    verify_webhook_signature, apply_status_updates, process_inbound_messages, whatsapp_delivery_stats
+)
+from user_cache import get_user_principal, get_user_record, user_cache_stats
+from auth import LOGIN_CONFIG, LoginBusy, find_user_by_login, verify_password
+from rate_limit import rate_limit, rate_limit_stats
+from metrics import init_metrics, metrics_allowed, render_metrics
+from profiler import PROFILER_CONFIG, init_profiler, list_profiles, get_profile, profiler_stats
+from outbox import OUTBOX_CONFIG, enqueue_email, outbox_stats, outbox_worker, requeue_dead_messages
+from inventory import OutOfStock, reserve_stock, change_order_status
+from idempotency import (
+    IDEMPOTENCY_CONFIG, IdempotencyConflict, request_fingerprint,
+    claim_idempotency_key, complete_idempotency_key, release_idempotency_key
 )
 from flask import Flask, render_template, send_from_directory
 
@@ -84,6 +110,9 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 }
 
 db.init_app(app)
+# Enregistré avant les autres hooks : la durée mesurée couvre toute la requête
+init_metrics(app)
+init_profiler(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -93,24 +122,19 @@ login_manager.login_message_category = 'warning'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # Principal en lecture seule, mis en cache ; invalidé au commit d'une modification du compte
+    return get_user_principal(int(user_id))
 
-# Normalisation des numéros de téléphone
-def normalize_phone(phone):
-    """Normalise le numéro de téléphone au format +226XXXXXXXX"""
-    phone = "".join(filter(str.isdigit, phone))
-    
-    if phone.startswith('00226'):
-        return '+' + phone[2:]
-    elif phone.startswith('226'):
-        return '+' + phone
-    elif len(phone) == 8 and phone.isdigit():
-        return '+226' + phone
-        
-    return phone if phone.startswith('+') else phone
+@app.before_request
+def start_outbox_worker():
+    # Démarré à la première requête : chaque processus gunicorn a son worker
+    if OUTBOX_CONFIG['enabled'] and not app.testing:
+        outbox_worker.start(app)
 
+# Normalisation des numéros de téléphone
 # Routes existantes (inchangées)
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limit('register')
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -148,6 +172,7 @@ def register():
     return render_template('register.html', form=form)
 
 @app.route('/verify-email/<int:user_id>', methods=['GET', 'POST'])
+@rate_limit('verify_email')
 def verify_email(user_id):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -171,12 +196,13 @@ def verify_email(user_id):
     if user.email_code_expires and datetime.now(timezone.utc) > user.email_code_expires.replace(tzinfo=timezone.utc):
         flash('⚠️ Le code de vérification a expiré. Un nouveau code a été envoyé.', 'warning')
         user.generate_email_verification_code()
+        enqueue_email(user.email, *render_verification_email(user, user.email_verification_code))
         db.session.commit()
-        send_verification_email(user, user.email_verification_code)
     
     return render_template('verify_email.html', form=form, user=user)
 
 @app.route('/resend-verification/<int:user_id>')
+@rate_limit('resend_verification', methods=('GET',))
 def resend_verification(user_id):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -188,9 +214,10 @@ def resend_verification(user_id):
         return redirect(url_for('login'))
     
     verification_code = user.generate_email_verification_code()
+    # Email envoyé par le worker outbox, après validation de la transaction
+    enqueue_email(user.email, *render_verification_email(user, verification_code))
     db.session.commit()
     
-    send_verification_email(user, verification_code)
     flash('✅ Nouveau code de vérification envoyé à votre email.', 'success')
     return redirect(url_for('verify_email', user_id=user.id))
 
@@ -207,6 +234,58 @@ def post_activation(user_id):
     
     return render_template('post_activation.html', user=user)
 
+def notify_whatsapp(phone, message, purpose):
+    """
+    Notification WhatsApp au client : envoyée par l'API Cloud (outbox, même
+    transaction que l'appelant) si elle est configurée, sinon lien wa.me retourné.
+    """
+    if whatsapp_cloud_enabled():
+        enqueue_whatsapp(phone, message, purpose)
+        return None
+    return build_whatsapp_url(phone, message)
+
+@app.route('/webhooks/whatsapp', methods=['GET'])
+def whatsapp_webhook_verify():
+    """Vérification de l'abonnement au webhook (hub.challenge)"""
+    verify_token = WHATSAPP_CLOUD_CONFIG['verify_token']
+    if (request.args.get('hub.mode') == 'subscribe' and verify_token
+            and secrets.compare_digest(request.args.get('hub.verify_token', ''), verify_token)):
+        return request.args.get('hub.challenge', ''), 200
+    return jsonify({'success': False, 'message': 'Jeton de vérification invalide'}), 403
+
+@app.route('/webhooks/whatsapp', methods=['POST'])
+def whatsapp_webhook():
+    """
+    Statuts de livraison (sent, delivered, read, failed) des messages envoyés,
+    et messages reçus : un token d'activation envoyé à l'admin active le compte
+    """
+    if not verify_webhook_signature(request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'success': False, 'message': 'Signature invalide'}), 403
+    
+    payload = request.get_json(silent=True) or {}
+    applied = apply_status_updates(payload)
+    activated = process_inbound_messages(payload)
+    return jsonify({'success': True, 'applied': applied, 'activated': activated})
+
+def activation_whatsapp_link(user):
+    """Lien court vers le message d'activation que l'utilisateur envoie à l'admin"""
+    message = format_activation_whatsapp_message(
+        user.phone, user.activation_token, f"{user.first_name} {user.last_name}"
+    )
+    print(f"🔗 Lien WhatsApp généré pour: {user.phone}")
+    return short_link_url(create_short_link(ADMIN_WHATSAPP_PHONE, message, 'activation'))
+
+@app.route('/w/<code>')
+def whatsapp_short_link(code):
+    """Redirige un lien court vers le message WhatsApp complet"""
+    whatsapp_url = resolve_short_link(code)
+    if not whatsapp_url:
+        flash('⚠️ Ce lien WhatsApp a expiré.', 'warning')
+        return redirect(url_for('index'))
+    
+    record_click(code)
+    return redirect(whatsapp_url)
+
 @app.route('/verify-whatsapp-now/<int:user_id>')
 def verify_whatsapp_now(user_id):
     if current_user.is_authenticated:
@@ -218,7 +297,8 @@ def verify_whatsapp_now(user_id):
         flash('Veuillez d\'abord vérifier votre email.', 'warning')
         return redirect(url_for('verify_email', user_id=user.id))
     
-    whatsapp_url = send_activation_whatsapp(user)
+    whatsapp_url = activation_whatsapp_link(user)
+    db.session.commit()
     
     flash('✅ WhatsApp ouvert! Envoyez votre token à l\'admin pour activer votre compte.', 'success')
     return render_template('send_whatsapp.html', 
@@ -235,10 +315,9 @@ def activate_account():
         
         if user:
             user.whatsapp_verified = True
+            notify_whatsapp(user.phone, format_activation_confirmation_message(user), 'activation')
             db.session.commit()
             
-            send_activation_confirmation_whatsapp(user)
-            
             flash('✅ Compte activé avec succès! Votre WhatsApp est maintenant vérifié.', 'success')
             return redirect(url_for('login'))
         else:
@@ -247,6 +326,7 @@ def activate_account():
     return redirect(url_for('login'))
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limit('login')
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -255,34 +335,37 @@ def login():
     activate_form = ActivateAccountForm()
     
     if form.validate_on_submit():
-        login_input = form.login.data.lower()
         password = form.password.data
+        user = find_user_by_login(form.login.data)
         
-        user = User.query.filter(
-            (User.email == login_input) | 
-            (User.phone == normalize_phone(login_input))
-        ).first()
+        # ✅ VÉRIFICATION WHATSAPP OBLIGATOIRE
+        if user and not user.whatsapp_verified:
+            flash('⚠️ Veuillez vérifier votre WhatsApp avant de vous connecter.', 'warning')
+            return redirect(url_for('verify_whatsapp_now', user_id=user.id))
         
-        if user:
-            # ✅ VÉRIFICATION WHATSAPP OBLIGATOIRE
-            if not user.whatsapp_verified:
-                flash('⚠️ Veuillez vérifier votre WhatsApp avant de vous connecter.', 'warning')
-                return redirect(url_for('verify_whatsapp_now', user_id=user.id))
+        # Connexion SQL rendue au pool pendant le hachage, lent par construction
+        db.session.close()
+        try:
+            # Utilisateur inconnu : hachage factice, même temps de réponse
+            valid = verify_password(user, password)
+        except LoginBusy:
+            flash('⏳ Trop de connexions en cours, réessayez dans quelques secondes.', 'warning')
+            return (render_template('login.html', form=form, activate_form=activate_form), 503,
+                    {'Retry-After': str(LOGIN_CONFIG['retry_after'])})
+        
+        if valid:
+            login_user(user, remember=form.remember_me.data)
+            flash(f'Bienvenue {user.first_name}!', 'success')
             
-            if user.check_password(password):
-                login_user(user, remember=form.remember_me.data)
-                flash(f'Bienvenue {user.first_name}!', 'success')
-                
-                next_page = request.args.get('next')
-                return redirect(next_page) if next_page else redirect(url_for('index'))
-            else:
-                flash('Email/téléphone ou mot de passe incorrect.', 'danger')
+            next_page = request.args.get('next')
+            return redirect(next_page) if next_page else redirect(url_for('index'))
         else:
             flash('Email/téléphone ou mot de passe incorrect.', 'danger')
     
     return render_template('login.html', form=form, activate_form=activate_form)
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
+@rate_limit('forgot_password')
 def forgot_password():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -296,9 +379,8 @@ def forgot_password():
             reset_token = secrets.token_urlsafe(32)
             user.reset_token = reset_token
             user.reset_token_expires = datetime.now(timezone.utc) + timedelta(hours=1)
+            enqueue_email(user.email, *render_password_reset_email(user, reset_token))
             db.session.commit()
-            
-            send_password_reset_email(user, reset_token)
         
         flash('✅ Si cet email existe, un lien de réinitialisation a été envoyé.', 'success')
         return redirect(url_for('login'))
@@ -344,22 +426,23 @@ def logout():
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
+    user = get_user_record(current_user)
     form = ProfileUpdateForm(
-        original_email=current_user.email,
-        original_phone=current_user.phone,
-        obj=current_user
+        original_email=user.email,
+        original_phone=user.phone,
+        obj=user
     )
     
     if form.validate_on_submit():
         try:
-            current_user.first_name = form.first_name.data
-            current_user.last_name = form.last_name.data
-            current_user.email = form.email.data.lower()
+            user.first_name = form.first_name.data
+            user.last_name = form.last_name.data
+            user.email = form.email.data.lower()
             
             new_phone = normalize_phone(form.phone.data)
-            if current_user.phone != new_phone:
-                current_user.phone = new_phone
-                current_user.whatsapp_verified = False
+            if user.phone != new_phone:
+                user.phone = new_phone
+                user.whatsapp_verified = False
                 flash('⚠️ Numéro modifié. Veuillez vérifier votre nouveau WhatsApp.', 'warning')
             
             db.session.commit()
@@ -370,7 +453,7 @@ def profile():
             db.session.rollback()
             flash(f'Erreur: {str(e)}', 'danger')
     
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter_by(user_id=user.id).order_by(Order.created_at.desc()).all()
     
     return render_template('profile.html', form=form, orders=orders)
 
@@ -378,16 +461,16 @@ def profile():
 @login_required
 def generate_whatsapp_token():
     try:
-        current_user.generate_activation_token()
+        user = get_user_record(current_user)
+        user.generate_activation_token()
+        whatsapp_url = activation_whatsapp_link(user)
         db.session.commit()
         
-        whatsapp_url = send_activation_whatsapp(current_user)
-        
         return jsonify({
             'success': True,
             'message': '✅ Token généré! WhatsApp ouvert.',
             'whatsapp_url': whatsapp_url,
-            'token': current_user.activation_token
+            'token': user.activation_token
         })
     except Exception as e:
         return jsonify({
@@ -422,20 +505,10 @@ def admin_users():
     
     return render_template('admin_users.html', users=users, search_query=search_query)
 
-@app.route('/admin/orders')
-@login_required
-def admin_orders():
-    if not current_user.is_admin:
-        flash('Accès non autorisé.', 'danger')
-        return redirect(url_for('index'))
-
-    search_query = request.args.get('search', '').strip()
-    status_filter = request.args.get('status', '')
-
-    query = Order.query.options(joinedload(Order.customer))
-    
+def filter_orders(query, search_query, status_filter):
+    """Applique les filtres recherche/statut de l'admin à une requête sur Order"""
     if search_query:
-        query = query.join(User).filter(
+        query = query.join(User, Order.user_id == User.id).filter(
             db.or_(
                 Order.whatsapp_order_id.ilike(f'%{search_query}%'),
                 Order.order_number.ilike(f'%{search_query}%'),
@@ -448,30 +521,232 @@ def admin_orders():
     if status_filter:
         query = query.filter(Order.status == status_filter)
     
-    orders = query.order_by(Order.created_at.desc()).all()
+    return query
+
+def compute_order_stats(search_query='', status_filter=''):
+    """Statistiques des commandes en une seule agrégation GROUP BY status"""
+    query = db.session.query(
+        Order.status,
+        db.func.count(Order.id),
+        db.func.coalesce(db.func.sum(Order.total_amount), 0)
+    ).select_from(Order)
     
-    total_orders = len(orders)
-    total_sales = sum(order.total_amount for order in orders)
-    pending_orders = sum(1 for order in orders if order.status == 'en_attente')
-    confirmed_orders = sum(1 for order in orders if order.status == 'confirme')
-    preparation_orders = sum(1 for order in orders if order.status == 'preparation')
-    delivered_orders = sum(1 for order in orders if order.status == 'livree')
+    rows = filter_orders(query, search_query, status_filter).group_by(Order.status).all()
     
     stats = {
-        'total': total_orders,
-        'en_attente': pending_orders,
-        'confirme': confirmed_orders,
-        'preparation': preparation_orders,
-        'livree': delivered_orders,
-        'total_sales': total_sales
+        'total': 0,
+        'en_attente': 0,
+        'confirme': 0,
+        'preparation': 0,
+        'livree': 0,
+        'annulee': 0,
+        'total_sales': 0
     }
+    for status, count, sales in rows:
+        stats['total'] += count
+        stats['total_sales'] += sales
+        if status in stats:
+            stats[status] = count
+    
+    return stats
+
+@app.route('/admin/orders')
+@login_required
+def admin_orders():
+    if not current_user.is_admin:
+        flash('Accès non autorisé.', 'danger')
+        return redirect(url_for('index'))
+
+    search_query = request.args.get('search', '').strip()
+    status_filter = request.args.get('status', '')
+
+    cursor = request.args.get('cursor', '')
+    limit = parse_limit(request.args.get('limit'))
+
+    query = filter_orders(Order.query.options(joinedload(Order.customer)), search_query, status_filter)
+    
+    # Pagination par curseur sur (created_at, id) : coût constant quelle que soit la page
+    if cursor:
+        try:
+            created_at, order_id = decode_cursor(cursor, 2)
+            created_at = datetime.fromisoformat(created_at)
+        except (InvalidCursor, TypeError, ValueError):
+            flash('Lien de pagination invalide.', 'warning')
+            return redirect(url_for('admin_orders', search=search_query, status=status_filter))
+        query = query.filter(db.tuple_(Order.created_at, Order.id) < (created_at, order_id))
+    
+    orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor([orders[-1].created_at.isoformat(), orders[-1].id])
+    
+    stats = compute_order_stats(search_query, status_filter)
 
     return render_template('admin_orders.html', 
                          orders=orders, 
                          stats=stats,
+                         next_cursor=next_cursor,
+                         is_first_page=not cursor,
                          search_query=search_query,
                          status_filter=status_filter)
 
+@app.route('/admin/api/orders/<int:order_id>')
+@login_required
+def api_order_details(order_id):
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    # Client et articles chargés dans la même requête
+    order = Order.query.options(
+        joinedload(Order.customer),
+        joinedload(Order.items)
+    ).filter(Order.id == order_id).first()
+    
+    if not order:
+        return jsonify({'success': False, 'message': '❌ Commande non trouvée'}), 404
+    
+    return jsonify({'success': True, 'order': order.to_dict()})
+
+@app.route('/admin/api/orders/stats')
+@login_required
+def api_order_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    stats = compute_order_stats(
+        request.args.get('search', '').strip(),
+        request.args.get('status', '')
+    )
+    
+    return jsonify({'success': True, 'stats': stats})
+
+@app.route('/admin/api/outbox/stats')
+@login_required
+def api_outbox_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    return jsonify({'success': True, 'stats': outbox_stats()})
+
+@app.route('/admin/api/outbox/requeue', methods=['POST'])
+@login_required
+def api_outbox_requeue():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    count = requeue_dead_messages()
+    return jsonify({'success': True, 'message': f'✅ {count} message(s) remis en file', 'requeued': count})
+
+@app.route('/admin/api/short-links/stats')
+@login_required
+def api_short_link_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    return jsonify({'success': True, 'stats': short_link_stats()})
+
+@app.route('/admin/api/whatsapp/stats')
+@login_required
+def api_whatsapp_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    return jsonify({'success': True, 'stats': whatsapp_delivery_stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métriques au format texte Prometheus (jeton METRICS_TOKEN, ou accès local en mode debug)"""
+    if not metrics_allowed():
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+@login_required
+def admin_profiles():
+    if not current_user.is_admin:
+        flash('Accès non autorisé.', 'danger')
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        try:
+            sample_every = max(0, int(request.form.get('sample_every', '0')))
+        except ValueError:
+            flash('Valeur d\'échantillonnage invalide.', 'danger')
+            return redirect(url_for('admin_profiles'))
+        # Réglage du processus courant (un par worker gunicorn)
+        PROFILER_CONFIG['sample_every'] = sample_every
+        if sample_every:
+            flash(f'✅ Une requête sur {sample_every} sera profilée.', 'success')
+        else:
+            flash('✅ Échantillonnage désactivé.', 'success')
+        return redirect(url_for('admin_profiles'))
+    
+    return render_template('admin_profiles.html',
+                         profiles=list_profiles(),
+                         profiler_config=PROFILER_CONFIG,
+                         stats=profiler_stats)
+
+@app.route('/admin/profiles/<profile_id>')
+@login_required
+def download_profile(profile_id):
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    profile = get_profile(profile_id)
+    if not profile:
+        return jsonify({'success': False, 'message': '❌ Profil non trouvé'}), 404
+    
+    return send_from_directory(PROFILER_CONFIG['directory'], profile['file'], as_attachment=True)
+
+@app.route('/admin/api/rate-limit/stats')
+@login_required
+def api_rate_limit_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    return jsonify({'success': True, 'stats': rate_limit_stats()})
+
+@app.route('/admin/api/user-cache/stats')
+@login_required
+def api_user_cache_stats():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    return jsonify({'success': True, 'stats': user_cache_stats()})
+
+@app.route('/admin/export-invoices')
+@login_required
+def export_invoices():
+    """Archive ZIP des factures d'une période (rendu parallèle, envoi en flux)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Non autorisé'}), 403
+    
+    try:
+        start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d')
+        end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates invalides (format AAAA-MM-JJ)'}), 400
+    
+    if end < start:
+        return jsonify({'success': False, 'message': 'La date de fin précède la date de début'}), 400
+    
+    status_filter = request.args.get('status', '')
+    # Date de fin incluse
+    query = filter_orders(Order.query, '', status_filter).filter(
+        Order.created_at >= start,
+        Order.created_at < end + timedelta(days=1)
+    )
+    
+    filename = f"factures-{start:%Y%m%d}-{end:%Y%m%d}{'-' + status_filter if status_filter else ''}.zip"
+    response = Response(
+        stream_with_context(stream_invoice_zip(iter_export_orders(query))),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 # --- ROUTES ADMIN PRODUITS ---
 
 @app.route('/admin/products')
@@ -489,7 +764,7 @@ def admin_products():
     query = Product.query.options(joinedload(Product.category_ref))
     
     if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%'))
+        query = apply_product_search(query, search_query)
     
     if category_filter:
         query = query.filter(Product.category_id == int(category_filter))
@@ -531,17 +806,25 @@ def admin_categories():
     
     categories = Category.query.order_by(Category.name).all()
     
+    # Produits par catégorie en une agrégation (pas de chargement de category.products)
+    product_counts = dict(
+        db.session.query(Product.category_id, db.func.count(Product.id))
+        .group_by(Product.category_id).all()
+    )
+    
     # Statistiques
     total_categories = len(categories)
     active_categories = sum(1 for c in categories if c.is_active)
     
     stats = {
         'total': total_categories,
-        'active': active_categories
+        'active': active_categories,
+        'products': sum(product_counts.get(c.id, 0) for c in categories)
     }
     
     return render_template('admin_categories.html', 
                          categories=categories,
+                         product_counts=product_counts,
                          stats=stats)
 
 # API Routes pour produits
@@ -576,6 +859,7 @@ def api_create_product():
         
         db.session.add(product)
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -618,6 +902,7 @@ def api_update_product(product_id):
             product.is_available = bool(data['is_available'])
         
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -647,6 +932,7 @@ def api_delete_product(product_id):
         
         db.session.delete(product)
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -683,6 +969,7 @@ def api_create_category():
         
         db.session.add(category)
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -722,6 +1009,7 @@ def api_update_category(category_id):
             category.is_active = bool(data['is_active'])
         
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -751,6 +1039,7 @@ def api_delete_category(category_id):
         
         db.session.delete(category)
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -795,10 +1084,9 @@ def admin_activate_user():
     
     if user:
         user.whatsapp_verified = True
+        notify_whatsapp(user.phone, format_activation_confirmation_message(user), 'activation')
         db.session.commit()
         
-        send_activation_confirmation_whatsapp(user)
-        
         return jsonify({
             'success': True,
             'message': f'✅ WhatsApp de {user.first_name} {user.last_name} vérifié!'
@@ -823,11 +1111,18 @@ def confirm_order(order_id):
             'message': '❌ Commande non trouvée'
         }), 404
     
-    order.status = 'confirme'
+    try:
+        changed_products = change_order_status(order, 'confirme')
+    except OutOfStock as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'❌ Stock insuffisant: {", ".join(e.product_names)}'
+        }), 409
     order.admin_confirmed_at = datetime.now(timezone.utc)
+    notify_whatsapp(order.customer.phone, format_order_confirmation_message(order.customer, order), 'commande')
     db.session.commit()
-    
-    send_order_confirmation_whatsapp(order.customer, order)
+    catalog_cache.discard_products(changed_products)
     
     return jsonify({
         'success': True,
@@ -846,11 +1141,19 @@ def update_order_status(order_id):
     if not new_status:
         return jsonify({'success': False, 'message': 'Statut manquant'}), 400
     
-    order.status = new_status
+    try:
+        changed_products = change_order_status(order, new_status)
+    except OutOfStock as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'❌ Stock insuffisant: {", ".join(e.product_names)}'
+        }), 409
     if new_status == 'confirme' and not order.admin_confirmed_at:
         order.admin_confirmed_at = datetime.now(timezone.utc)
     
     db.session.commit()
+    catalog_cache.discard_products(changed_products)
     
     return jsonify({
         'success': True,
@@ -887,24 +1190,115 @@ def index():
     search_query = request.args.get('search', '').strip()
     category_filter = request.args.get('category', '')
     
-    # Construction de la requête
-    query = Product.query.filter_by(is_available=True).options(joinedload(Product.category_ref))
-    
-    if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%'))
-    
-    if category_filter:
-        query = query.filter(Product.category_id == int(category_filter))
-    
-    products = query.all()
-    categories = Category.query.filter_by(is_active=True).all()
+    def load_products():
+        query = Product.query.filter_by(is_available=True).options(joinedload(Product.category_ref))
+        
+        if search_query:
+            query = apply_product_search(query, search_query)
+        
+        if category_filter:
+            query = query.filter(Product.category_id == int(category_filter))
+        
+        return [product.to_dict() for product in query.all()]
+    
+    def load_categories():
+        return [
+            {'id': c.id, 'name': c.name, 'icon': c.icon}
+            for c in Category.query.filter_by(is_active=True).all()
+        ]
+    
+    # Catalogue servi depuis le cache (invalidé par les routes admin)
+    products = catalog_cache.get_products(search_query, category_filter, load_products)
+    categories = catalog_cache.get_categories(load_categories)
+    products_html = catalog_cache.get_fragment(
+        search_query, category_filter, current_user.is_authenticated,
+        lambda: render_template('_product_cards.html',
+                                products=products,
+                                search_query=search_query,
+                                category_filter=category_filter),
+        [product['id'] for product in products]
+    )
     
     return render_template('index.html', 
                          products=products, 
+                         products_html=products_html,
                          categories=categories,
                          search_query=search_query,
                          category_filter=category_filter)
 
+# Champs exposés par l'API catalogue (sous-ensemble de Product.to_dict)
+PRODUCT_API_FIELDS = (
+    'id', 'name', 'description', 'price', 'unit', 'category', 'category_id',
+    'category_ref', 'image_url', 'stock', 'is_available', 'created_at', 'updated_at'
+)
+
+@app.route('/api/products')
+def api_products():
+    """Catalogue JSON paginé par curseur, avec ETag fort et réponses 304"""
+    search_query = request.args.get('search', '').strip()
+    category_filter = request.args.get('category', '')
+    cursor = request.args.get('cursor', '')
+    limit = parse_limit(request.args.get('limit'))
+    
+    fields = tuple(f for f in request.args.get('fields', '').split(',') if f)
+    unknown_fields = [f for f in fields if f not in PRODUCT_API_FIELDS]
+    if unknown_fields:
+        return jsonify({
+            'success': False,
+            'message': f'Champs inconnus: {", ".join(unknown_fields)}'
+        }), 400
+    
+    if category_filter and not category_filter.isdigit():
+        return jsonify({'success': False, 'message': 'Catégorie invalide'}), 400
+    
+    try:
+        after_id = decode_cursor(cursor, 1)[0] if cursor else None
+    except InvalidCursor:
+        return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+    if after_id is not None and not isinstance(after_id, int):
+        return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+    
+    def load_page():
+        query = Product.query.filter_by(is_available=True).options(joinedload(Product.category_ref))
+        
+        if search_query:
+            query = apply_product_search(query, search_query, ranked=False)
+        
+        if category_filter:
+            query = query.filter(Product.category_id == int(category_filter))
+        
+        if after_id is not None:
+            query = query.filter(Product.id > after_id)
+        
+        rows = query.order_by(Product.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        products = []
+        for product in rows:
+            data = product.to_dict()
+            products.append({f: data[f] for f in fields} if fields else data)
+        
+        body = json.dumps({
+            'success': True,
+            'products': products,
+            'next_cursor': encode_cursor([rows[-1].id]) if has_more else None
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        
+        return body, hashlib.sha256(body).hexdigest()[:32], [product.id for product in rows]
+    
+    body, etag, _ = catalog_cache.get_or_load(
+        ('api_products', search_query, category_filter, after_id, limit, fields),
+        load_page,
+        lambda page: page[2]
+    )
+    
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Le client garde sa copie mais revalide à chaque fois (304 si inchangé)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/cart')
 @login_required
 def cart():
@@ -919,115 +1313,107 @@ def download_invoice(order_id):
         flash('Accès non autorisé.', 'danger')
         return redirect(url_for('index'))
     
-    pdf_buffer = generate_invoice_pdf(order, order.customer)
+    pdf_path, etag = get_invoice_pdf(order, order.customer)
     
-    return send_file(
-        pdf_buffer,
+    # conditional=True : If-None-Match → 304 sans relire le fichier
+    response = send_file(
+        pdf_path,
         as_attachment=True,
         download_name=f'facture-{order.whatsapp_order_id}.pdf',
-        mimetype='application/pdf'
+        mimetype='application/pdf',
+        conditional=True,
+        etag=etag
     )
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-# --- ROUTE CORRIGÉE POUR WHATSAPP ---
-@app.route('/api/send-order-whatsapp', methods=['POST'])
-@login_required
-def send_order_whatsapp():
-    if not current_user.whatsapp_verified:
-        return jsonify({
-            'success': False,
-            'message': '❌ Veuillez vérifier votre WhatsApp avant de commander',
-            'redirect': url_for('profile')
-        }), 403
-    
-    data = request.get_json()  # CORRECTION: utiliser get_json() au lieu de .json
-    print(f"📦 Données reçues: {data}")  # Debug
-    
+def create_order_from_cart(user, data, idempotency_record=None):
+    """
+    Crée une commande à partir du panier envoyé par le client.
+    Retourne (payload, status_code). Si une clé d'idempotence est fournie,
+    la réponse est enregistrée dans la même transaction que la commande.
+    """
     if not data:
-        return jsonify({
+        return {
             'success': False,
             'message': 'Données manquantes'
-        }), 400
+        }, 400
+    
+    if not isinstance(data, dict) or not isinstance(data.get('items', []), list):
+        return {
+            'success': False,
+            'message': 'Panier invalide'
+        }, 400
     
     cart_items = data.get('items', [])
     delivery_address = data.get('delivery_address', '')
     notes = data.get('notes', '')
     
     if not cart_items:
-        return jsonify({
+        return {
             'success': False,
             'message': 'Panier vide'
-        }), 400
+        }, 400
     
     try:
-        # Créer la commande
-        order = Order(user_id=current_user.id)
-        order.generate_order_number()
-        order.generate_whatsapp_order_id()
-        order.delivery_address = delivery_address
-        order.notes = notes
-        
-        total = 0
-        items_added = 0
+        # Chiffrage du panier : une seule requête pour tous les produits
+        quote = price_cart(cart_items)
         
-        for item in cart_items:
-            product_id = item.get('product_id')
-            if not product_id:
-                continue
-                
-            product = Product.query.get(product_id)
-            if not product or not product.is_available:
-                print(f"❌ Produit non disponible: {product_id}")
-                continue
-            
-            try:
-                quantity = float(item.get('quantity', 0))
-                if quantity <= 0:
-                    continue
-            except (ValueError, TypeError):
-                print(f"❌ Quantité invalide: {item.get('quantity')}")
-                continue
-
-            subtotal = quantity * product.price
-            total += subtotal
-            
-            order_item = OrderItem(
-                product_id=product.id,
-                product_name=product.name,
-                quantity=quantity,
-                unit_price=product.price,
-                subtotal=subtotal
-            )
-            order.items.append(order_item)
-            items_added += 1
+        for rejected in quote.rejected:
+            app.logger.debug("Ligne ignorée: %s (%s)", rejected['product_id'], rejected['reason'])
         
         # Vérifier qu'au moins un article a été ajouté
-        if items_added == 0:
-            return jsonify({
+        if quote.is_empty:
+            return {
                 'success': False,
                 'message': 'Aucun produit valide dans le panier'
-            }), 400
+            }, 400
         
-        order.total_amount = total
-        order.status = 'en_attente'
+        # Réservation atomique du stock (annulée avec la transaction en cas d'échec)
+        reserved_products = reserve_stock([(line.product_id, line.quantity) for line in quote.lines])
         
-        db.session.add(order)
-        db.session.commit()
+        # Créer la commande
+        order = Order(user_id=user.id)
+        order.generate_order_number()
+        order.generate_whatsapp_order_id()
+        order.delivery_address = delivery_address
+        order.notes = notes
+        order.items.extend(quote.build_order_items())
+        order.total_amount = quote.total
+        order.status = 'en_attente'
+        order.stock_reserved = True
         
-        # Générer le lien WhatsApp APRÈS la création de la commande
-        whatsapp_url = generate_order_whatsapp_link(
-            cart_items, total, current_user, 
+        # Lien WhatsApp court vers le récapitulatif (prix serveur), enregistré avec la commande
+        message = format_order_whatsapp_message(
+            [line.to_dict() for line in quote.lines], quote.total, user, 
             order.whatsapp_order_id, delivery_address, notes
         )
+        whatsapp_url = short_link_url(create_short_link(ADMIN_WHATSAPP_PHONE, message, 'commande'))
         
-        print(f"✅ Commande créée: {order.whatsapp_order_id}")
-        print(f"🔗 Lien WhatsApp: {whatsapp_url}")
-        
-        return jsonify({
+        payload = {
             'success': True,
             'message': f'✅ WhatsApp ouvert! ID de commande: {order.whatsapp_order_id}',
             'whatsapp_url': whatsapp_url,
             'order_id': order.whatsapp_order_id
-        })
+        }
+        
+        db.session.add(order)
+        if idempotency_record is not None:
+            complete_idempotency_key(idempotency_record, payload, 200)
+        db.session.commit()
+        # Seules les entrées du catalogue contenant ces produits sont périmées
+        catalog_cache.discard_products(reserved_products)
+        
+        app.logger.info("Commande créée: %s", payload['order_id'])
+        
+        return payload, 200
+    
+    except OutOfStock as e:
+        db.session.rollback()
+        return {
+            'success': False,
+            'message': f'❌ Stock insuffisant: {", ".join(e.product_names)}'
+        }, 409
     
     except Exception as e:
         db.session.rollback()
@@ -1035,10 +1421,67 @@ def send_order_whatsapp():
         import traceback
         traceback.print_exc()
         
-        return jsonify({
+        return {
             'success': False,
             'message': f'Erreur lors de la création de commande: {str(e)}'
-        }), 500
+        }, 500
+
+# --- ROUTE CORRIGÉE POUR WHATSAPP ---
+@app.route('/api/send-order-whatsapp', methods=['POST'])
+@login_required
+@rate_limit('send_order')
+def send_order_whatsapp():
+    if not current_user.whatsapp_verified:
+        return jsonify({
+            'success': False,
+            'message': '❌ Veuillez vérifier votre WhatsApp avant de commander',
+            'redirect': url_for('profile')
+        }), 403
+    
+    data = request.get_json()  # CORRECTION: utiliser get_json() au lieu de .json
+    user = current_user._get_current_object()
+    
+    # Sans clé d'idempotence : comportement historique
+    idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+    if not idempotency_key:
+        payload, status_code = create_order_from_cart(user, data)
+        return jsonify(payload), status_code
+    
+    if len(idempotency_key) > IDEMPOTENCY_CONFIG['max_key_length']:
+        return jsonify({'success': False, 'message': 'Clé d\'idempotence trop longue'}), 400
+    
+    try:
+        record, stored = claim_idempotency_key(user.id, idempotency_key, request_fingerprint(data))
+    except IdempotencyConflict as e:
+        response = jsonify({'success': False, 'message': f'❌ {e.message}'})
+        if e.status_code == 409:
+            response.headers['Retry-After'] = '1'
+        return response, e.status_code
+    
+    # Requête rejouée : réponse enregistrée, sans toucher aux produits ni aux commandes
+    if stored is not None:
+        payload, status_code = stored
+        response = jsonify(payload)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, status_code
+    
+    payload, status_code = create_order_from_cart(user, data, idempotency_record=record)
+    if status_code != 200:
+        # Échec : la clé est libérée pour permettre un nouvel essai
+        release_idempotency_key(record)
+    
+    return jsonify(payload), status_code
+
+@app.route('/api/cart/quote', methods=['POST'])
+@login_required
+def api_cart_quote():
+    """Chiffre le panier aux prix actuels sans créer de commande"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or not isinstance(data.get('items', []), list):
+        return jsonify({'success': False, 'message': 'Panier invalide'}), 400
+    quote = price_cart(data.get('items', []))
+    
+    return jsonify({'success': True, **quote.to_dict()})
 
 # Route de débogage
 @app.route('/debug/cart', methods=['POST'])
@@ -1055,6 +1498,17 @@ def initialize_database():
         try:
             print("🔧 Tentative de création des tables...")
             db.create_all()
+            for column in upgrade_schema(db.engine):
+                print(f"✅ Colonne ajoutée: {column}")
+            fixed, conflicts = normalize_stored_phones()
+            if fixed:
+                print(f"✅ Numéros normalisés (E.164): {fixed}")
+            for user_id, phone, canonical in conflicts:
+                print(f"⚠️ Numéro {phone} (utilisateur {user_id}) en double avec {canonical}: non modifié")
+            # Index ajoutés après coup sur des tables déjà existantes
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
             print("✅ Tables créées avec succès")
             
             # Créer l'admin
@@ -1134,6 +1588,12 @@ def initialize_database():
                 print("✅ Produits de démonstration ajoutés")
             
             db.session.commit()
+            
+            # Index de recherche (base existante créée avant l'index)
+            if search_index_is_empty() and Product.query.count() > 0:
+                indexed = rebuild_search_index()
+                print(f"✅ Index de recherche reconstruit ({indexed} produits)")
+            
             print("🎉 Base de données initialisée avec succès!")
             
         except Exception as e:
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import os
+import secrets
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import User, normalize_phone
+
+# Configuration de la vérification des mots de passe à la connexion
+LOGIN_CONFIG = {
+    # Hachages simultanés au plus (scrypt libère le GIL : un cœur chacun)
+    'hash_workers': int(os.environ.get('LOGIN_HASH_WORKERS', os.cpu_count() or 2)),
+    # Vérifications en attente au-delà desquelles la connexion est refusée (503)
+    'max_waiting': 32,
+    'wait_timeout': 10,  # secondes
+    'retry_after': 2     # secondes, annoncées au client refusé
+}
+
+
+class LoginBusy(Exception):
+    """Trop de vérifications de mot de passe en cours : réessayer plus tard"""
+
+
+_hash_pool = None
+_hash_slots = threading.BoundedSemaphore(LOGIN_CONFIG['hash_workers'] + LOGIN_CONFIG['max_waiting'])
+_pool_lock = threading.Lock()
+_dummy_hash = None
+login_stats = {'verified': 0, 'rejected_busy': 0, 'hash_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+def find_user_by_login(login_input):
+    """
+    Un email passe par l'index email, tout le reste par l'index phone
+    (pas de OR entre les deux colonnes, que PostgreSQL lit en parcours complet).
+    """
+    login_input = login_input.strip()
+    if '@' in login_input:
+        return User.query.filter_by(email=login_input.lower()).first()
+    return User.query.filter_by(phone=normalize_phone(login_input)).first()
+
+
+def _get_hash_pool():
+    global _hash_pool, _dummy_hash
+    with _pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ThreadPoolExecutor(max_workers=LOGIN_CONFIG['hash_workers'],
+                                            thread_name_prefix='koasa-hash')
+            _dummy_hash = generate_password_hash(secrets.token_hex(16))
+        return _hash_pool
+
+
+def _check(password_hash, password):
+    started = time.perf_counter()
+    try:
+        return check_password_hash(password_hash, password)
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats_lock:
+            login_stats['hash_seconds'] += elapsed
+
+
+def verify_password(user, password):
+    """
+    Vérifie le mot de passe dans le pool de hachage borné. Un utilisateur
+    inconnu (user=None) coûte un hachage factice : même durée de réponse.
+    Lève LoginBusy si la file d'attente est pleine.
+    """
+    pool = _get_hash_pool()
+    if not _hash_slots.acquire(blocking=False):
+        with _stats_lock:
+            login_stats['rejected_busy'] += 1
+        raise LoginBusy()
+
+    password_hash = user.password_hash if user is not None and user.password_hash else _dummy_hash
+    try:
+        future = pool.submit(_check, password_hash, password)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+
+    try:
+        valid = future.result(timeout=LOGIN_CONFIG['wait_timeout'])
+    except FutureTimeout:
+        with _stats_lock:
+            login_stats['rejected_busy'] += 1
+        raise LoginBusy()
+    with _stats_lock:
+        login_stats['verified'] += 1
+    return valid and user is not None
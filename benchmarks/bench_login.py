@@ -0,0 +1,210 @@
+# benchmarks/bench_login.py
+"""
+Latence de connexion (p50 / p95 / p99) : ancienne recherche (email OR phone,
+hachage dans le thread de la requête) contre la recherche routée par index
+et le pool de hachage borné (auth.py).
+
+    python benchmarks/bench_login.py --users 5000 --logins 2000 --threads 32
+    python benchmarks/bench_login.py --threads 32 --pool-size 5   # pool SQL par défaut de SQLAlchemy
+    python benchmarks/bench_login.py --database-url postgresql://localhost/koasa_bench --explain
+
+Les connexions mélangent emails, numéros sous plusieurs formes, mauvais mots
+de passe et comptes inconnus. --explain affiche le plan des deux requêtes.
+Le nouveau chemin rend la connexion SQL au pool avant de hacher.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+import auth
+from models import db, User
+
+PASSWORD = 'bench-password'
+
+
+def create_bench_app(database_url, pool_size):
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    # L'ancien chemin garde sa connexion pendant tout le hachage
+    bench_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': pool_size, 'max_overflow': 0,
+                                                     'pool_timeout': 120}
+    db.init_app(bench_app)
+    return bench_app
+
+
+def legacy_normalize_phone(phone):
+    phone = "".join(filter(str.isdigit, phone))
+    if phone.startswith('00226'):
+        return '+' + phone[2:]
+    elif phone.startswith('226'):
+        return '+' + phone
+    elif len(phone) == 8:
+        return '+226' + phone
+    return phone
+
+
+def legacy_login(login_input, password):
+    login_input = login_input.lower()
+    user = User.query.filter(
+        (User.email == login_input) | (User.phone == legacy_normalize_phone(login_input))
+    ).first()
+    return bool(user and user.check_password(password))
+
+
+def routed_login(login_input, password):
+    user = auth.find_user_by_login(login_input)
+    db.session.close()
+    return auth.verify_password(user, password)
+
+
+def seed(bench_app, users):
+    with bench_app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(db.insert(User), [
+            {'email': f'client{i}@koasa.bf', 'phone': f'+2267{i:07d}', 'first_name': 'Client',
+             'last_name': str(i), 'password_hash': password_hash, 'whatsapp_verified': True}
+            for i in range(users)
+        ])
+        db.session.commit()
+
+
+def login_inputs(users, count, seed_value=42):
+    rng = random.Random(seed_value)
+    inputs = []
+    for _ in range(count):
+        i = rng.randrange(users)
+        kind = rng.random()
+        if kind < 0.4:
+            inputs.append((f'client{i}@koasa.bf', PASSWORD))
+        elif kind < 0.7:
+            inputs.append((f'7{i:07d}', PASSWORD))
+        elif kind < 0.8:
+            inputs.append((f'+226 7{i:07d}', PASSWORD))
+        elif kind < 0.9:
+            inputs.append((f'client{i}@koasa.bf', 'mauvais'))
+        else:
+            inputs.append((f'inconnu{i}@koasa.bf', PASSWORD))
+    return inputs
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(bench_app, login, inputs, threads):
+    latencies = []
+    rejected = []
+    lock = threading.Lock()
+    queue = list(inputs)
+
+    def worker():
+        with bench_app.app_context():
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    login_input, password = queue.pop()
+                started = time.perf_counter()
+                try:
+                    login(login_input, password)
+                except auth.LoginBusy:
+                    rejected.append(1)
+                    continue
+                finally:
+                    db.session.remove()
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'logins': len(latencies),
+        'rejected': len(rejected),
+        'seconds': elapsed,
+        'per_second': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+def explain(bench_app):
+    with bench_app.app_context():
+        postgres = db.engine.dialect.name == 'postgresql'
+        prefix = 'EXPLAIN' if postgres else 'EXPLAIN QUERY PLAN'
+        queries = {
+            'avant (OR)': "SELECT id FROM users WHERE email = 'client1@koasa.bf' OR phone = '+22670000001'",
+            'après (email)': "SELECT id FROM users WHERE email = 'client1@koasa.bf'",
+            'après (phone)': "SELECT id FROM users WHERE phone = '+22670000001'"
+        }
+        for label, query in queries.items():
+            rows = db.session.execute(text(f'{prefix} {query}')).all()
+            print(f"🔎 {label}: " + ' | '.join(str(row[-1]) for row in rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--logins', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--pool-size', type=int, default=None, help='connexions SQL (défaut : une par client)')
+    parser.add_argument('--hash-workers', type=int, default=None, help='défaut : LOGIN_HASH_WORKERS ou nombre de cœurs')
+    parser.add_argument('--database-url', default=None, help='défaut : SQLite temporaire')
+    parser.add_argument('--explain', action='store_true')
+    args = parser.parse_args()
+
+    if args.hash_workers:
+        auth.LOGIN_CONFIG['hash_workers'] = args.hash_workers
+        auth._hash_slots = threading.BoundedSemaphore(args.hash_workers + auth.LOGIN_CONFIG['max_waiting'])
+
+    database_url = args.database_url
+    tmpdir = None
+    if not database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    print(f"🔧 Base: {database_url.split('@')[-1]}")
+    print(f"🔧 {args.users} comptes, {args.logins} connexions, {args.threads} clients simultanés, "
+          f"{args.pool_size or args.threads} connexions SQL, "
+          f"{auth.LOGIN_CONFIG['hash_workers']} hachages simultanés (après)")
+
+    bench_app = create_bench_app(database_url, args.pool_size or args.threads)
+    seed(bench_app, args.users)
+    if args.explain:
+        explain(bench_app)
+
+    inputs = login_inputs(args.users, args.logins)
+    for label, login in (('avant', legacy_login), ('après', routed_login)):
+        result = run(bench_app, login, inputs, args.threads)
+        print(f"⏱️  {label:6} p50 {result['p50_ms']:7.1f} ms | p95 {result['p95_ms']:7.1f} ms | "
+              f"p99 {result['p99_ms']:7.1f} ms | {result['per_second']:6.1f} connexions/s | "
+              f"refusées (503): {result['rejected']}")
+
+    with bench_app.app_context():
+        db.drop_all()
+    if tmpdir:
+        tmpdir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
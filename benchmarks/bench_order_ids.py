@@ -0,0 +1,126 @@
+# benchmarks/bench_order_ids.py
+"""
+Débit du générateur d'identifiants de commande.
+
+    python benchmarks/bench_order_ids.py --orders 20000 --workers 8
+    python benchmarks/bench_order_ids.py --database-url postgresql://localhost/koasa_bench
+
+Crée des commandes réelles (order_number + whatsapp_order_id) depuis plusieurs
+threads et compte les violations d'unicité : le résultat attendu est 0.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Order
+
+
+def create_bench_app(database_url):
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    bench_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 20} if database_url.startswith('postgresql') else {}
+    db.init_app(bench_app)
+    return bench_app
+
+
+def run(bench_app, orders, workers, batch):
+    with bench_app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(email='bench@koasa.bf', phone='+22670000001', first_name='Bench',
+                    last_name='Mark', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    per_worker = orders // workers
+    collisions = []
+    errors = []
+
+    def worker():
+        with bench_app.app_context():
+            created = 0
+            while created < per_worker:
+                size = min(batch, per_worker - created)
+                try:
+                    for _ in range(size):
+                        order = Order(user_id=user_id, total_amount=0)
+                        order.generate_order_number()
+                        order.generate_whatsapp_order_id()
+                        db.session.add(order)
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    collisions.append(1)
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(str(e))
+                    # Verrou SQLite : on réessaie le lot
+                    continue
+                created += size
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with bench_app.app_context():
+        total = Order.query.count()
+        distinct = db.session.query(db.func.count(db.distinct(Order.whatsapp_order_id))).scalar()
+        db.drop_all()
+
+    return {
+        'orders': total,
+        'distinct_ids': distinct,
+        'seconds': elapsed,
+        'orders_per_second': total / elapsed if elapsed else 0,
+        'unique_violations': len(collisions),
+        'lock_retries': len(errors)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=50, help='commandes par transaction')
+    parser.add_argument('--database-url', default=None, help='défaut : SQLite temporaire')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    tmpdir = None
+    if not database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    print(f"🔧 Base: {database_url.split('@')[-1]}")
+    print(f"🔧 {args.orders} commandes, {args.workers} threads, lots de {args.batch}")
+
+    result = run(create_bench_app(database_url), args.orders, args.workers, args.batch)
+
+    print(f"📦 Commandes créées: {result['orders']} (identifiants distincts: {result['distinct_ids']})")
+    print(f"⏱️  Durée: {result['seconds']:.2f}s")
+    print(f"🚀 Débit: {result['orders_per_second']:,.0f} commandes/s")
+    print(f"{'✅' if result['unique_violations'] == 0 else '❌'} Violations d'unicité: {result['unique_violations']}")
+    if result['lock_retries']:
+        print(f"ℹ️  Lots rejoués après verrou: {result['lock_retries']}")
+
+    if tmpdir:
+        tmpdir.cleanup()
+
+    return 0 if result['unique_violations'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
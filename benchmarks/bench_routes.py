@@ -0,0 +1,434 @@
+# benchmarks/bench_routes.py
+"""
+Test de charge des routes chaudes : débit, latence p50 / p95 / p99 et taux
+d'erreur par scénario, enregistrés en JSON.
+
+    python benchmarks/bench_routes.py --concurrency 16 --duration 20 --output bench.json
+    python benchmarks/bench_routes.py --database-url postgresql://localhost/koasa_bench
+    python benchmarks/bench_routes.py --compare main HEAD --output compare.json
+    python benchmarks/bench_routes.py --baseline bench-main.json --output bench.json
+
+Chaque révision est servie par gunicorn (--workers / --threads) depuis une
+copie temporaire du code : l'arbre de travail courant, ou le résultat de
+`git archive` pour --compare. La base est recréée et peuplée avant chaque
+série (SQLite temporaire par défaut ; une base PostgreSQL passée en
+--database-url est vidée : utiliser une base dédiée).
+
+Scénarios : index (/), search (/?search=), login (GET + POST /login, seul
+le POST est mesuré), order (/api/send-order-whatsapp), admin_orders
+(/admin/orders), invoice (/download-invoice/<id>). Chaque scénario tourne
+seul pendant --duration secondes avec --concurrency clients, après
+--warmup secondes non mesurées.
+
+Avec --compare ou --baseline, une hausse de p95 au-delà de --threshold
+(ou du taux d'erreur) est signalée et le script sort avec le code 1.
+Le générateur de charge partage la machine avec le serveur : comparer des
+révisions sur la même machine, pas des chiffres absolus entre machines.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+ADMIN_EMAIL = 'bench-admin@koasa.bf'
+SEARCH_TERMS = ['boeuf', 'mouton', 'poulet', 'gigot', 'filet', 'brochette', 'cote', 'chevre']
+PRODUCT_NAMES = ['Bœuf - Filet', 'Bœuf - Côte', 'Mouton - Gigot', 'Mouton - Brochette',
+                 'Poulet entier', 'Poulet - Cuisse', 'Chèvre - Épaule', 'Pintade']
+SCENARIOS = ('index', 'search', 'login', 'order', 'admin_orders', 'invoice')
+
+
+# --- Préparation : copie du code, base, serveur ---
+
+def export_tree(revision, destination):
+    """Copie le code de la révision (None : arbre de travail) dans destination"""
+    if revision is None:
+        shutil.copytree(REPO_DIR, destination, ignore=shutil.ignore_patterns(
+            '.git', 'instance', '__pycache__', '*.db', '.env*'), dirs_exist_ok=True)
+        return
+    archive = subprocess.run(['git', 'archive', '--format=tar', revision], cwd=REPO_DIR,
+                             check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(destination)
+
+
+def describe_revision(revision):
+    if revision is None:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return f'{head}{"+modifié" if dirty else ""}'
+    return subprocess.run(['git', 'rev-parse', '--short', revision], cwd=REPO_DIR,
+                          check=True, capture_output=True, text=True).stdout.strip()
+
+
+def server_env(app_dir, database_url):
+    env = dict(os.environ)
+    env.update({
+        'SECRET_KEY': 'bench-secret',
+        'INVOICE_CACHE_DIR': os.path.join(app_dir, 'invoices'),
+        'RATE_LIMIT_ENABLED': 'false',   # un seul client, des milliers de requêtes
+        'OUTBOX_WORKER': 'false',
+        'SMTP_SERVER': '127.0.0.1',      # envoi direct des anciennes révisions : échec immédiat
+        'SMTP_PORT': '9',
+        'WHATSAPP_TOKEN': ''
+    })
+    env.pop('DATABASE_URL', None)
+    if database_url:
+        env['DATABASE_URL'] = database_url  # sinon : SQLite dans <copie>/instance
+    return env
+
+
+def seed_database(args):
+    """Mode --seed : exécuté dans la copie du code (imports de la révision testée)"""
+    sys.path.insert(0, args.app_dir)
+    os.chdir(args.app_dir)
+    from werkzeug.security import generate_password_hash
+    from app import app, initialize_database
+    from models import db, User, Product, Category, Order, OrderItem
+
+    rng = random.Random(args.seed_value)
+    with app.app_context():
+        db.drop_all()
+        initialize_database()
+        password_hash = generate_password_hash(PASSWORD)
+
+        db.session.execute(db.insert(User), [
+            {'email': ADMIN_EMAIL, 'phone': '+22660000000', 'first_name': 'Bench', 'last_name': 'Admin',
+             'password_hash': password_hash, 'email_verified': True, 'whatsapp_verified': True, 'is_admin': True}
+        ] + [
+            {'email': f'client{i}@koasa.bf', 'phone': f'+2267{i:07d}', 'first_name': 'Client',
+             'last_name': str(i), 'password_hash': password_hash, 'email_verified': True,
+             'whatsapp_verified': True}
+            for i in range(args.customers)
+        ])
+        category_ids = [c.id for c in Category.query.all()]
+        db.session.execute(db.insert(Product), [
+            {'name': f'{rng.choice(PRODUCT_NAMES)} {i}', 'description': 'Produit de test de charge',
+             'price': rng.randrange(1000, 9000, 100), 'unit': 'kg', 'category_id': rng.choice(category_ids),
+             'stock': 10 ** 7, 'is_available': True}
+            for i in range(args.products)
+        ])
+        db.session.commit()
+
+        customers = dict(db.session.query(User.email, User.id).filter(User.email.like('client%@koasa.bf')))
+        products = db.session.query(Product.id, Product.name, Product.price).all()
+        db.session.execute(db.insert(Order), [
+            {'user_id': customers[f'client{i}@koasa.bf'], 'order_number': f'KO-BENCH-{i}-{n}',
+             'whatsapp_order_id': f'CMD-BENCH-{i}-{n}', 'total_amount': 0, 'status': 'confirme'}
+            for i in range(args.customers) for n in range(args.orders_per_customer)
+        ])
+        orders = db.session.query(Order.id, Order.user_id).filter(Order.order_number.like('KO-BENCH-%')).all()
+        items = []
+        for order_id, _ in orders:
+            for product_id, name, price in rng.sample(products, 3):
+                items.append({'order_id': order_id, 'product_id': product_id, 'product_name': name,
+                              'quantity': 1, 'unit_price': price, 'subtotal': price})
+        db.session.execute(db.insert(OrderItem), items)
+        db.session.execute(db.update(Order).values(total_amount=db.select(
+            db.func.sum(OrderItem.subtotal)).where(OrderItem.order_id == Order.id).scalar_subquery()))
+        db.session.commit()
+
+        try:
+            from search import rebuild_search_index
+            rebuild_search_index()  # produits insérés en masse, hors événements ORM
+        except ImportError:
+            pass
+
+        user_logins = {user_id: email for email, user_id in customers.items()}
+        orders_by_login = {}
+        for order_id, user_id in orders:
+            orders_by_login.setdefault(user_logins[user_id], []).append(order_id)
+
+    with open(args.seed_output, 'w', encoding='utf-8') as f:
+        json.dump({'products': [p[0] for p in products], 'orders': orders_by_login}, f)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_dir, env, args):
+    port = free_port()
+    log = open(os.path.join(app_dir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', 'app:app', '--chdir', app_dir, '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers), '--threads', str(args.threads), '--worker-class', 'gthread',
+        '--timeout', '120'
+    ], env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+
+    import urllib.request
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            urllib.request.urlopen(f'{base_url}/login', timeout=2).close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    with open(os.path.join(app_dir, 'gunicorn.log'), encoding='utf-8', errors='replace') as f:
+        print(f.read()[-2000:])
+    raise RuntimeError('Le serveur ne répond pas')
+
+
+# --- Charge ---
+
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+async def log_in(session, base_url, login):
+    async with session.get(f'{base_url}/login') as response:
+        html = await response.text()
+    match = CSRF_PATTERN.search(html)
+    data = {'login': login, 'password': PASSWORD, 'csrf_token': match.group(1) if match else ''}
+    started = time.perf_counter()
+    async with session.post(f'{base_url}/login', data=data, allow_redirects=False) as response:
+        await response.read()
+        return response.status, time.perf_counter() - started
+
+
+class Context:
+
+    def __init__(self, base_url, seed_info, rng):
+        self.base_url = base_url
+        self.products = seed_info['products']
+        self.orders = seed_info['orders']
+        self.logins = sorted(self.orders)
+        self.rng = rng
+
+
+async def timed_get(session, url, expected=200):
+    started = time.perf_counter()
+    async with session.get(url, allow_redirects=False) as response:
+        await response.read()
+        return response.status == expected, response.status, time.perf_counter() - started
+
+
+async def scenario_index(session, ctx, worker):
+    return await timed_get(session, f'{ctx.base_url}/')
+
+
+async def scenario_search(session, ctx, worker):
+    return await timed_get(session, f'{ctx.base_url}/?search={ctx.rng.choice(SEARCH_TERMS)}')
+
+
+async def scenario_login(session, ctx, worker):
+    session.cookie_jar.clear()  # connexion complète à chaque fois
+    status, elapsed = await log_in(session, ctx.base_url, ctx.rng.choice(ctx.logins))
+    return status == 302, status, elapsed
+
+
+async def scenario_order(session, ctx, worker):
+    items = [{'product_id': product_id, 'quantity': 1} for product_id in ctx.rng.sample(ctx.products, 2)]
+    started = time.perf_counter()
+    async with session.post(f'{ctx.base_url}/api/send-order-whatsapp', json={'items': items}) as response:
+        await response.read()
+        return response.status == 200, response.status, time.perf_counter() - started
+
+
+async def scenario_admin_orders(session, ctx, worker):
+    return await timed_get(session, f'{ctx.base_url}/admin/orders')
+
+
+async def scenario_invoice(session, ctx, worker):
+    order_id = ctx.rng.choice(ctx.orders[worker['login']])
+    return await timed_get(session, f'{ctx.base_url}/download-invoice/{order_id}')
+
+
+# Scénario → (fonction, compte connecté : 'customer', 'admin' ou None)
+SCENARIO_FUNCTIONS = {
+    'index': (scenario_index, None),
+    'search': (scenario_search, None),
+    'login': (scenario_login, None),
+    'order': (scenario_order, 'customer'),
+    'admin_orders': (scenario_admin_orders, 'admin'),
+    'invoice': (scenario_invoice, 'customer'),
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_scenario(name, ctx, concurrency, duration, warmup):
+    from aiohttp import ClientSession, ClientTimeout, CookieJar, TCPConnector
+
+    function, account = SCENARIO_FUNCTIONS[name]
+    latencies = []
+    statuses = {}
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def worker(index):
+        nonlocal errors
+        state = {'login': ctx.logins[index % len(ctx.logins)]}
+        async with ClientSession(cookie_jar=CookieJar(unsafe=True), connector=TCPConnector(limit=1),
+                                 timeout=ClientTimeout(total=60)) as session:
+            if account:
+                login = ADMIN_EMAIL if account == 'admin' else state['login']
+                status, _ = await log_in(session, ctx.base_url, login)
+                if status != 302:
+                    raise RuntimeError(f'Connexion impossible pour {login} ({status})')
+            while time.perf_counter() < deadline:
+                try:
+                    ok, status, elapsed = await function(session, ctx, state)
+                except Exception as e:
+                    ok, status, elapsed = False, type(e).__name__, 0.0
+                if time.perf_counter() < measure_from:
+                    continue
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': errors / total if total else 0.0,
+        'per_second': len(latencies) / duration,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'statuses': statuses
+    }
+
+
+def benchmark_revision(revision, args):
+    """Copie, peuple, sert et mesure une révision ; retourne le résultat JSON"""
+    label = describe_revision(revision)
+    with tempfile.TemporaryDirectory(prefix='koasa-bench-') as app_dir:
+        export_tree(revision, app_dir)
+        env = server_env(app_dir, args.database_url)
+        seed_output = os.path.join(app_dir, 'seed.json')
+        print(f"🌱 {label}: {args.customers} clients, {args.products} produits, "
+              f"{args.customers * args.orders_per_customer} commandes")
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), '--seed', '--app-dir', app_dir,
+            '--seed-output', seed_output, '--customers', str(args.customers), '--products', str(args.products),
+            '--orders-per-customer', str(args.orders_per_customer), '--seed-value', str(args.seed_value)
+        ], cwd=app_dir, env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(seed_output, encoding='utf-8') as f:
+            seed_info = json.load(f)
+
+        process, base_url = start_server(app_dir, env, args)
+        scenarios = {}
+        try:
+            for name in args.scenarios:
+                ctx = Context(base_url, seed_info, random.Random(args.seed_value))
+                result = asyncio.run(run_scenario(name, ctx, args.concurrency, args.duration, args.warmup))
+                scenarios[name] = result
+                print(f"⏱️  {label:12} {name:13} p50 {result['p50_ms']:8.1f} ms | p95 {result['p95_ms']:8.1f} ms | "
+                      f"p99 {result['p99_ms']:8.1f} ms | {result['per_second']:7.1f} req/s | "
+                      f"erreurs {result['error_rate']:.1%}")
+        finally:
+            process.terminate()
+            process.wait(30)
+
+    return {
+        'revision': label,
+        'database': 'postgresql' if (args.database_url or '').startswith('postgres') else 'sqlite',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'settings': {key: getattr(args, key) for key in (
+            'concurrency', 'duration', 'warmup', 'workers', 'threads', 'customers', 'products',
+            'orders_per_customer', 'seed_value')},
+        'scenarios': scenarios
+    }
+
+
+def compare_results(before, after, threshold):
+    """Affiche l'écart par scénario ; retourne la liste des régressions"""
+    regressions = []
+    print(f"\n📊 {before['revision']} → {after['revision']}")
+    for name, new in after['scenarios'].items():
+        old = before['scenarios'].get(name)
+        if old is None:
+            continue
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        throughput = (new['per_second'] - old['per_second']) / old['per_second'] if old['per_second'] else 0.0
+        regressed = change > threshold or new['error_rate'] > old['error_rate'] + 0.001
+        print(f"{'❌' if regressed else '✅'} {name:13} p95 {old['p95_ms']:8.1f} → {new['p95_ms']:8.1f} ms "
+              f"({change:+.0%}) | {old['per_second']:7.1f} → {new['per_second']:7.1f} req/s ({throughput:+.0%}) | "
+              f"erreurs {old['error_rate']:.1%} → {new['error_rate']:.1%}")
+        if regressed:
+            regressions.append({'scenario': name, 'p95_change': round(change, 4),
+                                'error_rate': new['error_rate']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='liste séparée par des virgules')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15, help='secondes mesurées par scénario')
+    parser.add_argument('--warmup', type=float, default=3, help='secondes non mesurées par scénario')
+    parser.add_argument('--workers', type=int, default=2, help='workers gunicorn')
+    parser.add_argument('--threads', type=int, default=4, help='threads par worker gunicorn')
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--products', type=int, default=300)
+    parser.add_argument('--orders-per-customer', type=int, default=5)
+    parser.add_argument('--seed-value', type=int, default=42)
+    parser.add_argument('--database-url', default=None, help='PostgreSQL (vidée !) ; défaut : SQLite temporaire')
+    parser.add_argument('--compare', nargs=2, metavar=('AVANT', 'APRÈS'), help='deux révisions git')
+    parser.add_argument('--baseline', help='résultat JSON de référence à comparer au run courant')
+    parser.add_argument('--threshold', type=float, default=0.10, help='hausse de p95 tolérée (0.10 = 10 %%)')
+    parser.add_argument('--output', help='fichier JSON de sortie')
+    # Usage interne : peuplement exécuté dans la copie du code
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--app-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--seed-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.seed:
+        seed_database(args)
+        return 0
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIO_FUNCTIONS]
+    if unknown:
+        parser.error(f"scénarios inconnus : {', '.join(unknown)}")
+
+    if args.compare:
+        runs = [benchmark_revision(revision, args) for revision in args.compare]
+        regressions = compare_results(runs[0], runs[1], args.threshold)
+        output = {'runs': runs, 'threshold': args.threshold, 'regressions': regressions}
+    else:
+        result = benchmark_revision(None, args)
+        regressions = []
+        output = result
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                regressions = compare_results(json.load(f), result, args.threshold)
+            output = dict(result, baseline=args.baseline, threshold=args.threshold, regressions=regressions)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+        print(f"💾 Résultats: {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# benchmarks/bench_smtp.py
+"""
+Débit d'envoi d'emails : une connexion SMTP par message (ancien send_email)
+contre le pool de connexions persistantes (smtp_pool.py).
+
+    pip install aiosmtpd
+    python benchmarks/bench_smtp.py --messages 500 --threads 8 --latency 20
+
+Le serveur est un aiosmtpd local (sans TLS ni authentification) ; --latency
+ajoute un délai à chaque commande SMTP pour simuler l'aller-retour réseau
+vers un vrai fournisseur. L'EHLO compte pour quatre allers-retours : il tient
+lieu de la séquence EHLO / STARTTLS / EHLO / AUTH d'une connexion neuve.
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_pool import SMTPConnectionPool
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class CountingHandler:
+    """Compte les messages reçus et simule la latence réseau"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    async def _delay(self, round_trips=1):
+        if self.latency:
+            await asyncio.sleep(self.latency * round_trips)
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self._lock:
+            self.connections += 1
+        session.host_name = hostname
+        await self._delay(round_trips=4)
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await self._delay()
+        envelope.mail_from = address
+        return '250 OK'
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await self._delay()
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        await self._delay()
+        with self._lock:
+            self.received += 1
+        return '250 Message accepted'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def build_message(index):
+    msg = MIMEText(f'<p>Code de vérification: {index:06d}</p>', 'html')
+    msg['From'] = 'KOASA <noreply@koasa.bf>'
+    msg['To'] = f'client{index}@koasa.bf'
+    msg['Subject'] = 'KOASA - Vérification de votre email'
+    return msg
+
+
+def send_with_new_connection(settings, msg):
+    """Comportement historique : connexion, EHLO, envoi, QUIT pour chaque message"""
+    server = smtplib.SMTP(settings['host'], settings['port'], timeout=10)
+    server.ehlo()
+    server.send_message(msg)
+    server.quit()
+
+
+def run(label, send, messages, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, [build_message(i) for i in range(messages)]))
+    elapsed = time.perf_counter() - start
+    print(f"🚀 {label:<28} {messages / elapsed:8.1f} emails/s ({elapsed:.2f}s)")
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=None, help='défaut : --threads')
+    parser.add_argument('--latency', type=float, default=10, help='ms ajoutées à chaque commande SMTP')
+    args = parser.parse_args()
+
+    if Controller is None:
+        print("❌ aiosmtpd n'est pas installé : pip install aiosmtpd")
+        return 1
+
+    handler = CountingHandler(args.latency / 1000)
+    port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    settings = {'host': '127.0.0.1', 'port': port,
+                'starttls': False, 'username': '', 'password': ''}
+
+    print(f"🔧 {args.messages} emails, {args.threads} threads, latence {args.latency:g} ms/commande")
+    try:
+        baseline = run('connexion par message', lambda msg: send_with_new_connection(settings, msg),
+                       args.messages, args.threads)
+        baseline_connections = handler.connections
+
+        pool_size = args.pool_size or args.threads
+        pool = SMTPConnectionPool(settings, max_connections=pool_size)
+        pooled = run(f'pool ({pool_size} connexions)', pool.send_message, args.messages, args.threads)
+        pool.close_all()
+        pool_connections = handler.connections - baseline_connections
+    finally:
+        controller.stop()
+
+    print(f"🔌 Connexions ouvertes: {baseline_connections} → {pool_connections}")
+    print(f"📈 Gain: x{pooled / baseline:.1f}")
+    expected = 2 * args.messages
+    print(f"{'✅' if handler.received == expected else '❌'} Messages reçus: {handler.received}/{expected}")
+    return 0 if handler.received == expected else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import threading
+import time
+
+# Configuration du cache catalogue
+CATALOG_CACHE_CONFIG = {
+    'max_entries': 256,
+    # Filet de sécurité si plusieurs processus servent l'application :
+    # chaque processus recharge au plus tard après ce délai (secondes)
+    'ttl': 300
+}
+
+
+class CatalogCache:
+    """
+    Cache versionné du catalogue (produits, catégories, fragments HTML).
+    Borné en taille avec éviction LRU, invalidé à chaque écriture admin.
+    Chaque entrée peut retenir les produits qu'elle contient : un mouvement
+    de stock n'invalide alors que les entrées de ces produits.
+    """
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 1
+        self._entries = OrderedDict()
+        # Chargements en cours : un discard() pendant le calcul empêche son stockage
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, stored_at, value, product_ids = entry
+            if version != self.version or time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, value, version, token=None, product_ids=frozenset()):
+        with self._lock:
+            if token is not None:
+                if self._loading.get(key) is not token:
+                    return
+                del self._loading[key]
+            # Une invalidation a eu lieu pendant le calcul : ne pas stocker
+            if version != self.version:
+                return
+            self._entries[key] = (version, time.monotonic(), value, product_ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, product_ids=None):
+        """
+        Retourne la valeur en cache ou l'obtient via loader().
+        product_ids(valeur) : identifiants des produits contenus, pour discard_products()
+        """
+        entry = self._get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        token = object()
+        with self._lock:
+            version = self.version
+            self._loading[key] = token
+        try:
+            value = loader()
+        except Exception:
+            with self._lock:
+                if self._loading.get(key) is token:
+                    del self._loading[key]
+            raise
+        self._set(key, value, version, token,
+                  frozenset(product_ids(value)) if product_ids else frozenset())
+        return value
+
+    def get_categories(self, loader):
+        return self.get_or_load(('categories',), loader)
+
+    def get_products(self, search_query, category_filter, loader):
+        return self.get_or_load(
+            ('products', search_query, category_filter), loader,
+            lambda products: (product['id'] for product in products)
+        )
+
+    def get_fragment(self, search_query, category_filter, authenticated, renderer, product_ids=()):
+        return self.get_or_load(
+            ('fragment', search_query, category_filter, bool(authenticated)),
+            renderer,
+            lambda html: product_ids
+        )
+
+    def invalidate(self):
+        """Invalide tout le catalogue (appelé après chaque écriture admin)"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._loading.clear()
+
+    def discard(self, key):
+        """Invalide une seule entrée (y compris un chargement en cours)"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+
+    def discard_products(self, product_ids):
+        """
+        Invalide les entrées contenant l'un de ces produits (mouvement de stock).
+        Les chargements en cours, dont le contenu n'est pas encore connu, ne
+        seront pas stockés.
+        """
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[3] & product_ids]:
+                del self._entries[key]
+            self._loading.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+catalog_cache = CatalogCache(**CATALOG_CACHE_CONFIG)
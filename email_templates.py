@@ -0,0 +1,174 @@
+from collections import namedtuple
+from html.parser import HTMLParser
+import os
+import re
+
+from jinja2 import Environment, FileSystemLoader
+
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'emails')
+EMAIL_STYLESHEET = 'email.css'
+
+RenderedEmail = namedtuple('RenderedEmail', ['subject', 'html', 'text'])
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_RULE = re.compile(r'([^{}]+)\{([^}]*)\}')
+_TAG = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>')
+_CLASS_ATTR = re.compile(r'\sclass="([^"]*)"')
+_STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"')
+
+
+def parse_stylesheet(css):
+    """Règles simples (balise ou .classe) → {sélecteur: déclarations}"""
+    rules = {}
+    for selectors, declarations in _CSS_RULE.findall(_CSS_COMMENT.sub('', css)):
+        declarations = ' '.join(declarations.split()).strip().rstrip(';')
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            rules[selector] = f"{rules[selector]}; {declarations}" if selector in rules else declarations
+    return rules
+
+
+def inline_css(source, rules):
+    """
+    Copie les styles dans l'attribut style de chaque balise : règle de balise,
+    puis règles de classe, puis style déjà présent (prioritaire).
+    Appliqué au source Jinja, une seule fois, avant compilation.
+    """
+    def replace(match):
+        tag, attrs, closing = match.group(1), match.group(2) or '', match.group(3)
+        declarations = []
+        if tag.lower() in rules:
+            declarations.append(rules[tag.lower()])
+        class_match = _CLASS_ATTR.search(attrs)
+        if class_match:
+            declarations.extend(rules[f'.{name}'] for name in class_match.group(1).split()
+                                if f'.{name}' in rules)
+        if not declarations:
+            return match.group(0)
+
+        style_match = _STYLE_ATTR.search(attrs)
+        if style_match:
+            declarations.append(style_match.group(1).strip().rstrip(';'))
+            attrs = attrs[:style_match.start()] + attrs[style_match.end():]
+        return f'<{tag}{attrs} style="{"; ".join(declarations)}"{closing}>'
+
+    return _TAG.sub(replace, source)
+
+
+class _InliningLoader(FileSystemLoader):
+    """Chargeur Jinja qui inline la feuille de style commune dans chaque template"""
+
+    def __init__(self, searchpath):
+        super().__init__(searchpath)
+        with open(os.path.join(searchpath, EMAIL_STYLESHEET), encoding='utf-8') as f:
+            self.rules = parse_stylesheet(f.read())
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return inline_css(source, self.rules), filename, uptodate
+
+
+class _TextConverter(HTMLParser):
+    """Version texte d'un email HTML : blocs sur leurs lignes, liens en clair"""
+
+    BLOCKS = {'p', 'div', 'h1', 'h2', 'h3', 'li', 'tr', 'table'}
+    SKIPPED = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = ['']
+        self._skip = 0
+        self._space = False
+        self._href = None
+        self._link_text = ''
+
+    def _newline(self):
+        self._space = False
+        if self.lines[-1].strip():
+            self.lines.append('')
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skip += 1
+        elif tag == 'br':
+            self.lines.append('')
+        elif tag in self.BLOCKS:
+            self._newline()
+        elif tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._link_text = ''
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCKS:
+            self._newline()
+        elif tag == 'a' and self._href:
+            if self._href != self._link_text.strip():
+                self.lines[-1] += f' ({self._href})'
+            self._href = None
+
+    def handle_data(self, data):
+        if self._skip or not data:
+            return
+        if data[0].isspace():
+            self._space = True
+        text = ' '.join(data.split())
+        if not text:
+            return
+        if self._space and self.lines[-1]:
+            self.lines[-1] += ' '
+        self.lines[-1] += text
+        self._space = data[-1].isspace()
+        if self._href:
+            self._link_text += text
+
+    def text(self):
+        return '\n\n'.join(line.strip() for line in self.lines if line.strip()) + '\n'
+
+
+def html_to_text(html):
+    converter = _TextConverter()
+    converter.feed(html)
+    converter.close()
+    return converter.text()
+
+
+# Templates compilés une fois puis gardés en mémoire (pas de relecture du disque)
+email_environment = Environment(
+    loader=_InliningLoader(EMAIL_TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=False,
+    cache_size=-1,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+
+def precompile_email_templates():
+    """Compile (et inline) tous les templates d'email ; appelé au démarrage"""
+    names = email_environment.list_templates(extensions=['html'])
+    for name in names:
+        email_environment.get_template(name)
+    return names
+
+
+def _render(template, context):
+    module = template.make_module(context)
+    html = str(module)
+    return RenderedEmail(getattr(module, 'subject', 'KOASA'), html, html_to_text(html))
+
+
+def render_email(template_name, **context):
+    """Rend un email : (sujet, HTML, texte). Le sujet est défini dans le template."""
+    return _render(email_environment.get_template(template_name), context)
+
+
+def render_email_batch(template_name, contexts):
+    """Rend le même template compilé pour chaque contexte (un par destinataire)"""
+    template = email_environment.get_template(template_name)
+    for context in contexts:
+        yield _render(template, context)
+
+
+precompile_email_templates()
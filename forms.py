@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, EmailField, TelField, TextAreaField, BooleanField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, Regexp
-from models import User
+from models import User, normalize_phone
 
 class RegistrationForm(FlaskForm):
     first_name = StringField('Prénom', validators=[
@@ -39,14 +39,8 @@ class RegistrationForm(FlaskForm):
             raise ValidationError('Cet email est déjà utilisé')
     
     def validate_phone(self, field):
-        # Normaliser le numéro de téléphone
-        phone = field.data
-        if phone.startswith('00226'):
-            phone = '+226' + phone[5:]
-        elif phone.startswith('226'):
-            phone = '+226' + phone[3:]
-        elif len(phone) == 8 and phone.isdigit():
-            phone = '+226' + phone
+        # Même format canonique que celui enregistré en base
+        phone = normalize_phone(field.data)
         
         if User.query.filter_by(phone=phone).first():
             raise ValidationError('Ce numéro de téléphone est déjà utilisé')
@@ -138,14 +132,8 @@ class ProfileUpdateForm(FlaskForm):
                 raise ValidationError('Cet email est déjà utilisé')
     
     def validate_phone(self, field):
-        # Normaliser le numéro
-        phone = field.data
-        if phone.startswith('00226'):
-            phone = '+226' + phone[5:]
-        elif phone.startswith('226'):
-            phone = '+226' + phone[3:]
-        elif len(phone) == 8 and phone.isdigit():
-            phone = '+226' + phone
+        # Même format canonique que celui enregistré en base
+        phone = normalize_phone(field.data)
         
         if phone != self.original_phone:
             if User.query.filter_by(phone=phone).first():
@@ -0,0 +1,351 @@
+# generate_fixtures.py
+"""
+Données synthétiques à l'échelle de la production, reproductibles.
+
+    python generate_fixtures.py --users 100000 --orders 1000000 --seed 42 --end 2026-10-01
+    DATABASE_URL=postgresql://localhost/koasa_perf python generate_fixtures.py --reset
+
+Clients avec numéros +226 valides et uniques, catalogue, commandes réparties
+sur --years années (activité croissante, pics du week-end et du soir),
+articles par commande, statuts selon l'ancienneté de la commande. Même
+--seed et même --end : mêmes données.
+
+Insertion en masse, par lots : COPY sur PostgreSQL, executemany ailleurs
+(aucun objet ORM). Tous les comptes partagent le mot de passe
+FIXTURE_PASSWORD (un seul hachage pour 100 000 comptes). Les données sont
+ajoutées à la base existante ; --reset la vide d'abord.
+"""
+import argparse
+import csv
+import io
+import math
+import os
+import random
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+# Ajoute le chemin du projet
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, select, text
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Category, Product, Order, OrderItem, OrderCounter
+from search import rebuild_search_index
+
+FIXTURE_PASSWORD = 'koasa-fixture'
+
+FIRST_NAMES = ['Awa', 'Aminata', 'Fatimata', 'Mariam', 'Salimata', 'Rasmata', 'Adjara', 'Kadidia',
+               'Aïcha', 'Bintou', 'Safiatou', 'Alimata', 'Issa', 'Moussa', 'Boureima', 'Souleymane',
+               'Ousmane', 'Adama', 'Idrissa', 'Hamidou', 'Abdoulaye', 'Seydou', 'Lassané', 'Noufou',
+               'Wendkouni', 'Pascal', 'Jean', 'Paul', 'Désiré', 'Bienvenu', 'Clarisse', 'Estelle']
+LAST_NAMES = ['Ouédraogo', 'Sawadogo', 'Compaoré', 'Kaboré', 'Zongo', 'Traoré', 'Ouattara', 'Sankara',
+              'Kiemdé', 'Nikiema', 'Ilboudo', 'Yaméogo', 'Tapsoba', 'Bationo', 'Sanou', 'Coulibaly',
+              'Diallo', 'Konaté', 'Somé', 'Dabiré', 'Kientega', 'Bamogo', 'Zoungrana', 'Tiendrebéogo']
+EMAIL_DOMAINS = ['gmail.com', 'yahoo.fr', 'hotmail.com', 'outlook.fr', 'fasonet.bf']
+QUARTERS = ['Ouaga 2000', 'Gounghin', 'Pissy', 'Tampouy', 'Dassasgho', 'Cissin', 'Zogona',
+            'Patte d\'Oie', 'Kalgondin', 'Tanghin', 'Bobo - Sarfalao', 'Bobo - Accart-Ville']
+
+# Catégorie → (produit, unité, prix en FCFA)
+CATALOG = {
+    'Bœuf': [('Filet', 'kg', 5500), ('Côte', 'kg', 4200), ('Viande hachée', 'kg', 3800),
+             ('Brochettes', 'pièce', 500), ('Foie', 'kg', 3500)],
+    'Mouton': [('Gigot', 'kg', 3800), ('Côtelettes', 'kg', 4000), ('Épaule', 'kg', 3500),
+               ('Mouton entier', 'pièce', 85000)],
+    'Volaille': [('Poulet entier', 'pièce', 2500), ('Poulet bicyclette', 'pièce', 3000),
+                 ('Cuisses de poulet', 'kg', 2800), ('Pintade', 'pièce', 3500)],
+}
+
+# Articles par commande : 1 à 6, surtout 1 à 3
+ITEM_COUNT_WEIGHTS = [30, 30, 20, 10, 6, 4]
+KG_QUANTITIES = ([0.5, 1, 1.5, 2, 3, 5], [15, 35, 15, 20, 10, 5])
+PIECE_QUANTITIES = ([1, 2, 3, 4, 10], [50, 25, 12, 8, 5])
+# Commandes par heure de la journée (UTC = heure de Ouagadougou)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 6, 8, 9, 9, 10, 12, 10, 7, 6, 7, 9, 12, 14, 12, 8, 4, 2]
+
+BATCH_SIZE = 20000
+
+
+def status_mix(age):
+    """(statuts, poids) selon l'ancienneté de la commande"""
+    if age < timedelta(days=1):
+        return ['en_attente', 'confirme', 'preparation'], [60, 30, 10]
+    if age < timedelta(days=3):
+        return ['en_attente', 'confirme', 'preparation', 'livree', 'annulee'], [10, 30, 40, 15, 5]
+    return ['livree', 'annulee', 'confirme', 'en_attente'], [88, 9, 2, 1]
+
+
+class BulkWriter:
+    """Insertion par lots : COPY (PostgreSQL) ou executemany (autres bases)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.copy = engine.dialect.name == 'postgresql'
+        self.rows = 0
+
+    def write(self, table, columns, rows):
+        if not rows:
+            return
+        with self.engine.begin() as connection:
+            if self.copy:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow(['true' if v is True else 'false' if v is False else v for v in row])
+                buffer.seek(0)
+                cursor = connection.connection.cursor()
+                cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+        self.rows += len(rows)
+
+    def reset_sequences(self, *tables):
+        """Identifiants fournis explicitement : recale les séquences SERIAL"""
+        if not self.copy:
+            return
+        with self.engine.begin() as connection:
+            for table in tables:
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+                ))
+
+
+def growth_times(rng, count, start, end, exponent=2.0):
+    """count instants triés entre start et end, densité croissante (t^(exponent-1))"""
+    span = (end - start).total_seconds()
+    return sorted(start + timedelta(seconds=span * rng.random() ** (1 / exponent)) for _ in range(count))
+
+
+def generate_catalog(writer, rng, count, start, end):
+    """
+    Produits répartis sur les catégories du CATALOG, en vente dès start (les
+    commandes couvrent toute la période) ; retourne [(id, nom, unité, prix)]
+    """
+    categories = dict(db.session.execute(select(Category.name, Category.id)).all())
+    with db.engine.begin() as connection:
+        for name in CATALOG:
+            if name not in categories:
+                categories[name] = connection.execute(
+                    Category.__table__.insert().values(name=name, description=f'Viandes ({name.lower()})')
+                ).inserted_primary_key[0]
+
+    span = (end - start).total_seconds()
+    rows = []
+    for i in range(count):
+        category = rng.choice(list(CATALOG))
+        product, unit, price = rng.choice(CATALOG[category])
+        updated = start + timedelta(seconds=int(span * rng.random()))
+        rows.append((f'{category} - {product} #{i + 1}', f'{product} ({category.lower()}), lot {i + 1}',
+                     round(price * rng.uniform(0.8, 1.3), -1), unit, categories[category],
+                     rng.randint(0, 500), rng.random() < 0.9, start, updated))
+    writer.write(Product.__table__, ['name', 'description', 'price', 'unit', 'category_id', 'stock',
+                                     'is_available', 'created_at', 'updated_at'], rows)
+
+    products = db.session.execute(select(Product.id, Product.name, Product.unit, Product.price)
+                                  .order_by(Product.id)).all()
+    rebuild_search_index()  # produits insérés hors événements ORM
+    return products
+
+
+def generate_users(writer, rng, count, start, end):
+    """Clients triés par date d'inscription ; retourne (ids, dates d'inscription)"""
+    first_id = (db.session.execute(select(func.max(User.id))).scalar() or 0) + 1
+    taken = set(db.session.execute(select(User.phone)).scalars())
+    password_hash = generate_password_hash(FIXTURE_PASSWORD)
+
+    # Mobiles burkinabè : 8 chiffres commençant par 5, 6 ou 7
+    phones = [f'+226{n}' for n in rng.sample(range(50000000, 80000000), count)]
+    for i, phone in enumerate(phones):
+        while phone in taken:
+            phone = f'+226{rng.randrange(50000000, 80000000)}'
+        phones[i] = phone
+        taken.add(phone)
+    created = growth_times(rng, count, start, end)
+
+    columns = ['id', 'email', 'phone', 'password_hash', 'first_name', 'last_name', 'email_verified',
+               'whatsapp_verified', 'is_active', 'is_admin', 'created_at', 'updated_at']
+    batch = []
+    for i in range(count):
+        user_id = first_id + i
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        local = f'{first_name}.{last_name}'.lower().translate(str.maketrans('éèïô\'', 'eeio-'))
+        batch.append((user_id, f'{local}.{user_id}@{rng.choice(EMAIL_DOMAINS)}', phones[i], password_hash,
+                      first_name, last_name, rng.random() < 0.75, rng.random() < 0.9, rng.random() < 0.98,
+                      False, created[i], created[i]))
+        if len(batch) >= BATCH_SIZE:
+            writer.write(User.__table__, columns, batch)
+            batch = []
+    writer.write(User.__table__, columns, batch)
+    writer.reset_sequences(User.__table__)
+    return list(range(first_id, first_id + count)), created
+
+
+class OrderNumbers:
+    """Numéros au format de Order.generate_order_number, sans collision avec les futures commandes"""
+
+    def __init__(self, count):
+        self.postgres = db.engine.dialect.name == 'postgresql'
+        if self.postgres:
+            # Bloc réservé sur la séquence utilisée par next_order_sequence
+            with db.engine.begin() as connection:
+                last = connection.execute(text(
+                    "SELECT setval('order_number_seq', nextval('order_number_seq') + :n - 1)"
+                ), {'n': count}).scalar()
+            self._next = last - count + 1
+        else:
+            self.counters = dict(db.session.execute(select(OrderCounter.day, OrderCounter.value)).all())
+
+    def take(self, moment):
+        if self.postgres:
+            number, self._next = self._next, self._next + 1
+        else:
+            day = moment.strftime('%Y%m%d')
+            number = self.counters[day] = self.counters.get(day, 0) + 1
+        return f"KO-{moment:%Y%m%d}-{number:06d}", f"CMD-{moment:%y%m%d}-{number:04d}"
+
+    def save(self):
+        """SQLite : compteurs journaliers avancés au-delà des numéros générés"""
+        if self.postgres:
+            return
+        with db.engine.begin() as connection:
+            connection.execute(OrderCounter.__table__.delete().where(OrderCounter.day.in_(list(self.counters))))
+            connection.execute(OrderCounter.__table__.insert(),
+                               [{'day': day, 'value': value} for day, value in self.counters.items()])
+
+
+def daily_counts(rng, total, user_created, start, end):
+    """Commandes par jour : proportionnelles aux inscrits, +30 % le week-end ; somme exacte"""
+    # Jours commencés avant la fin de l'historique
+    days = math.ceil((end - datetime.combine(start.date(), datetime.min.time())) / timedelta(days=1))
+    weights = []
+    for offset in range(days):
+        day_end = datetime.combine(start.date() + timedelta(days=offset + 1), datetime.min.time())
+        registered = bisect_right(user_created, day_end)
+        weekend = (start.date() + timedelta(days=offset)).weekday() >= 5
+        weights.append(registered * (1.3 if weekend else 1.0) * rng.uniform(0.85, 1.15))
+    scale = total / (sum(weights) or 1)
+    counts = [int(w * scale) for w in weights]
+    # Reste distribué aux jours les plus chargés
+    for offset in sorted(range(days), key=lambda d: weights[d] * scale - counts[d], reverse=True)[:total - sum(counts)]:
+        counts[offset] += 1
+    return counts
+
+
+def generate_orders(writer, rng, count, user_ids, user_created, products, start, end):
+    first_id = (db.session.execute(select(func.max(Order.id))).scalar() or 0) + 1
+    numbers = OrderNumbers(count)
+
+    # Fidélité : peu de clients passent beaucoup de commandes (loi de Pareto)
+    user_weights = list(accumulate(min(rng.paretovariate(1.2), 50) for _ in user_ids))
+    # Popularité des produits : loi de Zipf
+    product_weights = list(accumulate(1 / (rank + 1) for rank in range(len(products))))
+    shuffled = products[:]
+    rng.shuffle(shuffled)
+
+    order_columns = ['id', 'user_id', 'order_number', 'whatsapp_order_id', 'total_amount', 'status',
+                     'delivery_address', 'admin_confirmed_at', 'stock_reserved', 'created_at', 'updated_at']
+    item_columns = ['order_id', 'product_id', 'product_name', 'quantity', 'unit_price', 'subtotal']
+    orders, items = [], []
+    order_id = first_id
+
+    for offset, day_count in enumerate(daily_counts(rng, count, user_created, start, end)):
+        if not day_count:
+            continue
+        day = datetime.combine(start.date() + timedelta(days=offset), datetime.min.time())
+        hours = rng.choices(range(24), HOUR_WEIGHTS, k=day_count)
+        moments = [day + timedelta(hours=hour, seconds=rng.randrange(3600)) for hour in hours]
+        # Dernier jour : rien après la fin de l'historique
+        moments = sorted(m if m <= end else day + (end - day) * rng.random() for m in moments)
+        for moment in moments:
+            registered = bisect_right(user_created, moment) or 1
+            user_index = bisect_right(user_weights, rng.random() * user_weights[registered - 1], hi=registered - 1)
+
+            total = 0
+            chosen = set()
+            for _ in range(rng.choices(range(1, 7), ITEM_COUNT_WEIGHTS)[0]):
+                product_id, name, unit, price = shuffled[bisect_right(product_weights, rng.random() * product_weights[-1])]
+                if product_id in chosen:
+                    continue
+                chosen.add(product_id)
+                quantity = rng.choices(*(KG_QUANTITIES if unit == 'kg' else PIECE_QUANTITIES))[0]
+                subtotal = quantity * price
+                total += subtotal
+                items.append((order_id, product_id, name, quantity, price, subtotal))
+
+            statuses, weights = status_mix(end - moment)
+            status = rng.choices(statuses, weights)[0]
+            confirmed_at = moment + timedelta(minutes=rng.randint(5, 120)) if status in ('confirme', 'preparation', 'livree') else None
+            updated_at = min(end, moment + timedelta(hours=rng.randint(1, 48))) if status in ('livree', 'annulee') else (confirmed_at or moment)
+            order_number, whatsapp_order_id = numbers.take(moment)
+            # Historique : le stock généré ne porte aucune réservation, une annulation
+            # ultérieure (change_order_status) n'a donc rien à restituer
+            orders.append((order_id, user_ids[user_index], order_number, whatsapp_order_id, total, status,
+                           rng.choice(QUARTERS) if rng.random() < 0.7 else None, confirmed_at,
+                           False, moment, updated_at))
+            order_id += 1
+
+            if len(orders) >= BATCH_SIZE:
+                writer.write(Order.__table__, order_columns, orders)
+                writer.write(OrderItem.__table__, item_columns, items)
+                orders, items = [], []
+
+    writer.write(Order.__table__, order_columns, orders)
+    writer.write(OrderItem.__table__, item_columns, items)
+    writer.reset_sequences(Order.__table__)
+    numbers.save()
+    return order_id - first_id
+
+
+def generate(users, orders, products=200, seed=42, years=4, end=None):
+    """Génère les données dans la base de l'application courante ; retourne les lignes écrites"""
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    start = end - timedelta(days=365 * years)
+    writer = BulkWriter(db.engine)
+
+    catalog = generate_catalog(writer, rng, products, start, end)
+    if not catalog:
+        raise ValueError('Aucun produit : utiliser --products > 0')
+    user_ids, user_created = generate_users(writer, rng, users, start, end)
+    if orders:
+        generate_orders(writer, rng, orders, user_ids, user_created, catalog, start, end)
+
+    with db.engine.begin() as connection:
+        connection.execute(text('ANALYZE'))
+    return writer.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--years', type=int, default=4, help="période couverte par l'historique")
+    parser.add_argument('--end', type=datetime.fromisoformat, default=None,
+                        help="date de fin de l'historique (défaut : maintenant)")
+    parser.add_argument('--reset', action='store_true', help='vide la base avant de générer')
+    args = parser.parse_args()
+
+    from app import app, initialize_database
+
+    with app.app_context():
+        if args.reset:
+            print("🗑️  Suppression des tables...")
+            db.drop_all()
+        initialize_database()
+
+        print(f"🌱 Génération: {args.users} clients, {args.orders} commandes, {args.products} produits "
+              f"(seed {args.seed}, {args.years} ans)")
+        started = time.perf_counter()
+        rows = generate(args.users, args.orders, args.products, args.seed, args.years, args.end)
+        elapsed = time.perf_counter() - started
+        print(f"✅ {rows} lignes en {elapsed:.1f}s ({rows / elapsed:.0f} lignes/s)")
+
+
+if __name__ == '__main__':
+    main()
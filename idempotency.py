@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_CONFIG = {
+    'ttl': timedelta(hours=24),        # durée de conservation des réponses
+    'lock_timeout': timedelta(seconds=60),  # une requête "en cours" plus vieille est abandonnée
+    'sweep_interval': 300,              # secondes entre deux purges (par processus)
+    'max_key_length': 100
+}
+
+_last_sweep = 0.0
+
+
+class IdempotencyConflict(Exception):
+    """Clé réutilisée pour une autre requête, ou requête identique encore en cours"""
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.message = message
+        super().__init__(message)
+
+
+def request_fingerprint(data):
+    """Empreinte stable du corps JSON de la requête"""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def sweep_expired_idempotency_keys():
+    """Supprime les clés expirées ; retourne le nombre de lignes supprimées"""
+    deleted = IdempotencyKey.query.filter(
+        IdempotencyKey.expires_at < datetime.now(timezone.utc)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _sweep_if_due():
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep >= IDEMPOTENCY_CONFIG['sweep_interval']:
+        _last_sweep = now
+        sweep_expired_idempotency_keys()
+
+
+def claim_idempotency_key(user_id, key, fingerprint, _retry=True):
+    """
+    Réserve une clé d'idempotence avant de traiter la requête.
+    Retourne (record, None) si la requête doit être traitée,
+    ou (record, (payload, status_code)) si une réponse est déjà enregistrée.
+    La réservation est une simple insertion validée aussitôt : c'est la
+    contrainte d'unicité qui sérialise les doublons, aucun verrou n'est gardé.
+    """
+    _sweep_if_due()
+
+    now = datetime.now(timezone.utc)
+    record = IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        request_hash=fingerprint,
+        created_at=now,
+        expires_at=now + IDEMPOTENCY_CONFIG['ttl']
+    )
+    db.session.add(record)
+    try:
+        db.session.commit()
+        return record, None
+    except IntegrityError:
+        db.session.rollback()
+
+    existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+    if existing is None:
+        # Supprimée entre-temps (échec de la première requête) : on réessaie
+        if _retry:
+            return claim_idempotency_key(user_id, key, fingerprint, _retry=False)
+        raise IdempotencyConflict(409, 'Requête déjà en cours de traitement')
+
+    if existing.request_hash != fingerprint:
+        raise IdempotencyConflict(422, 'Clé d\'idempotence déjà utilisée pour une autre requête')
+
+    if existing.status_code is None:
+        started = existing.created_at.replace(tzinfo=timezone.utc)
+        if _retry and now - started > IDEMPOTENCY_CONFIG['lock_timeout']:
+            # Traitement abandonné (processus arrêté) : la clé est libérée
+            db.session.delete(existing)
+            db.session.commit()
+            return claim_idempotency_key(user_id, key, fingerprint, _retry=False)
+        raise IdempotencyConflict(409, 'Requête déjà en cours de traitement')
+
+    return existing, (json.loads(existing.response_body), existing.status_code)
+
+
+def complete_idempotency_key(record, payload, status_code):
+    """Enregistre la réponse ; à valider dans la même transaction que la commande"""
+    record.status_code = status_code
+    record.response_body = json.dumps(payload, ensure_ascii=False)
+
+
+def release_idempotency_key(record):
+    """Libère la clé après un échec pour que le client puisse réessayer"""
+    db.session.delete(record)
+    db.session.commit()
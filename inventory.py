@@ -0,0 +1,96 @@
+import math
+
+from models import db, Product
+
+# Statut qui libère le stock réservé par une commande
+CANCELLED_STATUS = 'annulee'
+
+
+class OutOfStock(Exception):
+    """Stock insuffisant pour au moins un produit de la commande"""
+
+    def __init__(self, product_names):
+        self.product_names = product_names
+        super().__init__(', '.join(product_names))
+
+
+def reserved_units(quantity):
+    """Le stock est suivi en unités entières : 1.5 kg réserve 2 unités"""
+    return math.ceil(quantity)
+
+
+def _units_by_product(lines):
+    units = {}
+    for product_id, quantity in lines:
+        units[product_id] = units.get(product_id, 0) + reserved_units(quantity)
+    # Ordre fixe des verrous de ligne : pas d'interblocage entre commandes
+    return sorted(units.items())
+
+
+def reserve_stock(lines):
+    """
+    Décrémente le stock de façon atomique dans la transaction courante.
+    lines : [(product_id, quantity), ...]
+    Chaque UPDATE ne réussit que si le stock restant suffit
+    (UPDATE ... SET stock = stock - :q WHERE id = :id AND stock >= :q),
+    ce qui empêche toute survente même avec des commandes simultanées.
+    Lève OutOfStock ; l'appelant doit alors annuler la transaction.
+    Retourne les identifiants des produits dont le stock a changé.
+    """
+    missing = []
+    units_by_product = _units_by_product(lines)
+    for product_id, units in units_by_product:
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id, Product.stock >= units)
+            .values(stock=Product.stock - units)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            missing.append(product_id)
+
+    if missing:
+        names = db.session.execute(
+            db.select(Product.name).where(Product.id.in_(missing))
+        ).scalars().all()
+        raise OutOfStock(names)
+    return [product_id for product_id, units in units_by_product]
+
+
+def release_stock(lines):
+    """Restitue le stock réservé (commande annulée). Retourne les produits modifiés."""
+    released = []
+    for product_id, units in _units_by_product(lines):
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id)
+            .values(stock=Product.stock + units)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            released.append(product_id)
+    return released
+
+
+def order_lines(order):
+    return [(item.product_id, item.quantity) for item in order.items]
+
+
+def change_order_status(order, new_status):
+    """
+    Change le statut d'une commande en gardant le stock cohérent :
+    l'annulation libère la réservation, la réactivation la reprend.
+    Retourne les identifiants des produits dont le stock a changé.
+    """
+    changed = []
+    if new_status == CANCELLED_STATUS and order.status != CANCELLED_STATUS:
+        # Les commandes antérieures à la réservation n'ont rien à restituer
+        if order.stock_reserved:
+            changed = release_stock(order_lines(order))
+            order.stock_reserved = False
+    elif order.status == CANCELLED_STATUS and new_status != CANCELLED_STATUS:
+        changed = reserve_stock(order_lines(order))
+        order.stock_reserved = True
+
+    order.status = new_status
+    return changed
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from metrics import PDF_SECONDS
+from utils import generate_invoice_pdf, INVOICE_TEMPLATE_VERSION
+
+# Configuration du cache des factures PDF
+INVOICE_CACHE_CONFIG = {
+    'directory': os.environ.get('INVOICE_CACHE_DIR',
+                                os.path.join(tempfile.gettempdir(), 'koasa-invoices')),
+    # Taille maximale sur disque ; au-delà, les factures les moins
+    # récemment téléchargées sont supprimées
+    'max_bytes': int(os.environ.get('INVOICE_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+}
+
+_eviction_lock = threading.Lock()
+
+
+def invoice_cache_key(order, user):
+    """
+    Clé de contenu d'une facture : toute modification de la commande, du client
+    ou de la mise en page change la clé (et donc l'ETag et le fichier).
+    """
+    parts = [
+        str(order.id),
+        order.updated_at.isoformat() if order.updated_at else '',
+        user.updated_at.isoformat() if user.updated_at else '',
+        str(INVOICE_TEMPLATE_VERSION)
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(INVOICE_CACHE_CONFIG['directory'], f'{key}.pdf')
+
+
+def evict_invoices(max_bytes=None, keep=None):
+    """
+    Supprime les factures les moins récemment servies (mtime le plus ancien)
+    tant que le cache dépasse la taille maximale. Retourne le nombre supprimé.
+    """
+    if max_bytes is None:
+        max_bytes = INVOICE_CACHE_CONFIG['max_bytes']
+    directory = INVOICE_CACHE_CONFIG['directory']
+
+    with _eviction_lock:
+        entries = []
+        total = 0
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def get_invoice_pdf(order, user):
+    """
+    Retourne (chemin, clé) de la facture, générée seulement si absente du cache.
+    Un téléchargement répété ne coûte qu'un stat du fichier.
+    """
+    key = invoice_cache_key(order, user)
+    path = _cache_path(key)
+
+    try:
+        # Marque la facture comme récemment utilisée (ordre LRU)
+        os.utime(path)
+        return path, key
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(INVOICE_CACHE_CONFIG['directory'], exist_ok=True)
+    with PDF_SECONDS.time('facture'):
+        buffer = generate_invoice_pdf(order, user)
+
+    # Écriture atomique : un lecteur concurrent ne voit jamais un PDF tronqué
+    fd, tmp_path = tempfile.mkstemp(dir=INVOICE_CACHE_CONFIG['directory'], suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict_invoices(keep=path)
+    return path, key
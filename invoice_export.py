@@ -0,0 +1,203 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from types import SimpleNamespace
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from metrics import PDF_SECONDS
+from models import Order
+from utils import generate_invoice_pdf
+
+# Configuration de l'export groupé des factures
+INVOICE_EXPORT_CONFIG = {
+    'workers': int(os.environ.get('INVOICE_EXPORT_WORKERS', os.cpu_count() or 2)),
+    # Factures en cours de rendu par processus : borne la mémoire du flux
+    'in_flight_per_worker': 2,
+    # Commandes chargées par requête SQL
+    'batch_size': 200
+}
+
+_PAGE_PATTERN = re.compile(rb'/Type\s*/Page\b')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_export_pool():
+    """Pool de processus partagé, créé au premier export"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn : pas de fork d'un serveur multi-thread (verrous hérités)
+            _pool = ProcessPoolExecutor(
+                max_workers=INVOICE_EXPORT_CONFIG['workers'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def shutdown_export_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def snapshot_invoice(order):
+    """
+    Copie sérialisable (pickle) de ce que lit generate_invoice_pdf :
+    les objets ORM ne traversent pas la frontière entre processus.
+    """
+    customer = order.customer
+    return SimpleNamespace(
+        filename=f'facture-{order.whatsapp_order_id}.pdf',
+        order=SimpleNamespace(
+            whatsapp_order_id=order.whatsapp_order_id,
+            created_at=order.created_at,
+            status=order.status,
+            total_amount=order.total_amount,
+            delivery_address=order.delivery_address,
+            notes=order.notes,
+            items=[
+                SimpleNamespace(
+                    product_name=item.product_name,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price,
+                    subtotal=item.subtotal
+                )
+                for item in order.items
+            ]
+        ),
+        user=SimpleNamespace(
+            first_name=customer.first_name,
+            last_name=customer.last_name,
+            email=customer.email,
+            phone=customer.phone
+        )
+    )
+
+
+def render_invoice(snapshot):
+    """Exécuté dans un processus du pool : (nom du fichier, PDF, nombre de pages, durée)"""
+    started = time.perf_counter()
+    pdf = generate_invoice_pdf(snapshot.order, snapshot.user).getvalue()
+    return snapshot.filename, pdf, len(_PAGE_PATTERN.findall(pdf)), time.perf_counter() - started
+
+
+def iter_export_orders(query):
+    """Commandes à exporter, chargées par lots (pagination par id)"""
+    batch_size = INVOICE_EXPORT_CONFIG['batch_size']
+    last_id = 0
+    while True:
+        batch = query.options(
+            joinedload(Order.customer),
+            selectinload(Order.items)
+        ).filter(Order.id > last_id).order_by(Order.id).limit(batch_size).all()
+        if not batch:
+            return
+        for order in batch:
+            yield snapshot_invoice(order)
+        last_id = batch[-1].id
+
+
+class _ZipStream:
+    """Destination non seekable de zipfile : les octets écrits sont vidés à chaque envoi"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _export_report(stats):
+    return (
+        "KOASA - Export des factures\n"
+        f"Factures: {stats['invoices']}\n"
+        f"Pages: {stats['pages']}\n"
+        f"Processus: {stats['workers']}\n"
+        f"Durée: {stats['seconds']:.2f} s\n"
+        f"Débit: {stats['pages_per_second']:.1f} pages/s\n"
+    )
+
+
+def stream_invoice_zip(snapshots, pool=None, stats=None):
+    """
+    Génère l'archive ZIP morceau par morceau : chaque facture est ajoutée dès
+    que son rendu se termine, sans jamais garder l'archive entière en mémoire.
+    Le nombre de rendus en cours est borné (workers × in_flight_per_worker).
+    Un fichier rapport.txt (débit en pages/s) termine l'archive ;
+    les mêmes chiffres sont copiés dans `stats` si fourni.
+    """
+    pool = pool or get_export_pool()
+    workers = INVOICE_EXPORT_CONFIG['workers']
+    max_in_flight = workers * INVOICE_EXPORT_CONFIG['in_flight_per_worker']
+
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED)
+    names = set()
+    invoices = pages = 0
+    started = time.perf_counter()
+
+    snapshots = iter(snapshots)
+    pending = set()
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                snapshot = next(snapshots, None)
+                if snapshot is None:
+                    exhausted = True
+                else:
+                    pending.add(pool.submit(render_invoice, snapshot))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, pdf, page_count, seconds = future.result()
+                # Mesuré dans le processus de rendu, enregistré ici (registre du processus web)
+                PDF_SECONDS.observe(seconds, 'export')
+                # Deux commandes ne partagent jamais un identifiant, mais on reste prudent
+                if filename in names:
+                    filename = filename.replace('.pdf', f'-{invoices}.pdf')
+                names.add(filename)
+                archive.writestr(filename, pdf)
+                invoices += 1
+                pages += page_count
+            yield stream.drain()
+
+        seconds = time.perf_counter() - started
+        report = {
+            'invoices': invoices,
+            'pages': pages,
+            'workers': workers,
+            'seconds': seconds,
+            'pages_per_second': pages / seconds if seconds else 0.0
+        }
+        if stats is not None:
+            stats.update(report)
+        archive.writestr('rapport.txt', _export_report(report))
+        archive.close()
+        yield stream.drain()
+        print(f"📦 Export factures: {invoices} factures, {pages} pages en {seconds:.2f}s "
+              f"({report['pages_per_second']:.1f} pages/s, {workers} processus)")
+    finally:
+        # Client déconnecté : les rendus non commencés sont abandonnés
+        for future in pending:
+            future.cancel()
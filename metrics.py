@@ -0,0 +1,180 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import hmac
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configuration des métriques (format texte Prometheus, sans dépendance)
+METRICS_CONFIG = {
+    # Jeton attendu dans "Authorization: Bearer ..." ; sans jeton, /metrics n'est servi
+    # qu'en mode debug et en local (hors debug, le jeton est obligatoire)
+    'token': os.environ.get('METRICS_TOKEN', ''),
+    'latency_buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'size_buckets': (512, 2048, 8192, 32768, 131072, 524288, 2097152),
+    'query_buckets': (0, 1, 2, 3, 5, 10, 20, 50, 100)
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Histogramme à seaux fixes ; observe() ne fait qu'une recherche dichotomique"""
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self._series = {}  # labels → [compte par seau..., somme, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            names = self.labelnames + ('le',)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {values[-2]}')
+            lines.append(f'{self.name}_count{label_text} {values[-1]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('koasa_http_request_duration_seconds', 'Durée de traitement des requêtes',
+                            METRICS_CONFIG['latency_buckets'], ('endpoint', 'method'))
+REQUESTS = Counter('koasa_http_requests_total', 'Requêtes traitées', ('endpoint', 'method', 'status'))
+RESPONSE_BYTES = Histogram('koasa_http_response_size_bytes', 'Taille des réponses (hors flux)',
+                           METRICS_CONFIG['size_buckets'], ('endpoint',))
+REQUEST_QUERIES = Histogram('koasa_http_request_sql_queries', 'Requêtes SQL par requête HTTP',
+                            METRICS_CONFIG['query_buckets'], ('endpoint',))
+REQUEST_DB_SECONDS = Histogram('koasa_http_request_db_seconds', 'Temps SQL cumulé par requête HTTP',
+                               METRICS_CONFIG['latency_buckets'], ('endpoint',))
+SQL_QUERIES = Counter('koasa_sql_queries_total', 'Requêtes SQL exécutées', ('context',))
+SQL_SECONDS = Counter('koasa_sql_seconds_total', 'Temps SQL cumulé', ('context',))
+SMTP_SECONDS = Histogram('koasa_smtp_send_seconds', "Durée d'envoi d'un email",
+                         METRICS_CONFIG['latency_buckets'], ('result',))
+PDF_SECONDS = Histogram('koasa_pdf_render_seconds', "Durée de rendu d'une facture PDF",
+                        METRICS_CONFIG['latency_buckets'], ('kind',))
+
+REGISTRY = [REQUEST_SECONDS, REQUESTS, RESPONSE_BYTES, REQUEST_QUERIES, REQUEST_DB_SECONDS,
+            SQL_QUERIES, SQL_SECONDS, SMTP_SECONDS, PDF_SECONDS]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context() and 'metrics' in g:
+        g.metrics[1] += 1
+        g.metrics[2] += elapsed
+        context_label = 'request'
+    else:
+        context_label = 'background'  # worker outbox, tâches de démarrage
+    SQL_QUERIES.inc(context_label)
+    SQL_SECONDS.inc(context_label, amount=elapsed)
+
+
+def _start_request():
+    # [début, requêtes SQL, temps SQL]
+    g.metrics = [time.perf_counter(), 0, 0.0]
+
+
+def _finish_request(response):
+    metrics = g.pop('metrics', None)
+    if metrics is None:
+        return response
+    endpoint = request.endpoint or 'not_found'
+    REQUEST_SECONDS.observe(time.perf_counter() - metrics[0], endpoint, request.method)
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    REQUEST_QUERIES.observe(metrics[1], endpoint)
+    REQUEST_DB_SECONDS.observe(metrics[2], endpoint)
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, endpoint)
+    return response
+
+
+def init_metrics(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def metrics_allowed():
+    token = METRICS_CONFIG['token']
+    if token:
+        supplied = request.headers.get('Authorization', '').encode('utf-8')
+        return hmac.compare_digest(supplied, f'Bearer {token}'.encode('utf-8'))
+    # Derrière un nginx du même hôte, toute requête externe arrive de 127.0.0.1 :
+    # l'adresse seule ne prouve rien en production
+    return (current_app.debug
+            and request.remote_addr in ('127.0.0.1', '::1')
+            and 'X-Forwarded-For' not in request.headers)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -5,12 +5,16 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import app, db
+from models import upgrade_schema
 from sqlalchemy import text
 
 def migrate_database():
     with app.app_context():
         print("🔧 Migration de la base de données...")
         
+        for column in upgrade_schema(db.engine):
+            print(f"✅ Colonne ajoutée: {column}")
+        
         try:
             # Vérifier si la table orders existe
             result = db.session.execute(text("""
@@ -1,4 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, timezone
@@ -6,6 +9,68 @@ import secrets
 
 db = SQLAlchemy()
 
+# Colonnes ajoutées à des tables existantes (create_all ne les crée pas)
+ADDED_COLUMNS = [
+    ('orders', 'stock_reserved', 'BOOLEAN DEFAULT FALSE'),
+    ('outbox_messages', 'external_id', 'VARCHAR(100)'),
+    ('outbox_messages', 'delivery_status', 'VARCHAR(20)'),
+]
+
+def upgrade_schema(engine):
+    """Ajoute les colonnes manquantes listées dans ADDED_COLUMNS"""
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table, column, ddl in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                added.append(f'{table}.{column}')
+    return added
+
+def normalize_phone(phone):
+    """
+    Format canonique E.164 (+22670123456), seul format stocké en base.
+    Accepte 70123456, 22670123456, 0022670123456, +226 70 12 34 56.
+    """
+    if phone is None:
+        return None
+    digits = "".join(filter(str.isdigit, phone))
+    if phone.strip().startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if len(digits) == 8:
+        return '+226' + digits
+    return '+' + digits
+
+def normalize_stored_phones():
+    """
+    Réécrit au format canonique les numéros enregistrés avant la normalisation
+    à l'écriture. Un numéro dont la forme canonique est déjà prise est laissé
+    tel quel (doublon à fusionner à la main). Retourne (corrigés, conflits).
+    """
+    rows = db.session.execute(db.select(User.id, User.phone)).all()
+    taken = {phone for _, phone in rows}
+    fixed, conflicts = 0, []
+    for user_id, phone in rows:
+        canonical = normalize_phone(phone)
+        if canonical == phone:
+            continue
+        if canonical in taken:
+            conflicts.append((user_id, phone, canonical))
+            continue
+        db.session.execute(
+            db.update(User).where(User.id == user_id).values(phone=canonical)
+            .execution_options(synchronize_session=False)
+        )
+        taken.add(canonical)
+        fixed += 1
+    db.session.commit()
+    return fixed, conflicts
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -44,6 +109,11 @@ class User(UserMixin, db.Model):
     # Relations
     orders = db.relationship('Order', backref='customer', lazy=True, cascade='all, delete-orphan')
     
+    @validates('phone')
+    def _normalize_phone(self, key, phone):
+        # Toute écriture (inscription, profil, admin) stocke le format canonique
+        return normalize_phone(phone)
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
@@ -122,14 +192,15 @@ class Category(db.Model):
     # Relations
     products = db.relationship('Product', backref='category_ref', lazy=True)
     
-    def to_dict(self):
+    def to_dict(self, product_count=None):
+        # product_count déjà agrégé par l'appelant : évite de charger self.products
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'icon': self.icon,
             'is_active': self.is_active,
-            'product_count': len(self.products),
+            'product_count': len(self.products) if product_count is None else product_count,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -171,6 +242,10 @@ class Product(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Pagination admin par curseur sur (created_at, id)
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -181,21 +256,27 @@ class Order(db.Model):
     delivery_address = db.Column(db.Text)
     notes = db.Column(db.Text)
     admin_confirmed_at = db.Column(db.DateTime)
+    stock_reserved = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     
+    def _sequence(self):
+        """(date, numéro) partagé par order_number et whatsapp_order_id"""
+        if getattr(self, '_order_sequence', None) is None:
+            today = datetime.now(timezone.utc)
+            self._order_sequence = (today, next_order_sequence(today.strftime('%Y%m%d')))
+        return self._order_sequence
+    
     def generate_order_number(self):
-        timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
-        random_suffix = secrets.token_hex(3).upper()
-        self.order_number = f"KO-{timestamp}-{random_suffix}"
+        day, number = self._sequence()
+        self.order_number = f"KO-{day.strftime('%Y%m%d')}-{number:06d}"
         return self.order_number
     
     def generate_whatsapp_order_id(self):
-        date_part = datetime.now(timezone.utc).strftime('%y%m%d')  # CORRIGÉ: %Y → %y (année sur 2 chiffres)
-        random_part = secrets.token_hex(3).upper()
-        self.whatsapp_order_id = f"CMD-{date_part}-{random_part}"  # Maintenant 18 caractères max
+        day, number = self._sequence()
+        self.whatsapp_order_id = f"CMD-{day.strftime('%y%m%d')}-{number:04d}"  # CMD-261017-0042
         return self.whatsapp_order_id
     
     def confirm_by_admin(self):
@@ -223,6 +304,51 @@ class Order(db.Model):
             'items': [item.to_dict() for item in self.items]
         }
 
+class OrderCounter(db.Model):
+    """Compteur journalier des commandes (SQLite ; PostgreSQL utilise une séquence)"""
+    __tablename__ = 'order_counters'
+    
+    day = db.Column(db.String(8), primary_key=True)  # AAAAMMJJ
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+# Séquence PostgreSQL : nextval() ne bloque pas les transactions concurrentes
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE SEQUENCE IF NOT EXISTS order_number_seq"
+).execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_drop', DDL(
+    "DROP SEQUENCE IF EXISTS order_number_seq"
+).execute_if(dialect='postgresql'))
+
+def next_order_sequence(day):
+    """
+    Numéro de commande suivant, sans collision possible.
+    PostgreSQL : nextval() sur une séquence (monotone, non transactionnel).
+    SQLite : compteur par jour incrémenté dans la transaction de la commande
+    (les écritures SQLite sont déjà sérialisées).
+    """
+    # Requêtes Core sur la connexion de la session : pas de surcoût ORM
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(text("SELECT nextval('order_number_seq')")).scalar()
+    
+    counters = OrderCounter.__table__
+    increment = (
+        counters.update()
+        .where(counters.c.day == day)
+        .values(value=counters.c.value + 1)
+        .returning(counters.c.value)
+    )
+    value = connection.execute(increment).scalar()
+    if value is None:
+        try:
+            with db.session.begin_nested():
+                connection.execute(counters.insert().values(day=day, value=1))
+            return 1
+        except IntegrityError:
+            # Premier numéro du jour pris par une autre transaction
+            value = connection.execute(increment).scalar()
+    return value
+
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
@@ -243,4 +369,69 @@ class OrderItem(db.Model):
             'quantity': self.quantity,
             'unit_price': self.unit_price,
             'subtotal': self.subtotal
-        }
\ No newline at end of file
+        }
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        # Deux requêtes concurrentes avec la même clé : une seule insertion passe
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_user_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)  # NULL = traitement en cours
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class OutboxMessage(db.Model):
+    """Notification à envoyer, écrite dans la même transaction que la modification métier"""
+    __tablename__ = 'outbox_messages'
+    __table_args__ = (
+        # Le worker lit les messages dus : WHERE status = 'pending' AND available_at <= now
+        db.Index('ix_outbox_status_available', 'status', 'available_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(20), nullable=False)  # email, whatsapp
+    recipient = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON propre au canal
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Prochaine tentative ; repoussé pendant l'envoi (bail) et après un échec (backoff)
+    available_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    sent_at = db.Column(db.DateTime, nullable=True)
+    # Identifiant chez le fournisseur (wamid WhatsApp) et dernier statut reçu par webhook
+    external_id = db.Column(db.String(100), nullable=True, index=True)
+    delivery_status = db.Column(db.String(20), nullable=True)
+
+class ShortLink(db.Model):
+    """Lien court /w/<code> vers un message WhatsApp pré-rempli (wa.me)"""
+    __tablename__ = 'short_links'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(16), unique=True, nullable=False)
+    # Empreinte (numéro, message) : le même message réutilise le même lien
+    digest = db.Column(db.String(64), nullable=False, index=True)
+    phone = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    purpose = db.Column(db.String(30), nullable=False)  # commande, activation
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    last_clicked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class RateLimitBucket(db.Model):
+    """Seau de jetons partagé entre les workers (backend 'database' de rate_limit.py)"""
+    __tablename__ = 'rate_limit_buckets'
+    
+    key = db.Column(db.String(200), primary_key=True)  # règle:type de clé:valeur
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False, index=True)  # secondes epoch
+    allowed = db.Column(db.Boolean, nullable=False, default=True)  # résultat du dernier contrôle
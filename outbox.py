@@ -0,0 +1,320 @@
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import SMTP_SECONDS
+from models import db, OutboxMessage
+from utils import build_email_message, smtp_pool
+from email_templates import render_email_batch
+
+# Configuration de l'outbox et de son worker
+OUTBOX_CONFIG = {
+    'enabled': os.environ.get('OUTBOX_WORKER', 'true').lower() != 'false',
+    'batch_size': 20,
+    'poll_interval': 2.0,        # secondes entre deux lectures quand la file est vide
+    'lease': timedelta(minutes=2),  # un message en cours d'envoi est invisible pendant ce délai
+    'max_attempts': 8,           # au-delà : statut "dead" (lettre morte)
+    'backoff_base': 30,          # secondes ; doublé à chaque échec
+    'backoff_max': 3600
+}
+
+PENDING = 'pending'
+SENT = 'sent'
+DEAD = 'dead'
+
+
+def _utcnow():
+    # Colonnes DateTime naïves : on compare en UTC sans fuseau
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _deliver_email(message):
+    payload = json.loads(message.payload)
+    email = build_email_message(message.recipient, payload['subject'], payload['html'], payload.get('text'))
+    started = time.perf_counter()
+    try:
+        smtp_pool.send_message(email)
+    except Exception:
+        SMTP_SECONDS.observe(time.perf_counter() - started, 'error')
+        raise
+    SMTP_SECONDS.observe(time.perf_counter() - started, 'ok')
+
+
+# Canal → fonction d'envoi ; une exception signifie "à réessayer"
+# (sauf si elle porte retryable = False : le message part directement en lettre morte)
+OUTBOX_HANDLERS = {
+    'email': _deliver_email
+}
+
+# Canal → fonction d'envoi groupé : reçoit le lot du canal et retourne,
+# dans le même ordre, None (envoyé) ou l'exception de chaque message
+OUTBOX_BATCH_HANDLERS = {}
+
+
+def _outbox_message(channel, recipient, payload):
+    return OutboxMessage(
+        channel=channel,
+        recipient=recipient,
+        payload=json.dumps(payload, ensure_ascii=False)
+    )
+
+
+def _email_message(to_email, subject, html_content, text_content):
+    return _outbox_message('email', to_email,
+                           {'subject': subject, 'html': html_content, 'text': text_content})
+
+
+def enqueue_message(channel, recipient, payload):
+    """
+    Ajoute un message à l'outbox dans la transaction courante : il ne part
+    que si l'appelant valide (commit) sa modification.
+    """
+    message = _outbox_message(channel, recipient, payload)
+    db.session.add(message)
+    db.session.info['outbox_pending'] = True
+    return message
+
+
+def enqueue_messages(channel, items):
+    """
+    Ajout groupé, en un seul INSERT (executemany) : items = [(destinataire, payload), ...].
+    Comme enqueue_message, à valider par l'appelant.
+    """
+    rows = [
+        {'channel': channel, 'recipient': recipient, 'payload': json.dumps(payload, ensure_ascii=False)}
+        for recipient, payload in items
+    ]
+    if rows:
+        db.session.execute(db.insert(OutboxMessage), rows)
+        db.session.info['outbox_pending'] = True
+    return len(rows)
+
+
+def enqueue_email(to_email, subject, html_content, text_content=None):
+    return enqueue_message('email', to_email,
+                           {'subject': subject, 'html': html_content, 'text': text_content})
+
+
+def enqueue_email_batch(template_name, recipients):
+    """
+    Envoi groupé : recipients = [(email, contexte), ...]. Le template est
+    compilé une fois et rendu pour chaque destinataire ; à valider par l'appelant.
+    """
+    recipients = list(recipients)
+    rendered = render_email_batch(template_name, [context for _, context in recipients])
+    messages = [
+        _email_message(to_email, *email)
+        for (to_email, _), email in zip(recipients, rendered)
+    ]
+    db.session.add_all(messages)
+    db.session.info['outbox_pending'] = True
+    return messages
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('outbox_pending', False):
+        outbox_worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('outbox_pending', None)
+
+
+def retry_delay(attempts):
+    """Backoff exponentiel plafonné, avec ±20 % d'aléa pour étaler les reprises"""
+    delay = min(OUTBOX_CONFIG['backoff_base'] * 2 ** (attempts - 1), OUTBOX_CONFIG['backoff_max'])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _claim_due_messages(now):
+    """
+    Réserve un lot de messages dus. Le bail (available_at repoussé) est posé
+    par un UPDATE conditionnel : deux workers ne prennent jamais le même
+    message, et un worker arrêté en plein envoi le rend disponible à expiration.
+    """
+    candidates = db.session.execute(
+        db.select(OutboxMessage.id, OutboxMessage.available_at)
+        .where(OutboxMessage.status == PENDING, OutboxMessage.available_at <= now)
+        .order_by(OutboxMessage.available_at)
+        .limit(OUTBOX_CONFIG['batch_size'])
+    ).all()
+
+    claimed = []
+    lease_until = now + OUTBOX_CONFIG['lease']
+    for message_id, available_at in candidates:
+        result = db.session.execute(
+            db.update(OutboxMessage)
+            .where(OutboxMessage.id == message_id,
+                   OutboxMessage.status == PENDING,
+                   OutboxMessage.available_at == available_at)
+            .values(available_at=lease_until, attempts=OutboxMessage.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(message_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)).order_by(OutboxMessage.id).all()
+
+
+def _record_outcome(message, error):
+    if error is not None:
+        message.last_error = f'{type(error).__name__}: {error}'[:1000]
+        if message.attempts >= OUTBOX_CONFIG['max_attempts'] or not getattr(error, 'retryable', True):
+            message.status = DEAD
+            print(f"☠️ Outbox: message {message.id} abandonné après {message.attempts} essais ({message.last_error})")
+        else:
+            message.available_at = _utcnow() + retry_delay(message.attempts)
+            print(f"⚠️ Outbox: échec message {message.id} (essai {message.attempts}): {message.last_error}")
+    else:
+        message.status = SENT
+        message.sent_at = _utcnow()
+        message.last_error = None
+        outbox_worker.record_latency((message.sent_at - message.created_at).total_seconds())
+
+
+def process_outbox_batch():
+    """Envoie un lot de messages dus ; retourne le nombre de messages traités"""
+    messages = _claim_due_messages(_utcnow())
+
+    by_channel = {}
+    for message in messages:
+        by_channel.setdefault(message.channel, []).append(message)
+
+    for channel, group in by_channel.items():
+        batch_handler = OUTBOX_BATCH_HANDLERS.get(channel)
+        if batch_handler is not None:
+            # Envoi simultané : les résultats du lot sont enregistrés ensemble
+            try:
+                errors = batch_handler(group)
+            except Exception as e:
+                errors = [e] * len(group)
+            for message, error in zip(group, errors):
+                _record_outcome(message, error)
+            db.session.commit()
+            continue
+
+        handler = OUTBOX_HANDLERS.get(channel)
+        for message in group:
+            error = None
+            try:
+                if handler is None:
+                    raise LookupError(f'Canal inconnu: {channel}')
+                handler(message)
+            except Exception as e:
+                error = e
+            _record_outcome(message, error)
+            # Résultat enregistré message par message : un arrêt brutal ne renvoie que le message en cours
+            db.session.commit()
+
+    return len(messages)
+
+
+def requeue_dead_messages():
+    """Remet les lettres mortes dans la file (après correction de la cause)"""
+    count = OutboxMessage.query.filter_by(status=DEAD).update(
+        {'status': PENDING, 'attempts': 0, 'available_at': _utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if count:
+        outbox_worker.wake()
+    return count
+
+
+def outbox_stats():
+    """Profondeur de la file, lettres mortes et latence d'envoi"""
+    now = _utcnow()
+    counts = dict(db.session.query(OutboxMessage.status, db.func.count(OutboxMessage.id))
+                  .group_by(OutboxMessage.status).all())
+    oldest = db.session.query(db.func.min(OutboxMessage.created_at)).filter(
+        OutboxMessage.status == PENDING
+    ).scalar()
+    due = OutboxMessage.query.filter(
+        OutboxMessage.status == PENDING, OutboxMessage.available_at <= now
+    ).count()
+
+    return {
+        'pending': counts.get(PENDING, 0),
+        'due': due,
+        'sent': counts.get(SENT, 0),
+        'dead': counts.get(DEAD, 0),
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'worker': outbox_worker.stats()
+    }
+
+
+class OutboxWorker:
+    """Thread d'arrière-plan qui vide l'outbox ; un par processus"""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self.sent = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self, app):
+        """Démarre le worker une seule fois par processus (après le fork de gunicorn)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(app,),
+                                            name='koasa-outbox', daemon=True)
+            self._thread.start()
+            print("📬 Worker outbox démarré")
+            return True
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.sent += 1
+            self.latency_total += seconds
+            self.latency_max = max(self.latency_max, seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'sent': self.sent,
+                'avg_latency_seconds': self.latency_total / self.sent if self.sent else 0.0,
+                'max_latency_seconds': self.latency_max
+            }
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            processed = 0
+            try:
+                with app.app_context():
+                    processed = process_outbox_batch()
+            except Exception as e:
+                print(f"❌ Worker outbox: {e}")
+                time.sleep(OUTBOX_CONFIG['poll_interval'])
+            if processed < OUTBOX_CONFIG['batch_size']:
+                self._wakeup.wait(OUTBOX_CONFIG['poll_interval'])
+                self._wakeup.clear()
+
+
+outbox_worker = OutboxWorker()
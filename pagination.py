@@ -0,0 +1,34 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou falsifié"""
+
+
+def encode_cursor(values):
+    """Encode la clé de la dernière ligne d'une page en curseur opaque"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Décode un curseur et vérifie qu'il contient `size` valeurs"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def parse_limit(value, default=50, maximum=200):
+    """Taille de page bornée ; valeur invalide -> défaut"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
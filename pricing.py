@@ -0,0 +1,111 @@
+import math
+
+from models import Product, OrderItem
+
+
+class CartLine:
+    """Ligne de panier validée et chiffrée au prix serveur"""
+
+    def __init__(self, product, quantity):
+        # Valeurs copiées : la ligne reste lisible après le commit
+        # (sans recharger chaque produit expiré)
+        self.product_id = product.id
+        self.name = product.name
+        self.unit = product.unit
+        self.quantity = quantity
+        self.unit_price = product.price
+        self.subtotal = quantity * product.price
+
+    def to_order_item(self):
+        return OrderItem(
+            product_id=self.product_id,
+            product_name=self.name,
+            quantity=self.quantity,
+            unit_price=self.unit_price,
+            subtotal=self.subtotal
+        )
+
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'name': self.name,
+            'unit': self.unit,
+            'quantity': self.quantity,
+            'price': self.unit_price,
+            'subtotal': self.subtotal
+        }
+
+
+class CartQuote:
+    """Résultat du chiffrage d'un panier : lignes valides, total, lignes rejetées"""
+
+    def __init__(self, lines, rejected):
+        self.lines = lines
+        self.rejected = rejected
+        self.total = sum(line.subtotal for line in lines)
+
+    @property
+    def is_empty(self):
+        return not self.lines
+
+    def build_order_items(self):
+        return [line.to_order_item() for line in self.lines]
+
+    def to_dict(self):
+        return {
+            'items': [line.to_dict() for line in self.lines],
+            'rejected': self.rejected,
+            'total': self.total
+        }
+
+
+def _parse_line(item):
+    """Retourne (product_id, quantity) ou (product_id, raison du rejet)"""
+    try:
+        product_id = int(item.get('product_id'))
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        return None, 'produit_invalide'
+
+    try:
+        quantity = float(item.get('quantity', 0))
+    except (TypeError, ValueError):
+        return product_id, 'quantite_invalide'
+
+    # nan, inf et '1e309' passent float() : sous-totaux et total seraient nan/inf
+    if not math.isfinite(quantity) or quantity <= 0:
+        return product_id, 'quantite_invalide'
+
+    return product_id, quantity
+
+
+def price_cart(cart_items):
+    """
+    Chiffre un panier [{product_id, quantity}, ...] aux prix de la base.
+    Tous les produits référencés sont chargés en une seule requête IN (...).
+    """
+    parsed = [_parse_line(item) for item in cart_items]
+
+    product_ids = {product_id for product_id, value in parsed
+                   if product_id is not None and not isinstance(value, str)}
+    products = {}
+    if product_ids:
+        products = {
+            product.id: product
+            for product in Product.query.filter(Product.id.in_(product_ids)).all()
+        }
+
+    lines = []
+    rejected = []
+    for product_id, value in parsed:
+        if isinstance(value, str):
+            rejected.append({'product_id': product_id, 'reason': value})
+            continue
+
+        product = products.get(product_id)
+        if not product or not product.is_available:
+            rejected.append({'product_id': product_id, 'reason': 'produit_indisponible'})
+            continue
+
+        lines.append(CartLine(product, value))
+
+    return CartQuote(lines, rejected)
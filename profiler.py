@@ -0,0 +1,234 @@
+from collections import Counter
+import cProfile
+import itertools
+import json
+import os
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+
+from flask import g, request
+from flask_login import current_user
+
+# Configuration du profilage à la demande (désactivé : un test d'en-tête par requête)
+PROFILER_CONFIG = {
+    'directory': os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'koasa-profiles')),
+    # Profils gardés sur disque (anneau : les plus anciens sont supprimés)
+    'max_profiles': int(os.environ.get('PROFILE_MAX', 50)),
+    # Profiler une requête sur N (0 = jamais) ; réglable depuis /admin/profiles, par worker
+    'sample_every': int(os.environ.get('PROFILE_SAMPLE_EVERY', 0)),
+    # En-tête posé par un administrateur : "sample" ou "cprofile"
+    'header': 'X-Koasa-Profile',
+    'default_mode': 'sample',
+    'sample_interval': 0.005  # secondes entre deux relevés de pile
+}
+
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+
+class StackSampler:
+    """
+    Relève la pile du thread de la requête à intervalle fixe depuis un thread
+    à part. Sortie en piles repliées ("a;b;c 12"), lue telle quelle par
+    flamegraph.pl et speedscope.
+    """
+    extension = 'folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='koasa-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class CProfileRunner:
+    """Profil déterministe (nombre d'appels exact) ; fichier pstats pour snakeviz ou flameprof"""
+    extension = 'prof'
+
+    def __init__(self, interval):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def write(self, path):
+        self._profile.dump_stats(path)
+
+
+PROFILERS = {'sample': StackSampler, 'cprofile': CProfileRunner}
+
+# Un seul profil à la fois par processus (cProfile n'accepte qu'un profileur actif)
+_active = threading.Lock()
+_ring_lock = threading.Lock()
+_request_counter = itertools.count(1)
+profiler_stats = {'profiled': 0, 'skipped_busy': 0, 'evicted': 0}
+
+
+def _requested_mode():
+    """(mode, déclencheur) pour la requête courante, ou None (chemin rapide)"""
+    header = request.headers.get(PROFILER_CONFIG['header'])
+    if header is not None:
+        # En-tête ignoré pour les non-administrateurs
+        if not (current_user.is_authenticated and current_user.is_admin):
+            return None
+        mode = header.strip().lower()
+        return (mode if mode in PROFILERS else PROFILER_CONFIG['default_mode']), 'header'
+    every = PROFILER_CONFIG['sample_every']
+    if every and next(_request_counter) % every == 0:
+        return PROFILER_CONFIG['default_mode'], 'sampling'
+    return None
+
+
+def _start_profile():
+    requested = _requested_mode()
+    if requested is None:
+        return
+    if not _active.acquire(blocking=False):
+        profiler_stats['skipped_busy'] += 1
+        return
+    mode, trigger = requested
+    runner = PROFILERS[mode](PROFILER_CONFIG['sample_interval'])
+    g.profile = (runner, mode, trigger, time.perf_counter())
+    runner.start()
+
+
+def _finish_profile(status_code):
+    runner, mode, trigger, started = g.pop('profile')
+    try:
+        runner.stop()
+        duration = time.perf_counter() - started
+    finally:
+        _active.release()
+    try:
+        return save_profile(runner, {
+            'mode': mode,
+            'trigger': trigger,
+            'endpoint': request.endpoint or 'not_found',
+            'method': request.method,
+            'path': request.path,
+            'status': status_code,
+            'duration_ms': round(duration * 1000, 1)
+        })
+    except OSError as e:
+        print(f"⚠️ Profil non enregistré: {e}")
+        return None
+
+
+def _after_request(response):
+    if 'profile' in g:
+        profile_id = _finish_profile(response.status_code)
+        if profile_id:
+            response.headers['X-Koasa-Profile-Id'] = profile_id
+    return response
+
+
+def _teardown_request(exc):
+    # Exception non gérée : after_request n'a pas été appelé
+    if 'profile' in g:
+        _finish_profile(500)
+
+
+def init_profiler(app):
+    app.before_request(_start_profile)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def save_profile(runner, meta):
+    """Écrit le profil et ses métadonnées, puis applique la taille de l'anneau"""
+    directory = PROFILER_CONFIG['directory']
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+    filename = f"{profile_id}-{meta['endpoint']}.{runner.extension}"
+    runner.write(os.path.join(directory, filename))
+
+    meta = dict(meta, id=profile_id, file=filename, created_at=time.time())
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    profiler_stats['profiled'] += 1
+    print(f"🔬 Profil {profile_id}: {meta['method']} {meta['path']} ({meta['duration_ms']} ms, {meta['mode']})")
+    evict_profiles()
+    return profile_id
+
+
+def list_profiles():
+    """Métadonnées des profils sur disque, du plus récent au plus ancien"""
+    directory = PROFILER_CONFIG['directory']
+    profiles = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return profiles
+    for entry in entries:
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda meta: meta['created_at'], reverse=True)
+    return profiles
+
+
+def get_profile(profile_id):
+    """Métadonnées d'un profil, ou None (identifiant invalide ou profil supprimé)"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILER_CONFIG['directory'], f'{profile_id}.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_profile(meta):
+    for name in (meta['file'], f"{meta['id']}.json"):
+        try:
+            os.remove(os.path.join(PROFILER_CONFIG['directory'], name))
+        except FileNotFoundError:
+            pass
+
+
+def evict_profiles(max_profiles=None):
+    """Supprime les profils les plus anciens au-delà de max_profiles. Retourne le nombre supprimé."""
+    if max_profiles is None:
+        max_profiles = PROFILER_CONFIG['max_profiles']
+    with _ring_lock:
+        removed = 0
+        for meta in list_profiles()[max_profiles:]:
+            _remove_profile(meta)
+            removed += 1
+        profiler_stats['evicted'] += removed
+        return removed
@@ -0,0 +1,211 @@
+from collections import OrderedDict, namedtuple
+from functools import wraps
+import math
+import os
+import threading
+import time
+
+from flask import request, jsonify, render_template
+from flask_login import current_user
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, RateLimitBucket, normalize_phone
+
+# Configuration du limiteur de débit
+RATE_LIMIT_CONFIG = {
+    'enabled': os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false',
+    # 'memory' : par processus ; 'database' : partagé entre les workers gunicorn
+    'backend': os.environ.get('RATE_LIMIT_BACKEND', 'memory'),
+    # Proxys de confiance devant l'application (Render : 1) pour lire X-Forwarded-For
+    'trusted_proxies': int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0')),
+    'max_keys': 100000,       # seaux gardés en mémoire (LRU)
+    'sweep_interval': 600     # secondes entre deux purges des seaux pleins en base
+}
+
+# capacity jetons, rechargés en period secondes ; key : ce qui est compté
+RateLimit = namedtuple('RateLimit', ['key', 'capacity', 'period'])
+
+# Règles par route (nom de la règle → limites cumulées)
+RATE_LIMITS = {
+    'login': [RateLimit('ip', 30, 60), RateLimit('login', 10, 300)],
+    # Par numéro et par adresse aussi : changer d'IP ne permet pas d'inonder un même destinataire
+    'register': [RateLimit('ip', 5, 3600), RateLimit('phone', 3, 3600), RateLimit('email', 3, 3600)],
+    'forgot_password': [RateLimit('ip', 10, 3600), RateLimit('email', 3, 3600)],
+    'resend_verification': [RateLimit('ip', 10, 3600), RateLimit('user_id', 3, 900)],
+    # Code à 6 chiffres : les essais sont comptés par compte, quelle que soit l'IP
+    'verify_email': [RateLimit('user_id', 10, 900)],
+    'send_order': [RateLimit('user', 10, 60), RateLimit('ip', 30, 60)],
+}
+
+
+def client_ip():
+    if RATE_LIMIT_CONFIG['trusted_proxies']:
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(forwarded) >= RATE_LIMIT_CONFIG['trusted_proxies']:
+            return forwarded[-RATE_LIMIT_CONFIG['trusted_proxies']]
+    return request.remote_addr or ''
+
+
+def _login_key():
+    login = request.form.get('login', '').strip()
+    if not login:
+        return ''
+    return login.lower() if '@' in login else normalize_phone(login)
+
+
+# Type de clé → valeur pour la requête courante ('' : limite non appliquée)
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'login': _login_key,
+    'email': lambda: request.form.get('email', '').strip().lower(),
+    'phone': lambda: normalize_phone(request.form.get('phone', '')) if request.form.get('phone') else '',
+    'user_id': lambda: str((request.view_args or {}).get('user_id', '')),
+    'user': lambda: current_user.get_id() if current_user.is_authenticated else '',
+}
+
+
+class MemoryBackend:
+    """Seaux en mémoire du processus : le plus rapide, mais par worker"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now):
+        """Retourne (autorisé, jetons restants)"""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class DatabaseBackend:
+    """
+    Seaux dans la table rate_limit_buckets, partagés entre les workers.
+    Recharge et consommation en un seul INSERT ... ON CONFLICT DO UPDATE
+    (atomique, sans verrou applicatif), sur une connexion à part : le
+    contrôle ne valide jamais la transaction de la requête.
+    """
+
+    def __init__(self):
+        self._last_sweep = 0.0
+
+    def consume(self, key, capacity, rate, now):
+        table = RateLimitBucket.__table__
+        insert = (postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert)(table)
+        refilled = table.c.tokens + (now - table.c.updated_at) * rate
+        refilled = case((refilled > capacity, capacity), else_=refilled)
+        statement = insert.values(key=key, tokens=capacity - 1, updated_at=now, allowed=True).on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                'tokens': case((refilled >= 1, refilled - 1), else_=refilled),
+                'allowed': refilled >= 1,
+                'updated_at': now
+            }
+        ).returning(table.c.allowed, table.c.tokens)
+
+        with db.engine.begin() as connection:
+            allowed, tokens = connection.execute(statement).one()
+        self._sweep_if_due(now)
+        return bool(allowed), tokens
+
+    def _sweep_if_due(self, now):
+        # Un seau non utilisé depuis la plus longue période est plein : inutile de le garder
+        if now - self._last_sweep < RATE_LIMIT_CONFIG['sweep_interval']:
+            return
+        self._last_sweep = now
+        longest = max(limit.period for limits in RATE_LIMITS.values() for limit in limits)
+        with db.engine.begin() as connection:
+            connection.execute(RateLimitBucket.__table__.delete().where(
+                RateLimitBucket.__table__.c.updated_at < now - longest
+            ))
+
+    def reset(self):
+        with db.engine.begin() as connection:
+            connection.execute(RateLimitBucket.__table__.delete())
+
+
+BACKENDS = {
+    'memory': MemoryBackend(RATE_LIMIT_CONFIG['max_keys']),
+    'database': DatabaseBackend()
+}
+
+# Valeur inconnue : échec au démarrage plutôt qu'une erreur 500 sur chaque route limitée
+if RATE_LIMIT_CONFIG['backend'] not in BACKENDS:
+    raise RuntimeError(
+        f"RATE_LIMIT_BACKEND={RATE_LIMIT_CONFIG['backend']!r} inconnu (valeurs possibles : {', '.join(BACKENDS)})"
+    )
+
+limiter_stats = {'checks': 0, 'denied': 0}
+_stats_lock = threading.Lock()
+
+
+def check_rate_limit(rule):
+    """
+    Consomme un jeton pour chaque limite de la règle. Retourne None si la
+    requête passe, sinon le délai (secondes) avant le prochain jeton.
+    """
+    backend = BACKENDS[RATE_LIMIT_CONFIG['backend']]
+    now = time.time()
+    retry_after = None
+    for limit in RATE_LIMITS[rule]:
+        value = KEY_FUNCTIONS[limit.key]()
+        if not value:
+            continue
+        rate = limit.capacity / limit.period
+        allowed, tokens = backend.consume(f'{rule}:{limit.key}:{value}', limit.capacity, rate, now)
+        if not allowed:
+            wait = math.ceil((1 - tokens) / rate)
+            retry_after = max(retry_after or 0, wait)
+    with _stats_lock:
+        limiter_stats['checks'] += 1
+        if retry_after is not None:
+            limiter_stats['denied'] += 1
+    return retry_after
+
+
+def _limited_response(retry_after):
+    message = f'Trop de tentatives. Réessayez dans {retry_after} secondes.'
+    if request.path.startswith('/api/') or request.is_json:
+        response = jsonify({'success': False, 'message': f'⏳ {message}', 'retry_after': retry_after})
+    else:
+        response = render_template('rate_limited.html', message=message, retry_after=retry_after)
+    return response, 429, {'Retry-After': str(retry_after)}
+
+
+def rate_limit(rule, methods=('POST',)):
+    """Décorateur de route : applique RATE_LIMITS[rule] aux méthodes indiquées"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if RATE_LIMIT_CONFIG['enabled'] and request.method in methods:
+                retry_after = check_rate_limit(rule)
+                if retry_after is not None:
+                    print(f"🚦 Limite '{rule}' atteinte ({client_ip()}), réessai dans {retry_after}s")
+                    return _limited_response(retry_after)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def reset_rate_limits():
+    """Vide les seaux du backend actif"""
+    BACKENDS[RATE_LIMIT_CONFIG['backend']].reset()
+
+
+def rate_limit_stats():
+    with _stats_lock:
+        return {'backend': RATE_LIMIT_CONFIG['backend'], **limiter_stats}
@@ -0,0 +1,212 @@
+import re
+import unicodedata
+
+from sqlalchemy import DDL, Float, Integer, bindparam, column, event, select, text
+from sqlalchemy.orm import Session
+
+from models import db, Product, Category
+
+# Ligatures et lettres que la décomposition Unicode ne sépare pas
+LIGATURES = {
+    'œ': 'oe', 'Œ': 'oe',
+    'æ': 'ae', 'Æ': 'ae',
+    'ß': 'ss',
+}
+
+# Poids de pertinence : nom > catégorie > description
+SEARCH_WEIGHTS = {
+    'name': 10.0,
+    'category': 5.0,
+    'description': 1.0
+}
+
+# --- Structures d'index (créées/supprimées avec les autres tables) ---
+
+# SQLite : table virtuelle FTS5 (rowid = id du produit)
+event.listen(db.metadata, 'after_create', DDL("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+        name, category, description,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+""").execute_if(dialect='sqlite'))
+
+# PostgreSQL : tsvector pondéré + index GIN
+event.listen(db.metadata, 'after_create', DDL("""
+    CREATE TABLE IF NOT EXISTS product_search (
+        product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+        document TSVECTOR NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_product_search_document
+        ON product_search USING GIN (document)
+""").execute_if(dialect='postgresql'))
+
+event.listen(db.metadata, 'before_drop', DDL(
+    "DROP TABLE IF EXISTS product_search"
+).execute_if(dialect=('sqlite', 'postgresql')))
+
+
+def fold_text(value):
+    """Minuscules, sans accents ni ligatures : 'Bœuf - Entrecôte' -> 'boeuf - entrecote'"""
+    if not value:
+        return ''
+    value = ''.join(LIGATURES.get(char, char) for char in value)
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return value.lower()
+
+
+def search_terms(search_query):
+    """Découpe une recherche en termes normalisés (sans caractères spéciaux)"""
+    return re.findall(r'\w+', fold_text(search_query))
+
+
+def _index_rows(connection, product_ids):
+    """Réindexe les produits donnés (nom, description, nom de catégorie)"""
+    if not product_ids:
+        return
+
+    product_ids = list(product_ids)
+    dialect = connection.dialect.name
+    rows = connection.execute(
+        select(Product.id, Product.name, Product.description, Category.name)
+        .select_from(Product)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(Product.id.in_(product_ids))
+    ).all()
+
+    _delete_rows(connection, product_ids)
+
+    documents = [
+        {
+            'product_id': product_id,
+            'name': fold_text(name),
+            'category': fold_text(category_name),
+            'description': fold_text(description)
+        }
+        for product_id, name, description, category_name in rows
+    ]
+    if not documents:
+        return
+
+    if dialect == 'sqlite':
+        connection.execute(text("""
+            INSERT INTO product_search (rowid, name, category, description)
+            VALUES (:product_id, :name, :category, :description)
+        """), documents)
+    elif dialect == 'postgresql':
+        connection.execute(text("""
+            INSERT INTO product_search (product_id, document)
+            VALUES (
+                :product_id,
+                setweight(to_tsvector('simple', :name), 'A') ||
+                setweight(to_tsvector('simple', :category), 'B') ||
+                setweight(to_tsvector('simple', :description), 'C')
+            )
+        """), documents)
+
+
+def _delete_rows(connection, product_ids):
+    dialect = connection.dialect.name
+    if dialect not in ('sqlite', 'postgresql') or not product_ids:
+        return
+    key = 'rowid' if dialect == 'sqlite' else 'product_id'
+    connection.execute(
+        text(f"DELETE FROM product_search WHERE {key} IN :product_ids")
+        .bindparams(bindparam('product_ids', expanding=True)),
+        {'product_ids': list(product_ids)}
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Maintient l'index à jour dans la même transaction que l'écriture"""
+    to_index = set()
+    to_delete = set()
+    category_ids = set()
+
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Product):
+            to_index.add(obj.id)
+        elif isinstance(obj, Category):
+            category_ids.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            to_delete.add(obj.id)
+
+    if not (to_index or to_delete or category_ids):
+        return
+
+    connection = session.connection()
+    if connection.dialect.name not in ('sqlite', 'postgresql'):
+        return
+
+    if category_ids:
+        to_index.update(connection.execute(
+            select(Product.id).where(Product.category_id.in_(category_ids))
+        ).scalars())
+
+    _delete_rows(connection, to_delete)
+    _index_rows(connection, to_index - to_delete)
+
+
+def rebuild_search_index():
+    """Reconstruit entièrement l'index (migration, import massif)"""
+    connection = db.session.connection()
+    if connection.dialect.name not in ('sqlite', 'postgresql'):
+        return 0
+    connection.execute(text("DELETE FROM product_search"))
+    product_ids = connection.execute(select(Product.id)).scalars().all()
+    _index_rows(connection, product_ids)
+    db.session.commit()
+    return len(product_ids)
+
+
+def search_index_is_empty():
+    return db.session.execute(text("SELECT COUNT(*) FROM product_search")).scalar() == 0
+
+
+def apply_product_search(query, search_query, ranked=True):
+    """
+    Filtre une requête Product par recherche plein texte et la trie par pertinence.
+    Insensible à la casse, aux accents et aux ligatures ('boeuf' trouve 'Bœuf').
+    Avec ranked=False, filtre seulement (l'appelant garde son propre tri).
+    """
+    terms = search_terms(search_query)
+    if not terms:
+        return query
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        # Recherche par préfixe : "entrec" trouve "entrecôte"
+        match = ' '.join(f'"{term}"*' for term in terms)
+        ranking = text(f"""
+            SELECT rowid AS product_id,
+                   bm25(product_search, {SEARCH_WEIGHTS['name']},
+                        {SEARCH_WEIGHTS['category']},
+                        {SEARCH_WEIGHTS['description']}) AS rank
+            FROM product_search
+            WHERE product_search MATCH :match
+        """).bindparams(match=match)
+    elif dialect == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        ranking = text("""
+            SELECT product_id, -ts_rank(document, to_tsquery('simple', :match)) AS rank
+            FROM product_search
+            WHERE document @@ to_tsquery('simple', :match)
+        """).bindparams(match=match)
+    else:
+        for term in terms:
+            query = query.filter(Product.name.ilike(f'%{term}%'))
+        return query
+
+    ranking = ranking.columns(
+        column('product_id', Integer),
+        column('rank', Float)
+    ).subquery('search_rank')
+
+    if not ranked:
+        return query.filter(Product.id.in_(select(ranking.c.product_id)))
+
+    return query.join(ranking, ranking.c.product_id == Product.id).order_by(ranking.c.rank)
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import secrets
+import string
+import time
+
+from flask import url_for
+
+from catalog_cache import CatalogCache
+from models import db, ShortLink
+from utils import build_whatsapp_url
+
+# Configuration des liens courts WhatsApp
+SHORT_LINK_CONFIG = {
+    'ttl': timedelta(days=30),
+    'code_length': 8,
+    'cache_entries': 1024,
+    'cache_ttl': 300,           # secondes
+    'sweep_interval': 3600      # secondes entre deux purges des liens expirés
+}
+
+CODE_ALPHABET = string.ascii_letters + string.digits
+
+# Résolution code → (URL wa.me, expiration) ; les codes inconnus sont aussi mis en cache
+link_cache = CatalogCache(max_entries=SHORT_LINK_CONFIG['cache_entries'],
+                          ttl=SHORT_LINK_CONFIG['cache_ttl'])
+
+_last_sweep = 0.0
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _digest(phone, message):
+    return hashlib.sha256(f'{phone}\n{message}'.encode('utf-8')).hexdigest()
+
+
+def generate_code():
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(SHORT_LINK_CONFIG['code_length']))
+
+
+def create_short_link(phone, message, purpose):
+    """
+    Enregistre le message dans la transaction courante et retourne son code.
+    Un message identique encore valide réutilise le lien existant, dont
+    l'expiration est repoussée à now + ttl comme pour un nouveau lien.
+    """
+    digest = _digest(phone, message)
+    now = _utcnow()
+    existing = db.session.execute(
+        db.select(ShortLink.code).where(ShortLink.digest == digest, ShortLink.expires_at > now)
+        .limit(1)
+    ).scalar()
+    if existing:
+        db.session.execute(
+            db.update(ShortLink)
+            .where(ShortLink.code == existing)
+            .values(expires_at=now + SHORT_LINK_CONFIG['ttl'])
+            .execution_options(synchronize_session=False)
+        )
+        # L'entrée en cache porte l'ancienne expiration
+        link_cache.discard(('link', existing))
+        return existing
+
+    link = ShortLink(
+        code=generate_code(),
+        digest=digest,
+        phone=phone,
+        message=message,
+        purpose=purpose,
+        created_at=now,
+        expires_at=now + SHORT_LINK_CONFIG['ttl']
+    )
+    db.session.add(link)
+    return link.code
+
+
+def short_link_url(code):
+    return url_for('whatsapp_short_link', code=code)
+
+
+def _load_link(code):
+    link = db.session.execute(
+        db.select(ShortLink.phone, ShortLink.message, ShortLink.expires_at).where(ShortLink.code == code)
+    ).first()
+    if link is None:
+        return None
+    return build_whatsapp_url(link.phone, link.message), link.expires_at
+
+
+def resolve_short_link(code):
+    """URL wa.me complète du code, ou None s'il est inconnu ou expiré"""
+    if len(code) > 16:
+        return None
+    entry = link_cache.get_or_load(('link', code), lambda: _load_link(code))
+    if entry is None:
+        return None
+    url, expires_at = entry
+    if expires_at <= _utcnow():
+        return None
+    return url
+
+
+def record_click(code):
+    """
+    Compte le clic directement en base (un UPDATE par clic) : aucun compteur
+    en mémoire à perdre au redémarrage d'un worker, statistiques exactes
+    quel que soit le processus qui les lit
+    """
+    global _last_sweep
+    db.session.execute(
+        db.update(ShortLink)
+        .where(ShortLink.code == code)
+        .values(clicks=ShortLink.clicks + 1, last_clicked_at=_utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if time.monotonic() - _last_sweep >= SHORT_LINK_CONFIG['sweep_interval']:
+        _last_sweep = time.monotonic()
+        sweep_expired_short_links()
+
+
+def sweep_expired_short_links():
+    deleted = ShortLink.query.filter(ShortLink.expires_at <= _utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def short_link_stats(limit=20):
+    """Clics par usage et liens les plus consultés"""
+    by_purpose = db.session.query(
+        ShortLink.purpose,
+        db.func.count(ShortLink.id),
+        db.func.coalesce(db.func.sum(ShortLink.clicks), 0),
+        db.func.sum(db.case((ShortLink.clicks > 0, 1), else_=0))
+    ).group_by(ShortLink.purpose).all()
+
+    top = db.session.query(
+        ShortLink.code, ShortLink.purpose, ShortLink.clicks,
+        ShortLink.created_at, ShortLink.last_clicked_at
+    ).filter(ShortLink.clicks > 0).order_by(ShortLink.clicks.desc()).limit(limit).all()
+
+    return {
+        'purposes': {
+            purpose: {'links': links, 'clicks': int(clicks), 'clicked_links': int(clicked or 0)}
+            for purpose, links, clicks, clicked in by_purpose
+        },
+        'top_links': [
+            {
+                'code': code,
+                'purpose': purpose,
+                'clicks': clicks,
+                'created_at': created_at.isoformat() if created_at else None,
+                'last_clicked_at': last_clicked_at.isoformat() if last_clicked_at else None
+            }
+            for code, purpose, clicks, created_at, last_clicked_at in top
+        ],
+        'cache': link_cache.stats()
+    }
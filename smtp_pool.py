@@ -0,0 +1,188 @@
+from collections import deque
+from contextlib import contextmanager
+import smtplib
+import threading
+import time
+
+# Configuration du pool de connexions SMTP
+SMTP_POOL_CONFIG = {
+    'max_connections': 4,
+    # Une connexion plus vieille est fermée proprement puis recréée (secondes)
+    'max_age': 300,
+    # Au-delà de ce délai d'inactivité, NOOP avant réutilisation (secondes)
+    'noop_after': 15,
+    'timeout': 10,
+    # Attente maximale d'une connexion libre quand le pool est plein (secondes)
+    'wait_timeout': 30
+}
+
+# Erreurs qui signifient que la session SMTP est inutilisable
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion SMTP libre dans le délai imparti"""
+
+
+class _PooledConnection:
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.reused = False
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """
+    Connexions SMTP authentifiées et réutilisables, partagées entre threads.
+    Chaque connexion fait EHLO / STARTTLS / LOGIN une seule fois ; elle est
+    vérifiée par NOOP après une période d'inactivité et renouvelée après max_age.
+    Les paramètres du serveur sont relus dans `settings` (EMAIL_CONFIG) à chaque
+    nouvelle connexion.
+    """
+
+    def __init__(self, settings, max_connections=4, max_age=300, noop_after=15,
+                 timeout=10, wait_timeout=30):
+        self.settings = settings
+        self.max_connections = max_connections
+        self.max_age = max_age
+        self.noop_after = noop_after
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self._idle = deque()
+        self._open = 0
+        self._condition = threading.Condition()
+        self.connects = 0
+        self.reuses = 0
+
+    def _connect(self):
+        settings = self.settings
+        smtp = smtplib.SMTP(settings['host'], settings['port'], timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if settings.get('starttls', True):
+                smtp.starttls()
+                smtp.ehlo()
+            if settings.get('password'):
+                smtp.login(settings['username'], settings['password'])
+        except Exception:
+            smtp.close()
+            raise
+        self.connects += 1
+        return _PooledConnection(smtp)
+
+    def _is_usable(self, connection):
+        now = time.monotonic()
+        if now - connection.created_at > self.max_age:
+            return False
+        if now - connection.last_used > self.noop_after:
+            try:
+                return connection.smtp.noop()[0] == 250
+            except CONNECTION_ERRORS + (smtplib.SMTPException,):
+                return False
+        return True
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            while True:
+                if self._idle:
+                    # LIFO : la connexion la plus récemment utilisée est la plus sûre
+                    connection = self._idle.pop()
+                    break
+                if self._open < self.max_connections:
+                    self._open += 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise PoolTimeout('Aucune connexion SMTP disponible')
+
+        # Réseau hors verrou : un serveur lent ne bloque pas les autres threads
+        if connection is not None:
+            if self._is_usable(connection):
+                self.reuses += 1
+                connection.reused = True
+                return connection
+            connection.close()
+        try:
+            return self._connect()
+        except Exception:
+            self._discard()
+            raise
+
+    def _discard(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def _checkin(self, connection):
+        connection.last_used = time.monotonic()
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def _lease(self):
+        connection = self._checkout()
+        try:
+            yield connection
+        except CONNECTION_ERRORS:
+            connection.close()
+            self._discard()
+            raise
+        except BaseException:
+            self._checkin(connection)
+            raise
+        else:
+            self._checkin(connection)
+
+    @contextmanager
+    def connection(self):
+        """Prête une session SMTP ; elle est rendue au pool, ou fermée si elle a échoué"""
+        with self._lease() as connection:
+            yield connection.smtp
+
+    def send_message(self, msg):
+        """
+        Envoie un message sur une connexion du pool. Si une session réutilisée
+        a été coupée par le serveur, un seul nouvel essai est fait sur une
+        connexion neuve ; un échec de connexion neuve est remonté tel quel.
+        """
+        connection = None
+        try:
+            with self._lease() as connection:
+                return connection.smtp.send_message(msg)
+        except CONNECTION_ERRORS:
+            if connection is None or not connection.reused:
+                raise
+        with self.connection() as smtp:
+            return smtp.send_message(msg)
+
+    def close_all(self):
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'open': self._open,
+                'idle': len(self._idle),
+                'connects': self.connects,
+                'reuses': self.reuses
+            }
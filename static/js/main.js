@@ -32,9 +32,24 @@ function loadCart() {
 
 function saveCart() {
     sessionStorage.setItem('koasa_cart', JSON.stringify(cart));
+    // Panier modifié = nouvelle commande, donc nouvelle clé d'idempotence
+    sessionStorage.removeItem('koasa_order_key');
     updateCartBadge();
 }
 
+// Clé d'idempotence de la commande en cours : réutilisée par les nouvelles
+// tentatives pour que le serveur ne crée jamais la commande deux fois
+function getOrderIdempotencyKey() {
+    let key = sessionStorage.getItem('koasa_order_key');
+    if (!key) {
+        key = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+        sessionStorage.setItem('koasa_order_key', key);
+    }
+    return key;
+}
+
 function addToCart(productId, productName, price, unit) {
     // Vérifier si le produit est disponible
     const productCard = document.querySelector(`[data-product-id="${productId}"]`);
@@ -287,7 +302,10 @@ async function sendOrderByWhatsApp() {
         
         const response = await fetch('/api/send-order-whatsapp', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': getOrderIdempotencyKey()
+            },
             body: JSON.stringify({
                 items: cartItems,
                 total: total,
@@ -54,6 +54,26 @@ self.addEventListener('fetch', event => {
     return;
   }
 
+  // API catalogue : réseau d'abord (le navigateur revalide via ETag → 304),
+  // copie locale seulement hors connexion
+  if (url.pathname.startsWith('/api/products')) {
+    event.respondWith(
+      fetch(event.request)
+        .then(response => {
+          if (response && response.status === 200) {
+            const responseToCache = response.clone();
+            caches.open(RUNTIME_CACHE)
+              .then(cache => {
+                cache.put(event.request, responseToCache);
+              });
+          }
+          return response;
+        })
+        .catch(() => caches.match(event.request))
+    );
+    return;
+  }
+
   event.respondWith(
     caches.match(event.request)
       .then(cachedResponse => {
@@ -1,9 +1,68 @@
 import unittest
 import os
+import re
+import urllib.parse
+import threading
+import time
 import tempfile
-from app import app, db
-from models import User, Product, Order
-from datetime import datetime, timezone
+import subprocess
+import sys
+import json
+import io
+import zipfile
+import pstats
+import smtplib
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from sqlalchemy import event
+from app import app, db, compute_order_stats
+from models import (User, Product, Order, OrderItem, Category, OutboxMessage, RateLimitBucket, ShortLink,
+                    normalize_phone, normalize_stored_phones)
+from catalog_cache import catalog_cache, CatalogCache
+from user_cache import user_cache, USER_CACHE_CONFIG
+import auth
+import rate_limit
+from rate_limit import reset_rate_limits
+import metrics
+import profiler
+import generate_fixtures
+import invoice_cache
+import invoice_export
+from smtp_pool import SMTPConnectionPool
+import outbox
+import email_templates
+import shortlinks
+from utils import build_email_message
+import whatsapp_cloud
+from whatsapp_mock_server import MockWhatsAppServer, sign, status_payload, load_replay_payloads
+from search import apply_product_search, fold_text
+
+def capture_queries(func):
+    """Exécute func() et retourne (résultat, instructions SQL émises)"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, statements
+
+def count_queries(func):
+    """Exécute func() et compte les requêtes SQL émises"""
+    result, statements = capture_queries(func)
+    return result, len(statements)
+
+def product_selects(func):
+    """Exécute func() et compte les SELECT sur la table products"""
+    result, statements = capture_queries(func)
+    return result, sum(1 for statement in statements
+                       if statement.lstrip().upper().startswith('SELECT') and 'FROM products' in statement)
 
 class TestApp(unittest.TestCase):
     
@@ -22,6 +81,8 @@ class TestApp(unittest.TestCase):
         with self.app.app_context():
             db.session.remove()
             db.drop_all()
+        user_cache.invalidate()
+        reset_rate_limits()
     
     def test_home_page(self):
         """Test de la page d'accueil"""
@@ -174,5 +235,1653 @@ class TestApp(unittest.TestCase):
             user2.generate_otp()
             self.assertFalse(user2.verify_otp('000000'))
 
+class ShopTestCase(unittest.TestCase):
+    """Base : un produit en stock, un client vérifié et un admin"""
+    
+    STOCK = 10
+    
+    def setUp(self):
+        self.app = app
+        self.app.config['TESTING'] = True
+        self.app.config['SECRET_KEY'] = 'test-secret'
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        
+        with self.app.app_context():
+            db.create_all()
+            category = Category(name='Mouton')
+            db.session.add(category)
+            db.session.commit()
+            product = Product(name='Mouton - Gigot', price=3800, category_id=category.id, stock=self.STOCK)
+            user = User(email='awa@test.com', phone='+22670111111', first_name='Awa',
+                        last_name='Ouedraogo', whatsapp_verified=True)
+            user.set_password('client12345')
+            admin = User(email='admin@test.com', phone='+22670000000', first_name='Admin',
+                         last_name='Test', whatsapp_verified=True, is_admin=True)
+            admin.set_password('admin12345')
+            db.session.add_all([product, user, admin])
+            db.session.commit()
+            self.product_id = product.id
+            self.user_id = user.id
+            self.admin_id = admin.id
+        
+        catalog_cache.invalidate()
+    
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        user_cache.invalidate()
+        reset_rate_limits()
+        catalog_cache.invalidate()
+    
+    def client_for(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    
+    def order(self, client, quantity=1):
+        return client.post('/api/send-order-whatsapp', json={
+            'items': [{'product_id': self.product_id, 'quantity': quantity}]
+        })
+    
+    def stock(self):
+        with self.app.app_context():
+            return db.session.get(Product, self.product_id).stock
+
+class TestCatalogCache(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+        
+        with self.app.app_context():
+            category = Category(name='Bœuf', icon='fas fa-drumstick-bite')
+            db.session.add(category)
+            db.session.commit()
+            db.session.add(Product(name='Bœuf - Entrecôte', price=4500, category_id=category.id, stock=50))
+            db.session.commit()
+            self.category_id = category.id
+    
+    def test_anonymous_catalog_served_from_cache(self):
+        """Le deuxième affichage du catalogue ne touche pas la base"""
+        response, first_count = count_queries(lambda: self.client.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Entrecôte'.encode('utf-8'), response.data)
+        self.assertGreater(first_count, 0)
+        
+        response, second_count = count_queries(lambda: self.client.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Entrecôte'.encode('utf-8'), response.data)
+        self.assertEqual(second_count, 0)
+    
+    def test_storefront_search(self):
+        """La recherche de la vitrine ignore les accents"""
+        response = self.client.get('/?search=boeuf')
+        self.assertIn('Entrecôte'.encode('utf-8'), response.data)
+        response = self.client.get('/?search=agneau')
+        self.assertIn('Aucun produit trouvé'.encode('utf-8'), response.data)
+    
+    def test_admin_write_invalidates_catalog(self):
+        """Un produit créé par l'admin apparaît immédiatement"""
+        self.client.get('/')
+        version = catalog_cache.version
+        
+        self.client.post('/login', data={'login': 'admin@test.com', 'password': 'admin12345'})
+        response = self.client.post('/admin/api/products', json={
+            'name': 'Poulet - Cuisses',
+            'price': 3800,
+            'category_id': self.category_id
+        })
+        self.assertTrue(response.get_json()['success'])
+        self.assertGreater(catalog_cache.version, version)
+        
+        self.client.get('/logout')
+        response = self.client.get('/')
+        self.assertIn(b'Poulet - Cuisses', response.data)
+    
+    def test_cache_is_bounded(self):
+        """Le cache évince les entrées les moins récemment utilisées"""
+        original_max = catalog_cache.max_entries
+        catalog_cache.max_entries = 4
+        try:
+            for i in range(10):
+                catalog_cache.get_or_load(('test', i), lambda: i)
+            self.assertEqual(catalog_cache.stats()['entries'], 4)
+        finally:
+            catalog_cache.max_entries = original_max
+    
+    def test_products_api_keyset_pagination(self):
+        """Pagination par curseur et sélection de champs"""
+        with self.app.app_context():
+            for i in range(4):
+                db.session.add(Product(name=f'Produit {i}', price=1000 + i, category_id=self.category_id))
+            db.session.commit()
+        
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/products?limit=2&fields=id,name'
+            if cursor:
+                url += f'&cursor={cursor}'
+            data = self.client.get(url).get_json()
+            self.assertTrue(data['success'])
+            for product in data['products']:
+                self.assertEqual(set(product), {'id', 'name'})
+            seen.extend(p['id'] for p in data['products'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(seen, sorted(seen))
+        
+        self.assertEqual(self.client.get('/api/products?fields=password').status_code, 400)
+        self.assertEqual(self.client.get('/api/products?cursor=%%%').status_code, 400)
+    
+    def test_products_api_etag(self):
+        """Une revalidation avec le même ETag coûte un 304"""
+        response = self.client.get('/api/products')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        
+        response = self.client.get('/api/products', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        with self.app.app_context():
+            product = Product.query.first()
+            product.price = 5000
+            db.session.commit()
+        catalog_cache.invalidate()
+        
+        response = self.client.get('/api/products', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+class TestProductSearch(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            boeuf = Category(name='Bœuf')
+            volaille = Category(name='Volaille')
+            db.session.add_all([boeuf, volaille])
+            db.session.commit()
+            db.session.add_all([
+                Product(name='Bœuf - Entrecôte', description='Viande tendre', price=4500, category_id=boeuf.id),
+                Product(name='Saucisses', description='Saucisses de bœuf épicées', price=1800, category_id=boeuf.id),
+                Product(name='Poulet entier', description='Poulet fermier', price=2500, category_id=volaille.id)
+            ])
+            db.session.commit()
+    
+    def search(self, search_query):
+        return [p.name for p in apply_product_search(Product.query, search_query).all()]
+    
+    def test_fold_text(self):
+        """Normalisation des accents et ligatures"""
+        self.assertEqual(fold_text('Bœuf - Entrecôte'), 'boeuf - entrecote')
+    
+    def test_accent_insensitive_search(self):
+        """'boeuf' trouve 'Bœuf - Entrecôte', le nom passe avant la description"""
+        with self.app.app_context():
+            self.assertEqual(self.search('boeuf'), ['Bœuf - Entrecôte', 'Saucisses'])
+            self.assertEqual(self.search('ENTRECOTE'), ['Bœuf - Entrecôte'])
+            self.assertEqual(self.search('entrec'), ['Bœuf - Entrecôte'])
+    
+    def test_category_name_is_searchable(self):
+        """La recherche couvre le nom de la catégorie"""
+        with self.app.app_context():
+            self.assertEqual(self.search('volaille'), ['Poulet entier'])
+    
+    def test_index_follows_writes(self):
+        """L'index suit les modifications et suppressions"""
+        with self.app.app_context():
+            product = Product.query.filter_by(name='Poulet entier').first()
+            product.name = 'Pintade'
+            db.session.commit()
+            self.assertEqual(self.search('pintade'), ['Pintade'])
+            self.assertEqual(self.search('poulet entier'), [])
+            
+            category = Category.query.filter_by(name='Volaille').first()
+            category.name = 'Oiseaux'
+            db.session.commit()
+            self.assertEqual(self.search('oiseaux'), ['Pintade'])
+            
+            db.session.delete(product)
+            db.session.commit()
+            self.assertEqual(self.search('pintade'), [])
+
+class TestOrderStats(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+        
+        with self.app.app_context():
+            statuses = ['en_attente', 'en_attente', 'confirme', 'preparation', 'livree', 'livree']
+            for i, status in enumerate(statuses):
+                db.session.add(Order(
+                    user_id=self.user_id if i % 2 else self.admin_id,
+                    order_number=f'KO-TEST-{i}',
+                    whatsapp_order_id=f'CMD-TEST-{i}',
+                    total_amount=1000 * (i + 1),
+                    status=status
+                ))
+            db.session.commit()
+    
+    def test_stats_aggregate(self):
+        """Comptes par statut et chiffre d'affaires calculés en SQL"""
+        with self.app.app_context():
+            stats = compute_order_stats()
+            self.assertEqual(stats['total'], 6)
+            self.assertEqual(stats['en_attente'], 2)
+            self.assertEqual(stats['confirme'], 1)
+            self.assertEqual(stats['preparation'], 1)
+            self.assertEqual(stats['livree'], 2)
+            self.assertEqual(stats['total_sales'], 21000)
+    
+    def test_stats_share_filters(self):
+        """Les statistiques suivent les filtres recherche et statut"""
+        with self.app.app_context():
+            stats = compute_order_stats(search_query='Awa')
+            self.assertEqual(stats['total'], 3)
+            self.assertEqual(stats['total_sales'], 2000 + 4000 + 6000)
+            
+            stats = compute_order_stats(status_filter='livree')
+            self.assertEqual(stats['total'], 2)
+            self.assertEqual(stats['en_attente'], 0)
+    
+    def test_stats_endpoint(self):
+        """Endpoint JSON réservé aux admins"""
+        self.client.post('/login', data={'login': 'admin@test.com', 'password': 'admin12345'})
+        data = self.client.get('/admin/api/orders/stats?status=en_attente').get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['stats']['total'], 2)
+        
+        response = self.client.get('/admin/orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'CMD-TEST-5', response.data)
+    
+    def add_orders(self, count):
+        with self.app.app_context():
+            start = Order.query.count()
+            for i in range(start, start + count):
+                db.session.add(Order(user_id=self.user_id, order_number=f'KO-TEST-{i}',
+                                     whatsapp_order_id=f'CMD-TEST-{i}', total_amount=500))
+            db.session.commit()
+    
+    def test_orders_keyset_pagination(self):
+        """Toutes les commandes parcourues une seule fois, des plus récentes aux plus anciennes"""
+        self.add_orders(5)
+        self.client.post('/login', data={'login': 'admin@test.com', 'password': 'admin12345'})
+        
+        seen = []
+        url = '/admin/orders?limit=4'
+        while url:
+            html = self.client.get(url).get_data(as_text=True)
+            seen.extend(re.findall(r'id="order-row-(\d+)"', html))
+            match = re.search(r'href="(/admin/orders\?[^"]*cursor=[^"]+)"', html)
+            url = match.group(1).replace('&amp;', '&') + '&limit=4' if match else None
+        
+        self.assertEqual(len(seen), 11)
+        self.assertEqual(len(set(seen)), 11)
+    
+    def test_order_list_query_count_is_constant(self):
+        """Le nombre de requêtes ne dépend pas du nombre de commandes"""
+        self.client.post('/login', data={'login': 'admin@test.com', 'password': 'admin12345'})
+        self.client.get('/admin/orders')  # utilisateur connecté mis en cache
+        _, small = count_queries(lambda: self.client.get('/admin/orders'))
+        self.add_orders(30)
+        _, large = count_queries(lambda: self.client.get('/admin/orders'))
+        self.assertEqual(small, large)
+    
+    def test_order_details_endpoint(self):
+        """Détails chargés à la demande, en une requête"""
+        self.client.post('/login', data={'login': 'admin@test.com', 'password': 'admin12345'})
+        with self.app.app_context():
+            order_id = Order.query.filter_by(whatsapp_order_id='CMD-TEST-1').first().id
+        
+        response, queries = count_queries(lambda: self.client.get(f'/admin/api/orders/{order_id}'))
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['order']['customer']['first_name'], 'Awa')
+        self.assertEqual(data['order']['items'], [])
+        # Chargement de l'admin connecté + commande
+        self.assertEqual(queries, 2)
+        
+        self.assertEqual(self.client.get('/admin/api/orders/999999').status_code, 404)
+
+class TestOrderSubmission(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            category = Category(name='Bœuf')
+            db.session.add(category)
+            db.session.commit()
+            products = [
+                Product(name=f'Morceau {i}', price=1000 * (i + 1), category_id=category.id, stock=100)
+                for i in range(15)
+            ]
+            products.append(Product(name='Épuisé', price=500, category_id=category.id, is_available=False))
+            db.session.add_all(products)
+            db.session.commit()
+            self.product_ids = [p.id for p in products]
+        
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'login': 'awa@test.com', 'password': 'client12345'})
+    
+    def test_cart_priced_with_one_product_query(self):
+        """Un panier de 15 lignes = une seule requête produits"""
+        items = [{'product_id': pid, 'quantity': 2} for pid in self.product_ids[:15]]
+        response, selects = product_selects(lambda: self.client.post('/api/send-order-whatsapp', json={'items': items}))
+        
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(selects, 1)
+        
+        with self.app.app_context():
+            order = Order.query.filter_by(whatsapp_order_id=data['order_id']).first()
+            self.assertEqual(len(order.items), 15)
+            self.assertEqual(order.total_amount, sum(2 * 1000 * (i + 1) for i in range(15)))
+    
+    def test_invalid_lines_are_rejected(self):
+        """Lignes indisponibles ou invalides ignorées, prix serveur appliqués"""
+        response = self.client.post('/api/cart/quote', json={'items': [
+            {'product_id': self.product_ids[0], 'quantity': 3, 'price': 1},
+            {'product_id': self.product_ids[15], 'quantity': 1},
+            {'product_id': 999999, 'quantity': 1},
+            {'product_id': self.product_ids[1], 'quantity': 'abc'},
+        ]})
+        data = response.get_json()
+        self.assertEqual(data['total'], 3000)
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual(len(data['rejected']), 3)
+        
+        response = self.client.post('/api/send-order-whatsapp', json={'items': [
+            {'product_id': self.product_ids[15], 'quantity': 1}
+        ]})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_malformed_items_answer_400(self):
+        """JSON valide mais items qui n'est pas une liste : 400, pas 500"""
+        for body in ({'items': 5}, {'items': 'x'}, {'items': {'product_id': 1}}, [1, 2]):
+            with self.subTest(body=body):
+                for url in ('/api/cart/quote', '/api/send-order-whatsapp'):
+                    response = self.client.post(url, json=body)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertFalse(response.get_json()['success'])
+    
+    def test_non_finite_quantities_are_rejected(self):
+        """nan, inf et 1e309 ne donnent jamais un total nan/inf"""
+        product_id = self.product_ids[0]
+        # Chaînes lues par float() et littéraux JSON acceptés par le décodeur
+        bodies = [json.dumps({'items': [{'product_id': product_id, 'quantity': quantity}]})
+                  for quantity in ('nan', 'inf', '1e309')]
+        bodies += [f'{{"items": [{{"product_id": {product_id}, "quantity": {quantity}}}]}}'
+                   for quantity in ('NaN', 'Infinity', '1e309')]
+        for body in bodies:
+            with self.subTest(body=body):
+                data = self.client.post('/api/cart/quote', data=body, content_type='application/json').get_json()
+                self.assertEqual(data['total'], 0)
+                self.assertEqual(data['rejected'][0]['reason'], 'quantite_invalide')
+                response = self.client.post('/api/send-order-whatsapp', data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), 0)
+
+class TestStockReservation(ShopTestCase):
+    
+    @mock.patch.dict(rate_limit.RATE_LIMIT_CONFIG, {'enabled': False})  # 50 commandes d'un même client
+    def test_concurrent_orders_never_oversell(self):
+        """Commandes simultanées sur un même produit : jamais de survente"""
+        statuses = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(25)
+        
+        def worker():
+            client = self.client_for(self.user_id)
+            barrier.wait()
+            for _ in range(2):
+                response = self.order(client)
+                with lock:
+                    statuses.append(response.status_code)
+        
+        threads = [threading.Thread(target=worker) for _ in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # 50 commandes pour 10 unités : exactement 10 acceptées, toutes les autres en 409
+        self.assertEqual(statuses.count(200), self.STOCK)
+        self.assertEqual(statuses.count(409), len(statuses) - self.STOCK)
+        self.assertEqual(self.stock(), 0)
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), self.STOCK)
+        
+        self.assertEqual(self.order(self.client_for(self.user_id)).status_code, 409)
+    
+    def test_fractional_quantity_and_out_of_stock(self):
+        """1.5 kg réserve 2 unités ; au-delà du stock : 409 sans rien réserver"""
+        client = self.client_for(self.user_id)
+        self.assertEqual(self.order(client, 1.5).status_code, 200)
+        self.assertEqual(self.stock(), self.STOCK - 2)
+        
+        response = self.order(client, self.STOCK)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stock(), self.STOCK - 2)
+    
+    def test_cancellation_releases_stock(self):
+        """Annuler restitue le stock, réactiver le reprend"""
+        self.order(self.client_for(self.user_id), 3)
+        self.assertEqual(self.stock(), self.STOCK - 3)
+        
+        with self.app.app_context():
+            order_id = Order.query.first().id
+        admin = self.client_for(self.admin_id)
+        
+        admin.post(f'/admin/update-order-status/{order_id}', json={'status': 'annulee'})
+        self.assertEqual(self.stock(), self.STOCK)
+        admin.post(f'/admin/update-order-status/{order_id}', json={'status': 'annulee'})
+        self.assertEqual(self.stock(), self.STOCK)
+        
+        admin.post(f'/admin/update-order-status/{order_id}', json={'status': 'confirme'})
+        self.assertEqual(self.stock(), self.STOCK - 3)
+    
+    def test_order_discards_only_affected_catalog_entries(self):
+        """Une commande rafraîchit le stock affiché sans vider le reste du catalogue"""
+        with self.app.app_context():
+            volaille = Category(name='Volaille')
+            db.session.add(volaille)
+            db.session.commit()
+            db.session.add(Product(name='Poulet entier', price=2500, category_id=volaille.id, stock=20))
+            db.session.commit()
+            volaille_url = f'/?category={volaille.id}'
+        visitor = self.app.test_client()
+        visitor.get('/')
+        visitor.get(volaille_url)
+        version = catalog_cache.version
+        
+        self.assertEqual(self.order(self.client_for(self.user_id), 3).status_code, 200)
+        self.assertEqual(catalog_cache.version, version)
+        
+        response, queries = count_queries(lambda: visitor.get(volaille_url))
+        self.assertIn(b'Poulet entier', response.data)
+        self.assertEqual(queries, 0)
+        self.assertIn(f'Stock: {self.STOCK - 3}'.encode(), visitor.get('/').data)
+        
+        # Statut changé sans mouvement de stock : rien n'est invalidé
+        with self.app.app_context():
+            order_id = Order.query.first().id
+        _, queries = count_queries(lambda: visitor.get('/'))
+        self.assertEqual(queries, 0)
+        self.client_for(self.admin_id).post(f'/admin/update-order-status/{order_id}', json={'status': 'livre'})
+        _, queries = count_queries(lambda: visitor.get('/'))
+        self.assertEqual(queries, 0)
+
+class TestOrderIdentifiers(ShopTestCase):
+    
+    def test_identifiers_are_sequential(self):
+        """Identifiants courts, monotones et sans collision"""
+        with self.app.app_context():
+            numbers = []
+            for _ in range(5):
+                order = Order(user_id=self.user_id, total_amount=0)
+                order.generate_order_number()
+                order.generate_whatsapp_order_id()
+                db.session.add(order)
+                db.session.commit()
+                numbers.append((order.order_number, order.whatsapp_order_id))
+            
+            sequence = [int(wid.rsplit('-', 1)[1]) for _, wid in numbers]
+            self.assertEqual(sequence, list(range(sequence[0], sequence[0] + 5)))
+            for order_number, whatsapp_order_id in numbers:
+                self.assertRegex(order_number, r'^KO-\d{8}-\d{6}$')
+                self.assertRegex(whatsapp_order_id, r'^CMD-\d{6}-\d{4,}$')
+                self.assertEqual(order_number[-4:], whatsapp_order_id[-4:])
+    
+    def test_rolled_back_order_does_not_consume_number(self):
+        """SQLite : le compteur suit la transaction de la commande"""
+        with self.app.app_context():
+            first = Order(user_id=self.user_id, total_amount=0)
+            first.generate_whatsapp_order_id()
+            db.session.rollback()
+            
+            second = Order(user_id=self.user_id, total_amount=0)
+            self.assertEqual(second.generate_whatsapp_order_id(), first.whatsapp_order_id)
+
+class TestIdempotency(ShopTestCase):
+    
+    def post(self, client, key, quantity=1):
+        return client.post('/api/send-order-whatsapp', headers={'Idempotency-Key': key}, json={
+            'items': [{'product_id': self.product_id, 'quantity': quantity}]
+        })
+    
+    def test_replay_returns_stored_response(self):
+        """Une requête rejouée renvoie la même commande sans en créer une autre"""
+        client = self.client_for(self.user_id)
+        first = self.post(client, 'cle-1')
+        self.assertEqual(first.status_code, 200)
+        
+        replay, selects = product_selects(lambda: self.post(client, 'cle-1'))
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(selects, 0)
+        self.assertEqual(replay.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(replay.get_json()['order_id'], first.get_json()['order_id'])
+        
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+        self.assertEqual(self.stock(), self.STOCK - 1)
+    
+    def test_key_reused_with_other_payload(self):
+        """Même clé, autre panier : 422"""
+        client = self.client_for(self.user_id)
+        self.post(client, 'cle-2')
+        self.assertEqual(self.post(client, 'cle-2', quantity=2).status_code, 422)
+    
+    def test_failed_request_releases_key(self):
+        """Après un échec, la même clé peut être réessayée"""
+        client = self.client_for(self.user_id)
+        self.assertEqual(self.post(client, 'cle-3', quantity=self.STOCK + 1).status_code, 409)
+        
+        with self.app.app_context():
+            product = db.session.get(Product, self.product_id)
+            product.stock = self.STOCK * 2
+            db.session.commit()
+        
+        self.assertEqual(self.post(client, 'cle-3', quantity=self.STOCK + 1).status_code, 200)
+    
+    def test_concurrent_duplicates_create_one_order(self):
+        """Doublons simultanés : une seule commande"""
+        statuses = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(10)
+        
+        def worker():
+            client = self.client_for(self.user_id)
+            barrier.wait()
+            response = self.post(client, 'cle-concurrente')
+            with lock:
+                statuses.append(response.status_code)
+        
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        with self.app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+        self.assertEqual(self.stock(), self.STOCK - 1)
+        self.assertIn(200, statuses)
+        self.assertTrue(set(statuses) <= {200, 409})
+
+class TestInvoiceCache(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.config = dict(invoice_cache.INVOICE_CACHE_CONFIG)
+        invoice_cache.INVOICE_CACHE_CONFIG['directory'] = self.cache_dir.name
+        self.client = self.client_for(self.user_id)
+        self.order(self.client)
+        with self.app.app_context():
+            self.order_id = Order.query.one().id
+    
+    def tearDown(self):
+        invoice_cache.INVOICE_CACHE_CONFIG.update(self.config)
+        self.cache_dir.cleanup()
+        super().tearDown()
+    
+    def download(self, **headers):
+        return self.client.get(f'/download-invoice/{self.order_id}', headers=headers)
+    
+    def test_repeat_download_is_not_rendered_again(self):
+        """Deuxième téléchargement : fichier en cache, 304 si l'ETag correspond"""
+        with mock.patch.object(invoice_cache, 'generate_invoice_pdf',
+                               wraps=invoice_cache.generate_invoice_pdf) as render:
+            first = self.download()
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.data.startswith(b'%PDF'))
+            etag = first.headers['ETag']
+            first.close()
+            
+            second = self.download()
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual(second.headers['ETag'], etag)
+            second.close()
+            
+            revalidated = self.download(**{'If-None-Match': etag})
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(render.call_count, 1)
+    
+    def test_status_change_renders_new_invoice(self):
+        """La clé suit order.updated_at : une facture modifiée n'est jamais périmée"""
+        first = self.download()
+        etag = first.headers['ETag']
+        first.close()
+        
+        admin = self.client_for(self.admin_id)
+        response = admin.post(f'/admin/update-order-status/{self.order_id}', json={'status': 'livree'})
+        self.assertEqual(response.status_code, 200)
+        
+        second = self.download(**{'If-None-Match': etag})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], etag)
+        second.close()
+    
+    def test_eviction_removes_least_recently_used(self):
+        """Au-delà de la taille maximale, les fichiers les plus anciens partent"""
+        paths = []
+        for index in range(3):
+            path = os.path.join(self.cache_dir.name, f'{index}.pdf')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (1000 + index, 1000 + index))
+            paths.append(path)
+        # Le premier fichier vient d'être servi : il devient le plus récent
+        os.utime(paths[0], (2000, 2000))
+        
+        self.assertEqual(invoice_cache.evict_invoices(max_bytes=200), 1)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+class TestInvoiceExport(ShopTestCase):
+    
+    @classmethod
+    def tearDownClass(cls):
+        invoice_export.shutdown_export_pool()
+    
+    def create_orders(self, created_at, count):
+        with self.app.app_context():
+            for _ in range(count):
+                order = Order(user_id=self.user_id, total_amount=3800, created_at=created_at)
+                order.generate_order_number()
+                order.generate_whatsapp_order_id()
+                db.session.add(order)
+            db.session.commit()
+    
+    def test_export_streams_zip_for_date_range(self):
+        """Une facture par commande de la période, plus le rapport de débit"""
+        self.create_orders(datetime(2024, 3, 1, 9, 0), 3)
+        self.create_orders(datetime(2024, 3, 31, 23, 0), 2)
+        self.create_orders(datetime(2024, 4, 1, 8, 0), 1)
+        
+        admin = self.client_for(self.admin_id)
+        response = admin.get('/admin/export-invoices?start=2024-03-01&end=2024-03-31')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/zip')
+        
+        archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+        invoices = [name for name in archive.namelist() if name.endswith('.pdf')]
+        self.assertEqual(len(invoices), 5)
+        self.assertTrue(archive.read(invoices[0]).startswith(b'%PDF'))
+        report = archive.read('rapport.txt').decode('utf-8')
+        self.assertIn('Factures: 5', report)
+        self.assertIn('pages/s', report)
+    
+    def test_export_validates_request(self):
+        """Réservé aux admins, dates obligatoires"""
+        client = self.client_for(self.user_id)
+        self.assertEqual(client.get('/admin/export-invoices?start=2024-03-01&end=2024-03-31').status_code, 403)
+        
+        admin = self.client_for(self.admin_id)
+        self.assertEqual(admin.get('/admin/export-invoices?start=2024-03-01').status_code, 400)
+        self.assertEqual(admin.get('/admin/export-invoices?start=2024-03-31&end=2024-03-01').status_code, 400)
+
+class TestSMTPPool(unittest.TestCase):
+    
+    SETTINGS = {'host': 'smtp.test', 'port': 587, 'starttls': True,
+                'username': 'koasa@test.com', 'password': 'secret'}
+    
+    def setUp(self):
+        patcher = mock.patch('smtp_pool.smtplib.SMTP')
+        self.smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.smtp_class.side_effect = lambda *args, **kwargs: mock.MagicMock(**{'noop.return_value': (250, b'OK')})
+    
+    def test_burst_reuses_authenticated_session(self):
+        """Dix emails : une seule connexion, un seul LOGIN"""
+        pool = SMTPConnectionPool(self.SETTINGS, max_connections=2)
+        for _ in range(10):
+            pool.send_message(mock.sentinel.msg)
+        
+        self.assertEqual(self.smtp_class.call_count, 1)
+        smtp = pool._idle[0].smtp
+        smtp.starttls.assert_called_once()
+        smtp.login.assert_called_once_with('koasa@test.com', 'secret')
+        self.assertEqual(smtp.send_message.call_count, 10)
+        self.assertEqual(pool.stats()['reuses'], 9)
+    
+    def test_dropped_session_is_replaced(self):
+        """Session coupée par le serveur : reconnexion et nouvel essai"""
+        pool = SMTPConnectionPool(self.SETTINGS)
+        pool.send_message(mock.sentinel.msg)
+        stale = pool._idle[0].smtp
+        stale.send_message.side_effect = smtplib.SMTPServerDisconnected()
+        
+        pool.send_message(mock.sentinel.msg)
+        self.assertEqual(self.smtp_class.call_count, 2)
+        self.assertIsNot(pool._idle[0].smtp, stale)
+        self.assertEqual(pool.stats()['open'], 1)
+    
+    def test_idle_and_old_sessions_are_checked(self):
+        """NOOP après inactivité, fermeture après max_age"""
+        pool = SMTPConnectionPool(self.SETTINGS, noop_after=0, max_age=60)
+        pool.send_message(mock.sentinel.msg)
+        connection = pool._idle[0]
+        connection.last_used -= 1
+        pool.send_message(mock.sentinel.msg)
+        connection.smtp.noop.assert_called_once()
+        self.assertEqual(self.smtp_class.call_count, 1)
+        
+        connection.created_at -= 120
+        pool.send_message(mock.sentinel.msg)
+        connection.smtp.quit.assert_called_once()
+        self.assertEqual(self.smtp_class.call_count, 2)
+
+class TestOutbox(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('outbox.smtp_pool.send_message')
+        self.send_message = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def request_reset(self):
+        client = self.app.test_client()
+        return client.post('/forgot-password', data={'email': 'awa@test.com'})
+    
+    def test_reset_email_is_queued_not_sent(self):
+        """La requête n'attend pas le serveur SMTP : le message est en file"""
+        self.send_message.side_effect = AssertionError('envoi synchrone')
+        response = self.request_reset()
+        self.assertEqual(response.status_code, 302)
+        
+        with self.app.app_context():
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.recipient, 'awa@test.com')
+            self.assertEqual(message.status, 'pending')
+            self.assertIsNotNone(db.session.get(User, self.user_id).reset_token)
+    
+    def test_worker_sends_due_messages(self):
+        """Un lot envoyé : statut sent et latence mesurée"""
+        self.request_reset()
+        with self.app.app_context():
+            self.assertEqual(outbox.process_outbox_batch(), 1)
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.status, 'sent')
+            self.assertEqual(message.attempts, 1)
+            self.assertEqual(outbox.process_outbox_batch(), 0)
+        
+        sent = self.send_message.call_args[0][0]
+        self.assertEqual(sent['To'], 'awa@test.com')
+        self.assertIn('Réinitialisation', sent['Subject'])
+    
+    def test_failures_back_off_then_dead_letter(self):
+        """Échecs : reprise différée, puis lettre morte au dernier essai"""
+        self.send_message.side_effect = OSError('SMTP indisponible')
+        self.request_reset()
+        
+        with self.app.app_context():
+            for attempt in range(1, outbox.OUTBOX_CONFIG['max_attempts'] + 1):
+                self.assertEqual(outbox.process_outbox_batch(), 1)
+                message = OutboxMessage.query.one()
+                self.assertEqual(message.attempts, attempt)
+                self.assertIn('SMTP indisponible', message.last_error)
+                if message.status == 'pending':
+                    # Pas de nouvel essai avant l'échéance du backoff
+                    self.assertEqual(outbox.process_outbox_batch(), 0)
+                    message.available_at = datetime(2000, 1, 1)
+                    db.session.commit()
+            self.assertEqual(message.status, 'dead')
+            
+            stats = outbox.outbox_stats()
+            self.assertEqual(stats['dead'], 1)
+            self.assertEqual(stats['pending'], 0)
+            
+            self.assertEqual(outbox.requeue_dead_messages(), 1)
+            self.assertEqual(outbox.outbox_stats()['due'], 1)
+    
+    def test_batch_enqueue_renders_one_message_per_recipient(self):
+        with self.app.app_context():
+            outbox.enqueue_email_batch('verification.html', [
+                (f'client{i}@test.com', {'first_name': f'Client {i}', 'verification_code': f'{i:06d}'})
+                for i in range(5)
+            ])
+            db.session.commit()
+            self.assertEqual(outbox.process_outbox_batch(), 5)
+        
+        recipients = [call[0][0]['To'] for call in self.send_message.call_args_list]
+        self.assertEqual(recipients, [f'client{i}@test.com' for i in range(5)])
+    
+    def test_stats_endpoint_is_admin_only(self):
+        self.request_reset()
+        self.assertEqual(self.client_for(self.user_id).get('/admin/api/outbox/stats').status_code, 403)
+        
+        response = self.client_for(self.admin_id).get('/admin/api/outbox/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['stats']['pending'], 1)
+
+class TestEmailTemplates(unittest.TestCase):
+    
+    def test_templates_are_compiled_once_with_inlined_css(self):
+        """Template compilé au démarrage ; styles déjà dans les balises"""
+        template = email_templates.email_environment.get_template('verification.html')
+        self.assertIs(email_templates.email_environment.get_template('verification.html'), template)
+        
+        email = email_templates.render_email('verification.html', first_name='Awa', verification_code='482913')
+        self.assertEqual(email.subject, '🔐 KOASA - Vérification de votre email')
+        self.assertNotIn('<style', email.html)
+        self.assertIn('class="code" style="font-size: 32px', email.html)
+        self.assertIn('Bonjour Awa,', email.text)
+        self.assertIn('482913', email.text)
+        self.assertNotIn('<', email.text)
+    
+    def test_message_has_plain_text_alternative(self):
+        subject, html, text = email_templates.render_email(
+            'password_reset.html', first_name='Awa', reset_url='https://koasa.bf/reset-password/abc'
+        )
+        msg = build_email_message('awa@test.com', subject, html, text)
+        self.assertEqual(msg.get_content_subtype(), 'alternative')
+        parts = msg.get_payload()
+        self.assertEqual([part.get_content_type() for part in parts], ['text/plain', 'text/html'])
+        self.assertIn('(https://koasa.bf/reset-password/abc)', parts[0].get_payload(decode=True).decode('utf-8'))
+    
+    def test_batch_renders_each_recipient(self):
+        """Contexte échappé et propre à chaque destinataire"""
+        emails = list(email_templates.render_email_batch('verification.html', [
+            {'first_name': 'Awa', 'verification_code': '111111'},
+            {'first_name': '<b>Issa</b>', 'verification_code': '222222'}
+        ]))
+        self.assertEqual(len(emails), 2)
+        self.assertIn('111111', emails[0].html)
+        self.assertNotIn('222222', emails[0].html)
+        self.assertIn('&lt;b&gt;Issa&lt;/b&gt;', emails[1].html)
+
+class TestShortLinks(ShopTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        shortlinks.link_cache.invalidate()
+    
+    def test_order_response_carries_short_link(self):
+        """La réponse contient /w/<code> ; la redirection mène au message complet"""
+        client = self.client_for(self.user_id)
+        payload = self.order(client).get_json()
+        self.assertRegex(payload['whatsapp_url'], r'^/w/[A-Za-z0-9]{8}$')
+        
+        response = client.get(payload['whatsapp_url'])
+        self.assertEqual(response.status_code, 302)
+        location = response.headers['Location']
+        self.assertTrue(location.startswith('https://wa.me/22669628477?text='))
+        self.assertIn(payload['order_id'], urllib.parse.unquote(location))
+        self.assertGreater(len(location), 10 * len(payload['whatsapp_url']))
+    
+    def test_lookup_is_cached_and_clicks_are_counted(self):
+        client = self.client_for(self.user_id)
+        url = self.order(client).get_json()['whatsapp_url']
+        code = url.rsplit('/', 1)[1]
+        
+        client.get(url)
+        # Résolution servie par le cache : seule l'écriture du clic touche la base
+        _, statements = capture_queries(lambda: client.get(url))
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].lstrip().upper().startswith('UPDATE SHORT_LINKS'))
+        
+        # Clics visibles par tout processus, sans attendre un vidage
+        with self.app.app_context():
+            self.assertEqual(ShortLink.query.filter_by(code=code).one().clicks, 2)
+        stats = self.client_for(self.admin_id).get('/admin/api/short-links/stats').get_json()['stats']
+        self.assertEqual(stats['purposes']['commande']['clicks'], 2)
+        self.assertEqual(stats['top_links'][0]['code'], code)
+    
+    def test_expired_or_unknown_code_redirects_home(self):
+        client = self.client_for(self.user_id)
+        code = self.order(client).get_json()['whatsapp_url'].rsplit('/', 1)[1]
+        with self.app.app_context():
+            link = ShortLink.query.filter_by(code=code).one()
+            link.expires_at = datetime(2000, 1, 1)
+            db.session.commit()
+        
+        for path in (f'/w/{code}', '/w/inconnu'):
+            response = client.get(path)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.headers['Location'], '/')
+    
+    def test_same_message_reuses_link(self):
+        """Recharger la page d'activation ne crée pas un nouveau lien"""
+        with self.app.app_context():
+            first = shortlinks.create_short_link('+22670111111', 'Bonjour', 'activation')
+            db.session.commit()
+            self.assertEqual(shortlinks.create_short_link('+22670111111', 'Bonjour', 'activation'), first)
+            self.assertEqual(ShortLink.query.count(), 1)
+    
+    def test_reuse_extends_expiry(self):
+        """Un lien réutilisé vit ttl à partir de sa réutilisation, cache compris"""
+        with self.app.app_context():
+            code = shortlinks.create_short_link('+22670111111', 'Bonjour', 'activation')
+            db.session.commit()
+            link = ShortLink.query.filter_by(code=code).one()
+            link.expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=1)
+            db.session.commit()
+            self.assertIsNotNone(shortlinks.resolve_short_link(code))
+            
+            self.assertEqual(shortlinks.create_short_link('+22670111111', 'Bonjour', 'activation'), code)
+            db.session.commit()
+            expires_at = db.session.get(ShortLink, link.id).expires_at
+            self.assertGreater(expires_at, datetime.now(timezone.utc).replace(tzinfo=None)
+                               + shortlinks.SHORT_LINK_CONFIG['ttl'] - timedelta(minutes=1))
+            shortlinks.resolve_short_link(code)
+            _, cached_expiry = shortlinks.link_cache.get_or_load(('link', code), lambda: None)
+            self.assertEqual(cached_expiry, expires_at)
+
+class TestWhatsAppCloud(ShopTestCase):
+    """Envoi par l'API Cloud, contre le faux serveur local"""
+    
+    def setUp(self):
+        super().setUp()
+        self.server = MockWhatsAppServer(token='test-token', app_secret='test-secret')
+        base_url = self.server.start()
+        patcher = mock.patch.dict(whatsapp_cloud.WHATSAPP_CLOUD_CONFIG, {
+            'token': 'test-token', 'phone_number_id': '123456789', 'api_url': base_url,
+            'app_secret': 'test-secret', 'verify_token': 'verif'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        whatsapp_cloud.dispatcher.close()
+        self.server.stop()
+        super().tearDown()
+    
+    def confirm_order(self):
+        client = self.client_for(self.user_id)
+        order_id = self.order(client).get_json()['order_id']
+        response = self.client_for(self.admin_id).post(f'/admin/confirm-order/{order_id}')
+        self.assertEqual(response.status_code, 200)
+    
+    def enqueue(self, count):
+        with self.app.app_context():
+            for i in range(count):
+                whatsapp_cloud.enqueue_whatsapp(f'+2267011{i:04d}', f'Message {i}', 'test')
+            db.session.commit()
+    
+    def test_confirmation_is_queued_then_delivered(self):
+        self.confirm_order()
+        with self.app.app_context():
+            message = OutboxMessage.query.filter_by(channel='whatsapp').one()
+            self.assertEqual(message.status, 'pending')
+            self.assertEqual(outbox.process_outbox_batch(), 1)
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.status, 'sent')
+            self.assertEqual(message.delivery_status, 'accepted')
+        
+        self.assertEqual(len(self.server.messages), 1)
+        sent = self.server.messages[0]
+        self.assertEqual(message.external_id, sent['id'])
+        self.assertEqual(sent['to'], '22670111111')
+        self.assertIn('confirm', sent['body'].lower())
+    
+    def test_rate_limit_is_retried(self):
+        """Un 429 (avec Retry-After) suspend puis reprend les envois"""
+        self.server.rate_limit_every = 2
+        self.enqueue(3)
+        with self.app.app_context():
+            self.assertEqual(outbox.process_outbox_batch(), 3)
+            self.assertEqual(OutboxMessage.query.filter_by(status='sent').count(), 3)
+        self.assertGreater(self.server.rate_limited, 0)
+        self.assertEqual(len(self.server.messages), 3)
+    
+    def test_concurrency_is_bounded(self):
+        self.server.latency = 0.05
+        with mock.patch.dict(whatsapp_cloud.WHATSAPP_CLOUD_CONFIG, {'concurrency': 2}):
+            self.enqueue(6)
+            with self.app.app_context():
+                self.assertEqual(outbox.process_outbox_batch(), 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+    
+    def test_signed_status_webhook_updates_delivery(self):
+        self.enqueue(1)
+        with self.app.app_context():
+            outbox.process_outbox_batch()
+        wamid = self.server.messages[0]['id']
+        client = self.app.test_client()
+        
+        def post(status, signature=None):
+            body = json.dumps(status_payload(wamid, status, '22670110000')).encode('utf-8')
+            return client.post('/webhooks/whatsapp', data=body, content_type='application/json',
+                               headers={'X-Hub-Signature-256': signature or sign(body, 'test-secret')})
+        
+        self.assertEqual(post('delivered', signature='sha256=faux').status_code, 403)
+        self.assertEqual(post('read').get_json()['applied'], 1)
+        # Un statut arrivé en retard ne fait pas reculer la livraison
+        self.assertEqual(post('delivered').get_json()['applied'], 0)
+        with self.app.app_context():
+            self.assertEqual(OutboxMessage.query.one().delivery_status, 'read')
+    
+    def test_without_configuration_falls_back_to_link(self):
+        with mock.patch.dict(whatsapp_cloud.WHATSAPP_CLOUD_CONFIG, {'token': ''}):
+            self.confirm_order()
+        with self.app.app_context():
+            self.assertEqual(OutboxMessage.query.filter_by(channel='whatsapp').count(), 0)
+        self.assertEqual(self.server.requests, 0)
+
+class TestWhatsAppInbound(ShopTestCase):
+    """Activation automatique par les messages reçus sur le webhook"""
+    
+    FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'whatsapp_inbound.json')
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(whatsapp_cloud.WHATSAPP_CLOUD_CONFIG, {
+            'token': 'test-token', 'phone_number_id': '123456789', 'app_secret': 'test-secret'
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.app.app_context():
+            user = db.session.get(User, self.user_id)
+            user.whatsapp_verified = False
+            self.token = user.generate_activation_token()
+            db.session.commit()
+    
+    def post(self, body, secret='test-secret'):
+        return self.app.test_client().post('/webhooks/whatsapp', data=body, content_type='application/json',
+                                           headers={'X-Hub-Signature-256': sign(body, secret)})
+    
+    def test_replayed_fixture_activates_once(self):
+        """Le renvoi du même webhook par Meta n'active ni ne confirme deux fois"""
+        results = [self.post(body).get_json()['activated']
+                   for body in load_replay_payloads(self.FIXTURE, self.token)]
+        self.assertEqual(results, [1, 0, 0])
+        
+        with self.app.app_context():
+            self.assertTrue(db.session.get(User, self.user_id).whatsapp_verified)
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.channel, 'whatsapp')
+            self.assertEqual(message.recipient, '+22670111111')
+    
+    def test_bad_signature_is_rejected(self):
+        body = load_replay_payloads(self.FIXTURE, self.token)[0]
+        self.assertEqual(self.post(body, secret='autre').status_code, 403)
+        with self.app.app_context():
+            self.assertFalse(db.session.get(User, self.user_id).whatsapp_verified)
+    
+    def inbound(self, *texts, sender='22670111111'):
+        messages = [{'from': sender, 'id': f'wamid.{i}', 'type': 'text', 'text': {'body': text}}
+                    for i, text in enumerate(texts)]
+        body = json.dumps({'entry': [{'changes': [{'value': {'messages': messages}}]}]}).encode('utf-8')
+        return self.post(body).get_json()['activated']
+    
+    def test_unmatched_counts_only_foreign_tokens(self):
+        """Messages sans token et doublons ne comptent pas comme non appariés"""
+        before = dict(whatsapp_cloud.inbound_stats)
+        token_text = f"Mon token d'activation est :\n{self.token}"
+        self.assertEqual(self.inbound('Bonjour', token_text, token_text), 1)
+        self.assertEqual(whatsapp_cloud.inbound_stats['messages'] - before['messages'], 3)
+        self.assertEqual(whatsapp_cloud.inbound_stats['unmatched'], before['unmatched'])
+    
+    def test_confirmation_skipped_without_cloud_api(self):
+        """API Cloud non configurée : compte activé, confirmation comptée comme non envoyée"""
+        skipped = whatsapp_cloud.inbound_stats['confirmations_skipped']
+        with mock.patch.dict(whatsapp_cloud.WHATSAPP_CLOUD_CONFIG, {'token': ''}):
+            self.assertEqual(self.inbound(f"Mon token d'activation est :\n{self.token}"), 1)
+        self.assertEqual(whatsapp_cloud.inbound_stats['confirmations_skipped'], skipped + 1)
+        with self.app.app_context():
+            self.assertTrue(db.session.get(User, self.user_id).whatsapp_verified)
+            self.assertEqual(OutboxMessage.query.count(), 0)
+    
+    def test_batch_is_activated_in_constant_queries(self):
+        with self.app.app_context():
+            users = []
+            for i in range(30):
+                user = User(email=f'client{i}@test.com', phone=f'+2267020{i:04d}',
+                            first_name=f'Client {i}', last_name='Test', password_hash='x')
+                user.generate_activation_token()
+                users.append(user)
+            db.session.add_all(users)
+            db.session.commit()
+            messages = [{'from': user.phone[1:], 'id': f'wamid.{i}', 'type': 'text',
+                         'text': {'body': f"Mon token d'activation est :\n{user.activation_token}"}}
+                        for i, user in enumerate(users)]
+        payload = {'entry': [{'changes': [{'value': {'messages': messages}}]}]}
+        body = json.dumps(payload).encode('utf-8')
+        
+        response, queries = count_queries(lambda: self.post(body))
+        self.assertEqual(response.get_json()['activated'], 30)
+        self.assertLess(queries, 10)
+        with self.app.app_context():
+            self.assertEqual(User.query.filter_by(whatsapp_verified=True).count(), 31)
+    
+    def test_token_from_other_number_is_ignored(self):
+        """Un token envoyé depuis un autre numéro que celui du compte n'active rien"""
+        unmatched = whatsapp_cloud.inbound_stats['unmatched']
+        payload = {'entry': [{'changes': [{'value': {'messages': [
+            {'from': '22670999999', 'id': 'wamid.autre', 'type': 'text',
+             'text': {'body': f"Mon token d'activation est :\n{self.token}"}}
+        ]}}]}]}
+        response = self.post(json.dumps(payload).encode('utf-8'))
+        self.assertEqual(response.get_json()['activated'], 0)
+        self.assertEqual(whatsapp_cloud.inbound_stats['unmatched'], unmatched + 1)
+        with self.app.app_context():
+            self.assertFalse(db.session.get(User, self.user_id).whatsapp_verified)
+            self.assertEqual(OutboxMessage.query.count(), 0)
+
+
+class TestUserCache(ShopTestCase):
+    """current_user servi depuis le cache, invalidé quand le compte change"""
+    
+    def user_selects(self, func):
+        result, statements = capture_queries(func)
+        return result, [statement for statement in statements
+                        if statement.lstrip().upper().startswith('SELECT') and 'FROM users' in statement]
+    
+    def test_repeated_requests_read_only_access_fields(self):
+        """Requête suivante : le principal vient du cache, seuls les droits sont relus"""
+        client = self.client_for(self.user_id)
+        before = user_cache.stats()
+        client.get('/cart')
+        response, selects = self.user_selects(lambda: client.get('/cart'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(selects), 1)
+        self.assertIn('is_admin', selects[0])
+        self.assertNotIn('users.email', selects[0])
+        
+        stats = user_cache.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+    
+    def test_profile_update_invalidates(self):
+        client = self.client_for(self.user_id)
+        client.get('/profile')
+        response = client.post('/profile', data={
+            'first_name': 'Aminata', 'last_name': 'Ouedraogo',
+            'email': 'awa@test.com', 'phone': '+22670111111'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('Aminata', client.get('/profile').get_data(as_text=True))
+    
+    def test_admin_changes_invalidate_target_user(self):
+        client = self.client_for(self.user_id)
+        self.assertEqual(client.get('/admin/api/outbox/stats').status_code, 403)
+        
+        admin = self.client_for(self.admin_id)
+        self.assertTrue(admin.post(f'/admin/toggle-admin/{self.user_id}').get_json()['is_admin'])
+        self.assertEqual(client.get('/admin/api/outbox/stats').status_code, 200)
+    
+    def test_revoked_admin_denied_in_other_worker(self):
+        """Droit retiré dans un processus : refusé aussi par le cache d'un autre processus"""
+        with self.app.app_context():
+            db.session.get(User, self.user_id).is_admin = True
+            db.session.commit()
+        client = self.client_for(self.user_id)
+        other_worker = CatalogCache(**USER_CACHE_CONFIG)
+        with mock.patch('user_cache.user_cache', other_worker):
+            self.assertEqual(client.get('/admin/api/outbox/stats').status_code, 200)
+        
+        admin = self.client_for(self.admin_id)
+        self.assertFalse(admin.post(f'/admin/toggle-admin/{self.user_id}').get_json()['is_admin'])
+        with mock.patch('user_cache.user_cache', other_worker):
+            self.assertEqual(client.get('/admin/api/outbox/stats').status_code, 403)
+            self.assertEqual(other_worker.stats()['hits'], 1)
+    
+    def test_stats_endpoint(self):
+        self.client_for(self.admin_id).get('/cart')
+        response = self.client_for(self.admin_id).get('/admin/api/user-cache/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', response.get_json()['stats'])
+
+class TestLogin(ShopTestCase):
+    """Numéro canonique, recherche par index et vérification du mot de passe"""
+    
+    def login(self, login, password='client12345'):
+        return self.app.test_client().post('/login', data={'login': login, 'password': password})
+    
+    def test_phone_forms_share_one_canonical_value(self):
+        for phone in ('70111111', '22670111111', '0022670111111', '+226 70 11 11 11', '+22670111111'):
+            self.assertEqual(normalize_phone(phone), '+22670111111')
+        with self.app.app_context():
+            user = User(email='moussa@test.com', phone='0022670333333', first_name='Moussa',
+                        last_name='Test', password_hash='x')
+            db.session.add(user)
+            db.session.commit()
+            self.assertEqual(user.phone, '+22670333333')
+    
+    def test_login_with_any_phone_form_or_email(self):
+        for login in ('70111111', '+226 70 11 11 11', 'AWA@test.com'):
+            response = self.login(login)
+            self.assertEqual(response.status_code, 302, login)
+            self.assertEqual(response.headers['Location'], '/')
+        self.assertEqual(self.login('awa@test.com', 'mauvais').status_code, 200)
+    
+    def test_lookup_uses_a_single_column(self):
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM users' in statement:
+                statements.append(statement)
+        
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                self.assertEqual(auth.find_user_by_login('awa@test.com').id, self.user_id)
+                self.assertEqual(auth.find_user_by_login('70111111').id, self.user_id)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        
+        self.assertEqual(len(statements), 2)
+        self.assertIn('users.email =', statements[0])
+        self.assertIn('users.phone =', statements[1])
+        self.assertFalse(any(' OR ' in statement for statement in statements))
+    
+    def test_unknown_user_still_costs_a_hash(self):
+        with mock.patch('auth.check_password_hash', return_value=True) as check:
+            self.assertEqual(self.login('inconnu@test.com').status_code, 200)
+        self.assertEqual(check.call_count, 1)
+    
+    def test_saturated_hash_pool_answers_503(self):
+        with mock.patch('auth._hash_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = self.login('awa@test.com')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(auth.LOGIN_CONFIG['retry_after']))
+    
+    def test_stored_phones_are_migrated(self):
+        with self.app.app_context():
+            db.session.execute(db.update(User).where(User.id == self.user_id).values(phone='70111111'))
+            db.session.commit()
+            self.assertEqual(normalize_stored_phones(), (1, []))
+            self.assertEqual(db.session.get(User, self.user_id).phone, '+22670111111')
+
+class TestRateLimit(ShopTestCase):
+    """Seaux de jetons par route et par clé, réponse 429 avec Retry-After"""
+    
+    def forgot(self, client, email='awa@test.com'):
+        return client.post('/forgot-password', data={'email': email})
+    
+    def test_forgot_password_is_limited_per_email(self):
+        client = self.app.test_client()
+        for _ in range(3):
+            self.assertEqual(self.forgot(client).status_code, 302)
+        response = self.forgot(client)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        self.assertIn('Trop de tentatives', response.get_data(as_text=True))
+        # Les autres adresses ne sont limitées que par IP
+        self.assertEqual(self.forgot(client, 'admin@test.com').status_code, 302)
+        with self.app.app_context():
+            self.assertEqual(OutboxMessage.query.count(), 4)
+    
+    def test_login_attempts_are_limited_per_account(self):
+        client = self.app.test_client()
+        with mock.patch('auth.check_password_hash', return_value=False):
+            statuses = [client.post('/login', data={'login': login, 'password': 'x'}).status_code
+                        for login in ['70111111', '+22670111111'] * 5 + ['awa@test.com', 'AWA@test.com']]
+        self.assertEqual(statuses[:10], [200] * 10)
+        self.assertEqual(statuses[10:], [200, 200])
+        with mock.patch('auth.check_password_hash') as check:
+            self.assertEqual(client.post('/login', data={'login': '70111111', 'password': 'x'}).status_code, 429)
+        check.assert_not_called()
+    
+    def test_register_is_limited_per_phone(self):
+        """Changer d'IP ne contourne pas la limite par numéro de téléphone"""
+        statuses = []
+        for i in range(4):
+            client = self.app.test_client()
+            statuses.append(client.post('/register', environ_base={'REMOTE_ADDR': f'10.0.0.{i}'}, data={
+                'first_name': 'Fatou', 'last_name': 'Sawadogo', 'email': f'fatou{i}@test.com',
+                'phone': '70 22 22 22', 'password': 'fatou12345', 'confirm_password': 'fatou12345'
+            }).status_code)
+        self.assertNotIn(429, statuses[:3])
+        self.assertEqual(statuses[3], 429)
+    
+    def test_order_api_answers_json(self):
+        client = self.client_for(self.user_id)
+        with mock.patch.dict(rate_limit.RATE_LIMITS, {'send_order': [rate_limit.RateLimit('user', 2, 60)]}):
+            self.order(client)
+            self.order(client)
+            response = self.order(client)
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.get_json()['success'])
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(self.stock(), self.STOCK - 2)
+    
+    def test_database_backend_is_shared(self):
+        """Deux instances (deux workers) voient le même seau"""
+        with self.app.app_context(), mock.patch.dict(rate_limit.RATE_LIMIT_CONFIG, {'backend': 'database'}):
+            workers = [rate_limit.DatabaseBackend(), rate_limit.DatabaseBackend()]
+            results = [workers[i % 2].consume('test:ip:1.2.3.4', 3, 3 / 60, 1000.0)[0] for i in range(4)]
+            self.assertEqual(results, [True, True, True, False])
+            self.assertTrue(workers[0].consume('test:ip:1.2.3.4', 3, 3 / 60, 1020.0)[0])
+            self.assertEqual(RateLimitBucket.query.count(), 1)
+            
+            client = self.app.test_client()
+            statuses = [self.forgot(client).status_code for _ in range(4)]
+            self.assertEqual(statuses, [302, 302, 302, 429])
+    
+    def test_unknown_backend_fails_at_import(self):
+        """Une faute de frappe dans RATE_LIMIT_BACKEND empêche le démarrage"""
+        result = subprocess.run([sys.executable, '-c', 'import rate_limit'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                env=dict(os.environ, RATE_LIMIT_BACKEND='memroy'))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("RATE_LIMIT_BACKEND='memroy' inconnu", result.stderr)
+    
+    def test_memory_check_is_fast(self):
+        with self.app.test_request_context('/login', method='POST', data={'login': 'awa@test.com'}):
+            started = time.perf_counter()
+            for _ in range(1000):
+                rate_limit.check_rate_limit('login')
+            self.assertLess((time.perf_counter() - started) / 1000, 0.001)
+
+class TestMetrics(ShopTestCase):
+    """Latence, requêtes SQL et tailles par route, exposées au format Prometheus"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(metrics.METRICS_CONFIG, {'token': 'secret-scrape'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def scrape(self, **headers):
+        headers.setdefault('Authorization', 'Bearer secret-scrape')
+        return self.app.test_client().get('/metrics', headers=headers)
+    
+    def test_request_metrics_are_exposed(self):
+        client = self.client_for(self.user_id)
+        before = metrics.REQUEST_QUERIES._series.get(('cart',), [0] * 12)[-2]
+        _, queries = count_queries(lambda: client.get('/cart'))
+        self.assertEqual(metrics.REQUEST_QUERIES._series[('cart',)][-2] - before, queries)
+        
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE koasa_http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'koasa_http_request_duration_seconds_bucket\{endpoint="cart",method="GET",le="\+Inf"\} \d+')
+        self.assertRegex(body, r'koasa_http_requests_total\{endpoint="cart",method="GET",status="200"\} \d+')
+        self.assertIn('koasa_http_response_size_bytes_count{endpoint="cart"}', body)
+        self.assertIn('koasa_sql_queries_total{context="request"}', body)
+    
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', (0.1, 1.0), ('kind',))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, 'a"b')
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{kind="a\\"b"} 4', lines)
+    
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.scrape(Authorization='').status_code, 403)
+        self.assertEqual(self.scrape(Authorization='Bearer autre').status_code, 403)
+        self.assertEqual(self.scrape().status_code, 200)
+    
+    def test_without_token_only_local_debug_is_allowed(self):
+        """Sans jeton, 127.0.0.1 ne suffit pas : c'est l'adresse de tout client derrière nginx"""
+        client = self.app.test_client()
+        with mock.patch.dict(metrics.METRICS_CONFIG, {'token': ''}):
+            self.assertEqual(client.get('/metrics').status_code, 403)
+            self.app.debug = True
+            try:
+                self.assertEqual(client.get('/metrics').status_code, 200)
+                self.assertEqual(client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'}).status_code, 403)
+                self.assertEqual(client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.9'}).status_code, 403)
+            finally:
+                self.app.debug = False
+    
+    def test_email_and_pdf_timings(self):
+        with mock.patch('outbox.smtp_pool.send_message'):
+            self.app.test_client().post('/forgot-password', data={'email': 'awa@test.com'})
+            with self.app.app_context():
+                outbox.process_outbox_batch()
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(invoice_cache.INVOICE_CACHE_CONFIG, {'directory': directory}):
+            client = self.client_for(self.user_id)
+            self.order(client)
+            with self.app.app_context():
+                client.get(f'/download-invoice/{Order.query.one().id}').close()
+        
+        body = self.scrape().get_data(as_text=True)
+        self.assertRegex(body, r'koasa_smtp_send_seconds_count\{result="ok"\} [1-9]')
+        self.assertRegex(body, r'koasa_pdf_render_seconds_count\{kind="facture"\} [1-9]')
+
+class TestProfiler(ShopTestCase):
+    """Profilage à la demande : en-tête administrateur ou une requête sur N"""
+    
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.config = dict(profiler.PROFILER_CONFIG)
+        profiler.PROFILER_CONFIG['directory'] = self.profile_dir.name
+    
+    def tearDown(self):
+        profiler.PROFILER_CONFIG.clear()
+        profiler.PROFILER_CONFIG.update(self.config)
+        self.profile_dir.cleanup()
+        super().tearDown()
+    
+    def test_admin_header_saves_downloadable_profile(self):
+        admin = self.client_for(self.admin_id)
+        response = admin.get('/cart', headers={'X-Koasa-Profile': 'sample'})
+        self.assertEqual(response.status_code, 200)
+        profile_id = response.headers['X-Koasa-Profile-Id']
+        
+        page = admin.get('/admin/profiles')
+        self.assertIn(profile_id[:15], page.get_data(as_text=True))
+        
+        download = admin.get(f'/admin/profiles/{profile_id}')
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('attachment', download.headers['Content-Disposition'])
+        # Piles repliées : "cadre;cadre;... N"
+        for line in download.get_data(as_text=True).splitlines():
+            self.assertRegex(line, r'^.+ \d+$')
+        download.close()
+        
+        self.assertEqual(self.client_for(self.user_id).get(f'/admin/profiles/{profile_id}').status_code, 403)
+        self.assertEqual(admin.get('/admin/profiles/../app.py').status_code, 404)
+    
+    def test_header_is_ignored_for_customers(self):
+        response = self.client_for(self.user_id).get('/cart', headers={'X-Koasa-Profile': 'cprofile'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Koasa-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+    
+    def test_sampling_one_request_in_n(self):
+        admin = self.client_for(self.admin_id)
+        admin.post('/admin/profiles', data={'sample_every': '3'})
+        self.assertEqual(profiler.PROFILER_CONFIG['sample_every'], 3)
+        profiler.PROFILER_CONFIG['default_mode'] = 'cprofile'
+        
+        client = self.client_for(self.user_id)
+        profiled = [bool(client.get('/cart').headers.get('X-Koasa-Profile-Id')) for _ in range(9)]
+        self.assertEqual(profiled.count(True), 3)
+        
+        profiles = profiler.list_profiles()
+        self.assertEqual({profile['trigger'] for profile in profiles}, {'sampling'})
+        stats = pstats.Stats(os.path.join(self.profile_dir.name, profiles[0]['file']))
+        self.assertGreater(stats.total_calls, 0)
+        
+        admin.post('/admin/profiles', data={'sample_every': '0'})
+        self.assertNotIn('X-Koasa-Profile-Id', client.get('/cart').headers)
+    
+    def test_ring_buffer_keeps_newest_profiles(self):
+        profiler.PROFILER_CONFIG['max_profiles'] = 2
+        admin = self.client_for(self.admin_id)
+        ids = [admin.get('/cart', headers={'X-Koasa-Profile': 'sample'}).headers['X-Koasa-Profile-Id']
+               for _ in range(3)]
+        
+        self.assertEqual([profile['id'] for profile in profiler.list_profiles()], ids[:0:-1])
+        self.assertEqual(len(os.listdir(self.profile_dir.name)), 4)
+        self.assertEqual(admin.get(f'/admin/profiles/{ids[0]}').status_code, 404)
+
+class TestQueryBudgets(ShopTestCase):
+    """
+    Nombre de requêtes SQL par route : plafonné, et indépendant du volume de
+    données (un N+1 fait grandir le compte avec les lignes affichées).
+    """
+    
+    # (rôle, URL) → requêtes SQL au plus, catalogue non mis en cache et utilisateur connecté en cache
+    # (une lecture des droits par requête authentifiée)
+    QUERY_BUDGETS = {
+        ('anonymous', '/'): 2,
+        ('anonymous', '/api/products'): 1,
+        ('anonymous', '/login'): 0,
+        ('customer', '/'): 3,
+        ('customer', '/cart'): 1,
+        ('customer', '/profile'): 3,
+        ('admin', '/admin/orders'): 3,
+        ('admin', '/admin/users'): 2,
+        ('admin', '/admin/products'): 3,
+        ('admin', '/admin/categories'): 3,
+        ('admin', '/admin/api/orders/stats'): 2,
+    }
+    
+    def seed(self, categories, products_per_category, customers, orders_per_customer):
+        """Insertion en masse : catégories, produits, clients et commandes à deux articles"""
+        with self.app.app_context():
+            start = Category.query.count()
+            db.session.execute(db.insert(Category), [
+                {'name': f'Catégorie {i}', 'icon': 'fas fa-tag'} for i in range(start, start + categories)
+            ])
+            category_ids = [c.id for c in Category.query.all()]
+            db.session.execute(db.insert(Product), [
+                {'name': f'Produit {category_id}-{i}', 'price': 1000 + i, 'category_id': category_id, 'stock': 5}
+                for category_id in category_ids[-categories:] for i in range(products_per_category)
+            ])
+            start = User.query.count()
+            db.session.execute(db.insert(User), [
+                {'email': f'client{i}@test.com', 'phone': f'+2267{i:07d}', 'first_name': 'Client',
+                 'last_name': str(i), 'password_hash': 'x', 'whatsapp_verified': True}
+                for i in range(start, start + customers)
+            ])
+            user_ids = [u.id for u in User.query.all()]
+            start = Order.query.count()
+            db.session.execute(db.insert(Order), [
+                {'user_id': user_id, 'order_number': f'KO-{start + n}-{i}', 'whatsapp_order_id': f'CMD-{start + n}-{i}',
+                 'total_amount': 7600}
+                for n, user_id in enumerate(user_ids) for i in range(orders_per_customer)
+            ])
+            db.session.execute(db.insert(OrderItem), [
+                {'order_id': order_id, 'product_id': self.product_id, 'product_name': 'Mouton - Gigot',
+                 'quantity': 1, 'unit_price': 3800, 'subtotal': 3800}
+                for (order_id,) in db.session.query(Order.id).filter(Order.id > start) for _ in range(2)
+            ])
+            db.session.commit()
+    
+    def measure(self):
+        """(rôle, URL) → instructions SQL émises par un GET"""
+        clients = {
+            'anonymous': self.app.test_client(),
+            'customer': self.client_for(self.user_id),
+            'admin': self.client_for(self.admin_id)
+        }
+        measured = {}
+        for role, url in self.QUERY_BUDGETS:
+            clients[role].get(url)  # utilisateur connecté mis en cache
+            catalog_cache.invalidate()
+            response, statements = capture_queries(lambda: clients[role].get(url))
+            self.assertEqual(response.status_code, 200, f'{role} {url}')
+            measured[(role, url)] = statements
+        return measured
+    
+    def report(self, route, statements, before=None):
+        role, url = route
+        line = f'GET {url} ({role}): {len(statements)} requête(s)'
+        if before is not None:
+            line = f'GET {url} ({role}): {len(before)} → {len(statements)} requête(s) avec plus de données'
+        # Signature d'un N+1 : la même instruction répétée
+        repeated = max(set(statements), key=statements.count, default=None)
+        if repeated and statements.count(repeated) > 1:
+            line += f"\n    répétée {statements.count(repeated)}× : {' '.join(repeated.split())[:160]}"
+        return line
+    
+    def test_routes_within_budget(self):
+        self.seed(categories=3, products_per_category=3, customers=3, orders_per_customer=2)
+        over_budget = [
+            self.report(route, statements) + f' (budget {self.QUERY_BUDGETS[route]})'
+            for route, statements in self.measure().items()
+            if len(statements) > self.QUERY_BUDGETS[route]
+        ]
+        if over_budget:
+            self.fail('Budget de requêtes dépassé :\n' + '\n'.join(over_budget))
+    
+    def test_query_count_does_not_grow_with_data(self):
+        self.seed(categories=2, products_per_category=2, customers=2, orders_per_customer=1)
+        small = self.measure()
+        self.seed(categories=30, products_per_category=10, customers=40, orders_per_customer=5)
+        large = self.measure()
+        growing = [
+            self.report(route, large[route], before=small[route])
+            for route in self.QUERY_BUDGETS
+            if len(large[route]) > len(small[route])
+        ]
+        if growing:
+            self.fail('Requêtes proportionnelles aux données (N+1) :\n' + '\n'.join(growing))
+
+class TestFixtureGenerator(ShopTestCase):
+    """Données synthétiques : valides, reproductibles, sans collision avec les vraies commandes"""
+    
+    END = datetime(2026, 3, 1, 12, 0)
+    
+    def generate(self, seed=7):
+        with self.app.app_context():
+            generate_fixtures.generate(users=60, orders=400, products=15, seed=seed, years=1, end=self.END)
+            return db.session.execute(db.select(
+                User.email, User.phone, Order.order_number, Order.status, Order.total_amount, Order.created_at
+            ).join(Order.customer).order_by(Order.id)).all()
+    
+    def test_generated_data_is_consistent(self):
+        rows = self.generate()
+        with self.app.app_context():
+            self.assertEqual(User.query.count(), 62)
+            self.assertEqual(Order.query.count(), 400)
+            for user in User.query.all():
+                self.assertEqual(normalize_phone(user.phone), user.phone)
+                self.assertRegex(user.phone, r'^\+226[5-7]\d{7}$')
+            totals = dict(db.session.query(OrderItem.order_id, db.func.sum(OrderItem.subtotal))
+                          .group_by(OrderItem.order_id).all())
+            for order in Order.query.all():
+                self.assertAlmostEqual(order.total_amount, totals[order.id])
+                self.assertGreaterEqual(order.created_at, order.customer.created_at)
+            # Catalogue daté dans la période générée, pas à l'heure de la génération
+            for product in Product.query.filter(Product.id != self.product_id):
+                self.assertEqual(product.created_at, self.END - timedelta(days=365))
+                self.assertLessEqual(product.updated_at, self.END)
+        self.assertTrue(all(row.created_at <= self.END for row in rows))
+        self.assertEqual(len({row.order_number for row in rows}), 400)
+        self.assertIn('livree', {row.status for row in rows})
+    
+    def test_cancelling_generated_order_keeps_stock(self):
+        """Les commandes générées ne réservent rien : les annuler ne gonfle pas le stock"""
+        self.generate()
+        with self.app.app_context():
+            order = Order.query.filter(Order.status == 'en_attente', Order.user_id != self.user_id).first()
+            stock = {item.product_id: item.product.stock for item in order.items}
+            order_id = order.id
+        self.client_for(self.admin_id).post(f'/admin/update-order-status/{order_id}', json={'status': 'annulee'})
+        with self.app.app_context():
+            self.assertEqual({product_id: db.session.get(Product, product_id).stock for product_id in stock}, stock)
+    
+    def test_same_seed_same_data(self):
+        first = self.generate()
+        self.tearDown()
+        self.setUp()
+        self.assertEqual(self.generate(), first)
+    
+    def test_order_counter_moves_past_generated_numbers(self):
+        self.generate()
+        client = self.client_for(self.user_id)
+        with mock.patch('models.datetime') as clock:
+            clock.now.return_value = self.END
+            self.assertEqual(self.order(client).status_code, 200)
+        with self.app.app_context():
+            last_day = Order.query.filter(Order.order_number.like(f"KO-{self.END:%Y%m%d}-%")).count()
+            self.assertGreater(last_day, 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
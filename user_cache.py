@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from catalog_cache import CatalogCache
+from models import db, User
+
+# Configuration du cache des utilisateurs connectés (load_user)
+USER_CACHE_CONFIG = {
+    'max_entries': 4096,
+    # Autres processus gunicorn : nom, email, téléphone y sont à jour au plus tard après
+    # ce délai ; les droits (ACCESS_FIELDS) sont relus à chaque requête
+    'ttl': 60
+}
+
+# Colonnes lues par les templates et les contrôles d'accès ; le reste de la ligne
+# (mot de passe, OTP, jetons de réinitialisation) n'est jamais chargé par load_user
+PRINCIPAL_FIELDS = ('id', 'email', 'phone', 'first_name', 'last_name', 'is_admin', 'is_active',
+                    'email_verified', 'whatsapp_verified', 'activation_token')
+
+# Champs d'autorisation jamais servis depuis le cache : l'invalidation ne touche que
+# le processus qui a fait la modification, un droit retiré doit l'être partout
+ACCESS_FIELDS = ('is_admin', 'is_active', 'whatsapp_verified')
+
+
+class UserPrincipal(namedtuple('UserPrincipal', PRINCIPAL_FIELDS), UserMixin):
+    """
+    Utilisateur courant en lecture seule (current_user). Les routes qui
+    modifient le compte chargent le User complet avec get_user_record().
+    """
+    __slots__ = ()
+
+
+user_cache = CatalogCache(**USER_CACHE_CONFIG)
+
+
+def _load_principal(user_id):
+    row = db.session.execute(
+        db.select(*(getattr(User, field) for field in PRINCIPAL_FIELDS)).where(User.id == user_id)
+    ).first()
+    return UserPrincipal(*row) if row else None
+
+
+def get_user_principal(user_id):
+    """
+    Principal en cache, droits relus en base (une lecture par clé primaire)
+    sauf s'il vient d'être chargé
+    """
+    loaded = []
+
+    def load():
+        loaded.append(True)
+        return _load_principal(user_id)
+
+    principal = user_cache.get_or_load(('user', user_id), load)
+    if principal is None or loaded:
+        return principal
+
+    access = db.session.execute(
+        db.select(*(getattr(User, field) for field in ACCESS_FIELDS)).where(User.id == user_id)
+    ).first()
+    if access is None:
+        user_cache.discard(('user', user_id))
+        return None
+    return principal._replace(**access._asdict())
+
+
+def get_user_record(user):
+    """User complet (modifiable) correspondant à un principal"""
+    return db.session.get(User, user.id)
+
+
+def invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.discard(('user', user_id))
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_users', set())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in PRINCIPAL_FIELDS):
+                changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    # Après le commit seulement : un chargement concurrent lirait sinon l'ancienne ligne
+    invalidate_users(session.info.pop('changed_users', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_users', None)
+
+
+def user_cache_stats():
+    return user_cache.stats()
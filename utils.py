@@ -7,22 +7,40 @@ from reportlab.lib.enums import TA_CENTER, TA_RIGHT
 from io import BytesIO
 from datetime import datetime
 import requests
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import urllib.parse
 import os
 
+from smtp_pool import SMTPConnectionPool, SMTP_POOL_CONFIG
+from email_templates import render_email, html_to_text
+
 # Configuration email CORRIGÉE
 EMAIL_CONFIG = {
     'host': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
     'port': int(os.environ.get('SMTP_PORT', 587)),
     'username': os.environ.get('SMTP_USERNAME', 'sankarabienvenu226@gmail.com'),
     'password': os.environ.get('SMTP_PASSWORD', ''),
+    'starttls': os.environ.get('SMTP_STARTTLS', 'true').lower() != 'false',
     'from_name': 'KOASA'
 }
 
-def send_email(to_email, subject, html_content):
+# Sessions SMTP authentifiées réutilisées d'un email à l'autre
+smtp_pool = SMTPConnectionPool(EMAIL_CONFIG, **SMTP_POOL_CONFIG)
+
+def build_email_message(to_email, subject, html_content, text_content=None):
+    """Construit le message MIME envoyé par send_email et par l'outbox"""
+    msg = MIMEMultipart('alternative')
+    msg['From'] = f"{EMAIL_CONFIG['from_name']} <{EMAIL_CONFIG['username']}>"
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    # Version texte d'abord : les clients affichent la dernière alternative lisible
+    msg.attach(MIMEText(text_content or html_to_text(html_content), 'plain', 'utf-8'))
+    msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+    return msg
+
+def send_email(to_email, subject, html_content, text_content=None):
     """
     Envoie un email réel via SMTP Gmail
     """
@@ -30,27 +48,10 @@ def send_email(to_email, subject, html_content):
     try:
         print(f"🔧 CONFIG SMTP: {EMAIL_CONFIG['username']}")
         print(f"🔧 MOT DE PASSE PRÉSENT: {bool(EMAIL_CONFIG['password'])}")
-        # Créer le message
-        msg = MIMEMultipart()
-        msg['From'] = f"{EMAIL_CONFIG['from_name']} <{EMAIL_CONFIG['username']}>"
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        # Ajouter le contenu HTML
-        msg.attach(MIMEText(html_content, 'html'))
+        msg = build_email_message(to_email, subject, html_content, text_content)
         
-        # Connexion au serveur SMTP
-        server = smtplib.SMTP(EMAIL_CONFIG['host'], EMAIL_CONFIG['port'])
-        server.ehlo()  # Identification au serveur
-        server.starttls()  # Chiffrement TLS
-        server.ehlo()  # Ré-identification après TLS
-        
-        # Login avec vos identifiants
-        server.login(EMAIL_CONFIG['username'], EMAIL_CONFIG['password'])
-        
-        # Envoi de l'email
-        server.send_message(msg)
-        server.quit()
+        # Envoi sur une connexion du pool (EHLO/STARTTLS/LOGIN déjà faits)
+        smtp_pool.send_message(msg)
         
         print(f"✅ Email envoyé avec succès à: {to_email}")
         return True
@@ -60,119 +61,35 @@ def send_email(to_email, subject, html_content):
         print(f"📧 Détails - From: {EMAIL_CONFIG['username']}, To: {to_email}")
         return False
 
+def render_verification_email(user, verification_code):
+    """Email de vérification : (sujet, HTML, texte)"""
+    return render_email('verification.html', first_name=user.first_name,
+                        verification_code=verification_code)
+
 def send_verification_email(user, verification_code):
     """Envoie l'email de vérification"""
-    subject = "🔐 KOASA - Vérification de votre email"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background: #dc2626; color: white; padding: 20px; text-align: center; }}
-            .content {{ background: #f9f9f9; padding: 20px; }}
-            .code {{ font-size: 32px; font-weight: bold; text-align: center; color: #dc2626; margin: 20px 0; padding: 15px; background: #f8f9fa; border: 2px dashed #dc2626; border-radius: 8px; }}
-            .footer {{ text-align: center; margin-top: 20px; font-size: 12px; color: #666; }}
-            .info {{ background: #e3f2fd; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🥩 KOASA Boucherie</h1>
-                <h2>Vérification de votre email</h2>
-            </div>
-            <div class="content">
-                <p>Bonjour <strong>{user.first_name}</strong>,</p>
-                <p>Merci de vous être inscrit sur KOASA. Pour activer votre compte, veuillez utiliser le code de vérification suivant :</p>
-                
-                <div class="code">{verification_code}</div>
-                
-                <div class="info">
-                    <p><strong>⏱️ Ce code expire dans 5 minutes</strong></p>
-                    <p><strong>📍 Important :</strong> Ce code est nécessaire pour vérifier votre email et continuer le processus d'inscription.</p>
-                </div>
-                
-                <p>Si vous n'avez pas créé de compte sur KOASA, veuillez ignorer cet email.</p>
-            </div>
-            <div class="footer">
-                <p>KOASA Boucherie Sankara & Fils - Ouagadougou, Burkina Faso</p>
-                <p>📞 +226 69 62 84 77 | 📧 contact@koasa.bf</p>
-                <p>© 2024 KOASA. Tous droits réservés.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    return send_email(user.email, subject, html_content)
+    return send_email(user.email, *render_verification_email(user, verification_code))
+
+def render_password_reset_email(user, reset_token):
+    """Email de réinitialisation : (sujet, HTML, texte)"""
+    reset_url = f"https://koasa.onrender.com/reset-password/{reset_token}"
+    return render_email('password_reset.html', first_name=user.first_name, reset_url=reset_url)
 
 def send_password_reset_email(user, reset_token):
     """Envoie l'email de réinitialisation de mot de passe"""
-    subject = "🔐 KOASA - Réinitialisation de votre mot de passe"
-    
-    reset_url = f"https://koasa.onrender.com/reset-password/{reset_token}"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background: #dc2626; color: white; padding: 20px; text-align: center; }}
-            .content {{ background: #f9f9f9; padding: 20px; }}
-            .button {{ display: inline-block; padding: 12px 24px; background: #dc2626; color: white; text-decoration: none; border-radius: 5px; font-weight: bold; }}
-            .footer {{ text-align: center; margin-top: 20px; font-size: 12px; color: #666; }}
-            .info {{ background: #fff3cd; padding: 15px; border-radius: 5px; margin: 15px 0; border-left: 4px solid #ffc107; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🥩 KOASA Boucherie</h1>
-                <h2>Réinitialisation de mot de passe</h2>
-            </div>
-            <div class="content">
-                <p>Bonjour <strong>{user.first_name}</strong>,</p>
-                <p>Vous avez demandé la réinitialisation de votre mot de passe. Cliquez sur le bouton ci-dessous pour créer un nouveau mot de passe :</p>
-                
-                <p style="text-align: center; margin: 30px 0;">
-                    <a href="{reset_url}" class="button">Réinitialiser mon mot de passe</a>
-                </p>
-                
-                <div class="info">
-                    <p><strong>⏱️ Ce lien expire dans 1 heure</strong></p>
-                    <p>Si le bouton ne fonctionne pas, copiez et collez ce lien dans votre navigateur :</p>
-                    <p style="word-break: break-all; background: #f8f9fa; padding: 10px; border-radius: 4px; font-family: monospace;">
-                        {reset_url}
-                    </p>
-                </div>
-                
-                <p>Si vous n'avez pas demandé cette réinitialisation, veuillez ignorer cet email.</p>
-            </div>
-            <div class="footer">
-                <p>KOASA Boucherie Sankara & Fils - Ouagadougou, Burkina Faso</p>
-                <p>📞 +226 69 62 84 77 | 📧 contact.koasa@gmail.com</p>
-                <p>© 2024 KOASA. Tous droits réservés.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    return send_email(user.email, subject, html_content)
+    return send_email(user.email, *render_password_reset_email(user, reset_token))
 
 # Fonctions WhatsApp réelles
-def generate_whatsapp_link(phone, token, user_name):
-    """
-    Génère un lien WhatsApp avec message pré-rempli pour l'utilisateur
-    L'utilisateur envoie le token à l'admin
-    """
-    admin_phone = "+22669628477"
-    message = f"""
+ADMIN_WHATSAPP_PHONE = "+22669628477"
+
+def build_whatsapp_url(phone, message):
+    """Lien wa.me avec message pré-rempli (wa.me attend le numéro sans '+')"""
+    digits = "".join(filter(str.isdigit, phone))
+    return f"https://wa.me/{digits}?text={urllib.parse.quote(message)}"
+
+def format_activation_whatsapp_message(phone, token, user_name):
+    """Message envoyé par l'utilisateur à l'admin avec son token d'activation"""
+    return f"""
 🔐 KOASA - Activation WhatsApp
 
 Bonjour Admin KOASA,
@@ -186,11 +103,13 @@ Mon numéro: {phone}
 
 Merci de vérifier mon WhatsApp!
 """
-    
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{admin_phone}?text={encoded_message}"
-    
-    return whatsapp_url
+
+def generate_whatsapp_link(phone, token, user_name):
+    """
+    Génère un lien WhatsApp avec message pré-rempli pour l'utilisateur
+    L'utilisateur envoie le token à l'admin
+    """
+    return build_whatsapp_url(ADMIN_WHATSAPP_PHONE, format_activation_whatsapp_message(phone, token, user_name))
 
 def send_activation_whatsapp(user):
     """Génère le lien WhatsApp pour que l'utilisateur envoie le token à l'admin"""
@@ -201,9 +120,9 @@ def send_activation_whatsapp(user):
     
     return whatsapp_url
 
-def send_otp_whatsapp(user, otp_code):
-    """Envoie le code OTP par WhatsApp (vrai envoi)"""
-    message = f"""
+def format_otp_whatsapp_message(user, otp_code):
+    """Code OTP envoyé au client"""
+    return f"""
 🔐 KOASA - Code de vérification WhatsApp
 
 Bonjour {user.first_name},
@@ -215,24 +134,25 @@ Votre code de vérification:
 
 Ne partagez ce code avec personne!
 """
-    
+
+def send_otp_whatsapp(user, otp_code):
+    """Envoie le code OTP par WhatsApp (vrai envoi)"""
     # Générer le lien WhatsApp pour l'envoi
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{user.phone}?text={encoded_message}"
+    whatsapp_url = build_whatsapp_url(user.phone, format_otp_whatsapp_message(user, otp_code))
     
     print(f"📱 Code OTP WhatsApp généré pour: {user.phone}")
     print(f"🔗 Lien WhatsApp: {whatsapp_url}")
     
     return whatsapp_url
 
-def send_order_confirmation_whatsapp(user, order):
-    """Envoie la confirmation de commande par WhatsApp"""
+def format_order_confirmation_message(user, order):
+    """Confirmation de commande envoyée au client"""
     items_text = "\n".join([
         f"• {item.product_name} - {item.quantity} {item.unit_price} FCFA"
         for item in order.items
     ])
     
-    message = f"""
+    return f"""
 ✅ KOASA - Commande confirmée!
 
 Bonjour {user.first_name},
@@ -251,15 +171,14 @@ Votre commande a été confirmée par l'admin!
 Votre commande est en préparation! 🥩
 Merci de votre confiance! 🙏
 """
-    
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{user.phone}?text={encoded_message}"
-    
-    return whatsapp_url
 
-def send_activation_confirmation_whatsapp(user):
-    """Envoie la confirmation d'activation à l'utilisateur"""
-    message = f"""
+def send_order_confirmation_whatsapp(user, order):
+    """Envoie la confirmation de commande par WhatsApp"""
+    return build_whatsapp_url(user.phone, format_order_confirmation_message(user, order))
+
+def format_activation_confirmation_message(user):
+    """Confirmation d'activation envoyée au client"""
+    return f"""
 ✅ KOASA - WhatsApp Vérifié!
 
 Bonjour {user.first_name},
@@ -270,26 +189,21 @@ Vous pouvez maintenant passer commande sur KOASA.
 
 Merci de votre confiance! 🥩
 """
-    
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{user.phone}?text={encoded_message}"
-    
-    return whatsapp_url
+
+def send_activation_confirmation_whatsapp(user):
+    """Envoie la confirmation d'activation à l'utilisateur"""
+    return build_whatsapp_url(user.phone, format_activation_confirmation_message(user))
 
 # --- FONCTION CORRIGÉE POUR GÉNÉRER LE LIEN WHATSAPP ---
-def generate_order_whatsapp_link(cart_items, total, user, whatsapp_order_id, delivery_address="", notes=""):
-    """
-    Génère un lien WhatsApp avec le récapitulatif de commande pour l'admin
-    """
-    admin_phone = "+22669628477"
-    
+def format_order_whatsapp_message(cart_items, total, user, whatsapp_order_id, delivery_address="", notes=""):
+    """Récapitulatif de commande envoyé à l'admin"""
     # Formater les items correctement
     items_text = "\n".join([
         f"• {item['name']} - {item['quantity']} {item.get('unit', 'unité')} x {item['price']:,.0f} FCFA = {(item['price'] * item['quantity']):,.0f} FCFA"
         for item in cart_items
     ])
     
-    message = f"""
+    return f"""
 🛒 NOUVELLE COMMANDE KOASA
 
 📋 ID COMMANDE: {whatsapp_order_id}
@@ -314,14 +228,21 @@ Email: {user.email}
 
 Merci de préparer cette commande! 🥩
 """
-    
-    # Encodage URL correct
-    encoded_message = urllib.parse.quote(message)
-    whatsapp_url = f"https://wa.me/{admin_phone}?text={encoded_message}"
+
+def generate_order_whatsapp_link(cart_items, total, user, whatsapp_order_id, delivery_address="", notes=""):
+    """
+    Génère un lien WhatsApp avec le récapitulatif de commande pour l'admin
+    """
+    message = format_order_whatsapp_message(cart_items, total, user, whatsapp_order_id, delivery_address, notes)
+    whatsapp_url = build_whatsapp_url(ADMIN_WHATSAPP_PHONE, message)
     
     print(f"🔗 Lien WhatsApp généré: {whatsapp_url}")
     return whatsapp_url
 
+# À incrémenter à chaque modification de la mise en page :
+# les factures déjà en cache (invoice_cache.py) sont alors régénérées
+INVOICE_TEMPLATE_VERSION = 1
+
 def generate_invoice_pdf(order, user):
     """Génère une facture PDF pour une commande"""
     buffer = BytesIO()
@@ -377,6 +298,8 @@ def generate_invoice_pdf(order, user):
         status_text = "EN PRÉPARATION"
     elif order.status == 'livree':
         status_text = "LIVRÉE"
+    elif order.status == 'annulee':
+        status_text = "ANNULÉE"
     
     elements.append(Paragraph(f"STATUT: {status_text}", header_style))
     elements.append(Spacer(1, 0.5*cm))
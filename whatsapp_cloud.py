@@ -0,0 +1,333 @@
+# Envoi des notifications WhatsApp par l'API Cloud (Meta), via l'outbox.
+# Optionnel : actif seulement si WHATSAPP_TOKEN et WHATSAPP_PHONE_NUMBER_ID sont
+# définis (et aiohttp installé). Sinon les liens wa.me de utils.py restent utilisés.
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+
+try:
+    import aiohttp
+except ImportError:  # dépendance optionnelle
+    aiohttp = None
+
+from models import db, normalize_phone, OutboxMessage, User
+from outbox import OUTBOX_BATCH_HANDLERS, enqueue_message, enqueue_messages
+from user_cache import invalidate_users
+from utils import format_activation_confirmation_message
+
+WHATSAPP_CLOUD_CONFIG = {
+    'token': os.environ.get('WHATSAPP_TOKEN', ''),
+    'phone_number_id': os.environ.get('WHATSAPP_PHONE_NUMBER_ID', ''),
+    'api_url': os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v19.0'),
+    # Webhook : jeton de vérification (abonnement) et secret de l'app (signature)
+    'verify_token': os.environ.get('WHATSAPP_VERIFY_TOKEN', ''),
+    'app_secret': os.environ.get('WHATSAPP_APP_SECRET', ''),
+    'max_connections': 20,     # connexions HTTP gardées ouvertes vers l'API
+    'concurrency': 10,         # requêtes simultanées au plus
+    'timeout': 15,             # secondes par requête
+    'rate_limit_retries': 3,   # nouveaux essais immédiats après un 429
+    'default_retry_after': 2   # secondes, si l'API ne précise pas Retry-After
+}
+
+# Codes d'erreur Graph API signalant une limite de débit
+RATE_LIMIT_CODES = {4, 80007, 130429, 131048, 131056}
+
+# Token d'activation (secrets.token_urlsafe(32)) repéré dans un message reçu
+ACTIVATION_TOKEN_PATTERN = re.compile(r'(?<![A-Za-z0-9_-])[A-Za-z0-9_-]{43}(?![A-Za-z0-9_-])')
+
+# Ordre des statuts de livraison : un webhook en retard ne fait pas reculer le statut
+DELIVERY_STATUS_RANK = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+class WhatsAppAPIError(Exception):
+    """Réponse d'erreur de l'API ; retryable = False pour les erreurs définitives (4xx)"""
+
+    def __init__(self, message, status=None, retryable=True):
+        self.status = status
+        self.retryable = retryable
+        super().__init__(message)
+
+
+def whatsapp_cloud_enabled():
+    return bool(aiohttp and WHATSAPP_CLOUD_CONFIG['token'] and WHATSAPP_CLOUD_CONFIG['phone_number_id'])
+
+
+def _retry_after(response, attempt):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return WHATSAPP_CLOUD_CONFIG['default_retry_after'] * 2 ** attempt
+
+
+class WhatsAppDispatcher:
+    """
+    Client asynchrone de l'API Cloud. La boucle asyncio tourne dans un thread
+    dédié ; la session aiohttp (pool de connexions keep-alive) y est partagée
+    par tous les envois. Un 429 suspend tous les envois jusqu'à Retry-After.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._semaphore = None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='koasa-whatsapp', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.config['max_connections'], keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.config['timeout']),
+                headers={'Authorization': f"Bearer {self.config['token']}"}
+            )
+            self._semaphore = asyncio.Semaphore(self.config['concurrency'])
+        return self._session
+
+    async def _wait_for_rate_limit(self):
+        delay = self._paused_until - self._loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send_text(self, to, body):
+        """Envoie un message texte ; retourne le wamid attribué par l'API"""
+        session = await self._get_session()
+        url = f"{self.config['api_url'].rstrip('/')}/{self.config['phone_number_id']}/messages"
+        payload = {
+            'messaging_product': 'whatsapp',
+            'recipient_type': 'individual',
+            'to': ''.join(filter(str.isdigit, to)),
+            'type': 'text',
+            'text': {'preview_url': False, 'body': body}
+        }
+
+        for attempt in range(self.config['rate_limit_retries'] + 1):
+            await self._wait_for_rate_limit()
+            async with self._semaphore:
+                self.requests += 1
+                async with session.post(url, json=payload) as response:
+                    data = await response.json(content_type=None)
+                    if response.status == 200:
+                        return data['messages'][0]['id']
+
+                    error = (data or {}).get('error', {})
+                    if response.status == 429 or error.get('code') in RATE_LIMIT_CODES:
+                        self.rate_limited += 1
+                        delay = _retry_after(response, attempt)
+                        self._paused_until = max(self._paused_until, self._loop.time() + delay)
+                        continue
+
+                    message = error.get('message') or f'HTTP {response.status}'
+                    raise WhatsAppAPIError(message, status=response.status,
+                                           retryable=response.status >= 500 or response.status == 408)
+
+        raise WhatsAppAPIError('Limite de débit WhatsApp atteinte', status=429)
+
+    async def _send_many(self, items):
+        return await asyncio.gather(*(self.send_text(to, body) for to, body in items),
+                                    return_exceptions=True)
+
+    def send_batch(self, items):
+        """
+        Envoie [(numéro, texte), ...] en parallèle (borné par concurrency).
+        Retourne, dans l'ordre, le wamid ou l'exception de chaque message.
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._send_many(items), loop)
+        return future.result()
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+        self._loop = None
+
+    def stats(self):
+        return {'requests': self.requests, 'rate_limited': self.rate_limited}
+
+
+dispatcher = WhatsAppDispatcher(WHATSAPP_CLOUD_CONFIG)
+
+
+def _deliver_whatsapp_batch(messages):
+    results = dispatcher.send_batch([
+        (message.recipient, json.loads(message.payload)['body']) for message in messages
+    ])
+    errors = []
+    for message, result in zip(messages, results):
+        if isinstance(result, BaseException):
+            errors.append(result)
+        else:
+            message.external_id = result
+            message.delivery_status = 'accepted'
+            errors.append(None)
+    return errors
+
+
+OUTBOX_BATCH_HANDLERS['whatsapp'] = _deliver_whatsapp_batch
+
+
+def enqueue_whatsapp(phone, body, purpose):
+    """Ajoute un message WhatsApp à l'outbox (transaction de l'appelant)"""
+    return enqueue_message('whatsapp', phone, {'body': body, 'purpose': purpose})
+
+
+def verify_webhook_signature(body, signature_header):
+    """En-tête X-Hub-Signature-256 : HMAC-SHA256 du corps brut avec le secret de l'app"""
+    secret = WHATSAPP_CLOUD_CONFIG['app_secret']
+    if not secret or not signature_header or not signature_header.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len('sha256='):])
+
+
+def apply_status_updates(payload):
+    """
+    Met à jour les messages de l'outbox à partir des statuts reçus
+    (entry[].changes[].value.statuses[]). Retourne le nombre de statuts appliqués.
+    """
+    statuses = _webhook_values(payload, 'statuses')
+    if not statuses:
+        return 0
+
+    messages = {
+        message.external_id: message
+        for message in OutboxMessage.query.filter(
+            OutboxMessage.external_id.in_({status.get('id') for status in statuses})
+        ).all()
+    }
+
+    applied = 0
+    for status in statuses:
+        message = messages.get(status.get('id'))
+        new_status = status.get('status')
+        if message is None or new_status not in DELIVERY_STATUS_RANK:
+            continue
+        if DELIVERY_STATUS_RANK[new_status] <= DELIVERY_STATUS_RANK.get(message.delivery_status, 0):
+            continue
+        message.delivery_status = new_status
+        if new_status == 'failed':
+            errors = status.get('errors') or [{}]
+            message.last_error = f"WhatsApp: {errors[0].get('title', 'échec de livraison')}"[:1000]
+        applied += 1
+    db.session.commit()
+    return applied
+
+
+def _webhook_values(payload, key):
+    return [
+        item
+        for entry in payload.get('entry', [])
+        for change in entry.get('changes', [])
+        for item in change.get('value', {}).get(key, [])
+    ]
+
+
+def _message_text(message):
+    if message.get('type') == 'text':
+        return message.get('text', {}).get('body', '')
+    if message.get('type') == 'button':
+        return message.get('button', {}).get('text', '')
+    return ''
+
+
+# unmatched : tokens valides reçus d'un autre numéro que celui du compte
+inbound_stats = {'messages': 0, 'activated': 0, 'unmatched': 0, 'confirmations_skipped': 0}
+_inbound_lock = threading.Lock()
+
+
+def process_inbound_messages(payload):
+    """
+    Messages reçus (entry[].changes[].value.messages[]) : un token d'activation
+    n'active le compte que s'il est envoyé depuis le numéro de ce compte (le
+    token seul circule en clair dans le message d'activation). Tout le lot est
+    traité en une lecture (IN sur l'index activation_token) et une mise à jour ;
+    les confirmations partent par l'outbox dans la même transaction.
+    Retourne le nombre de comptes activés.
+    """
+    messages = _webhook_values(payload, 'messages')
+    if not messages:
+        return 0
+
+    # token -> numéros expéditeurs qui l'ont envoyé
+    senders = {}
+    for message in messages:
+        sender = normalize_phone('+' + message['from']) if message.get('from') else None
+        for token in ACTIVATION_TOKEN_PATTERN.findall(_message_text(message)):
+            senders.setdefault(token, set()).add(sender)
+
+    # Les renvois du même webhook par Meta ne retrouvent plus de compte à activer
+    candidates = User.query.filter(
+        User.activation_token.in_(senders),
+        db.or_(User.whatsapp_verified.is_(False), User.whatsapp_verified.is_(None))
+    ).all() if senders else []
+    users = [user for user in candidates if user.phone in senders[user.activation_token]]
+    # Sans API Cloud configurée, l'outbox ne pourrait que réessayer jusqu'à l'abandon
+    confirmed = whatsapp_cloud_enabled()
+
+    if users:
+        user_ids = [user.id for user in users]
+        db.session.execute(
+            db.update(User)
+            .where(User.id.in_(user_ids))
+            .values(whatsapp_verified=True)
+            .execution_options(synchronize_session=False)
+        )
+        if confirmed:
+            enqueue_messages('whatsapp', [
+                (user.phone, {'body': format_activation_confirmation_message(user), 'purpose': 'activation'})
+                for user in users
+            ])
+        else:
+            print(f"⚠️ API WhatsApp Cloud non configurée : {len(users)} confirmation(s) d'activation non envoyée(s)")
+        db.session.commit()
+        # UPDATE groupé, hors suivi de session : invalidation explicite
+        invalidate_users(user_ids)
+        print(f"✅ {len(users)} compte(s) activé(s) par message WhatsApp")
+    unmatched = len(candidates) - len(users)
+    if unmatched:
+        print(f"⚠️ {unmatched} token(s) d'activation reçu(s) d'un autre numéro que celui du compte")
+
+    with _inbound_lock:
+        inbound_stats['messages'] += len(messages)
+        inbound_stats['activated'] += len(users)
+        inbound_stats['unmatched'] += unmatched
+        if users and not confirmed:
+            inbound_stats['confirmations_skipped'] += len(users)
+    return len(users)
+
+
+def whatsapp_delivery_stats():
+    counts = dict(
+        db.session.query(OutboxMessage.delivery_status, db.func.count(OutboxMessage.id))
+        .filter(OutboxMessage.channel == 'whatsapp')
+        .group_by(OutboxMessage.delivery_status).all()
+    )
+    return {
+        'enabled': whatsapp_cloud_enabled(),
+        'statuses': {status or 'en_file': count for status, count in counts.items()},
+        'dispatcher': dispatcher.stats(),
+        'inbound': dict(inbound_stats)
+    }
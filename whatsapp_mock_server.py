@@ -0,0 +1,226 @@
+# whatsapp_mock_server.py
+"""
+Faux serveur de l'API WhatsApp Cloud, pour développer et tester hors ligne.
+
+    python whatsapp_mock_server.py --port 8090 --webhook-url http://localhost:5000/webhooks/whatsapp
+    WHATSAPP_API_URL=http://localhost:8090/v19.0 WHATSAPP_TOKEN=test WHATSAPP_PHONE_NUMBER_ID=123 python app.py
+
+Accepte POST /<version>/<phone_number_id>/messages comme l'API réelle,
+peut simuler latence et limites de débit (429 + Retry-After), et envoie les
+statuts sent/delivered au webhook de l'application, signés avec le secret.
+
+Rejouer des webhooks entrants enregistrés (messages d'activation) :
+
+    python whatsapp_mock_server.py --replay tests/fixtures/whatsapp_inbound.json \
+        --activation-token <token> --webhook-url http://localhost:5000/webhooks/whatsapp
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import socket
+import threading
+import time
+import uuid
+
+from aiohttp import web, ClientSession
+
+
+class MockWhatsAppServer:
+
+    def __init__(self, token='test-token', app_secret='test-secret', webhook_url=None,
+                 latency=0.0, rate_limit_every=0, retry_after=0):
+        self.token = token
+        self.app_secret = app_secret
+        self.webhook_url = webhook_url
+        self.latency = latency
+        # Toutes les N requêtes, répondre 429 (0 = jamais)
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.messages = []
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.base_url = None
+        self._loop = None
+        self._thread = None
+        self._runner = None
+        self._started = threading.Event()
+
+    def _error(self, status, code, message, headers=None):
+        return web.json_response({'error': {'message': message, 'type': 'OAuthException', 'code': code}},
+                                 status=status, headers=headers)
+
+    async def handle_message(self, request):
+        if request.headers.get('Authorization') != f'Bearer {self.token}':
+            return self._error(401, 190, 'Invalid OAuth access token')
+
+        self.requests += 1
+        if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+            self.rate_limited += 1
+            return self._error(429, 130429, 'Rate limit hit', headers={'Retry-After': str(self.retry_after)})
+
+        payload = await request.json()
+        if payload.get('messaging_product') != 'whatsapp' or not payload.get('to'):
+            return self._error(400, 100, 'Invalid parameter')
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        wamid = f'wamid.{uuid.uuid4().hex}'
+        self.messages.append({'id': wamid, 'phone_number_id': request.match_info['phone_number_id'],
+                              'to': payload['to'], 'body': payload.get('text', {}).get('body')})
+        if self.webhook_url:
+            asyncio.ensure_future(self._send_statuses(wamid, payload['to']))
+
+        return web.json_response({
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': payload['to'], 'wa_id': payload['to']}],
+            'messages': [{'id': wamid}]
+        })
+
+    async def handle_list(self, request):
+        return web.json_response({'messages': self.messages, 'requests': self.requests,
+                                  'rate_limited': self.rate_limited, 'max_in_flight': self.max_in_flight})
+
+    async def _send_statuses(self, wamid, recipient):
+        async with ClientSession() as session:
+            for status in ('sent', 'delivered'):
+                body = json.dumps(status_payload(wamid, status, recipient)).encode('utf-8')
+                headers = {'Content-Type': 'application/json',
+                           'X-Hub-Signature-256': sign(body, self.app_secret)}
+                try:
+                    await session.post(self.webhook_url, data=body, headers=headers)
+                except Exception as e:
+                    print(f"⚠️ Webhook injoignable: {e}")
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post('/{version}/{phone_number_id}/messages', self.handle_message)
+        app.router.add_get('/_mock/messages', self.handle_list)
+        return app
+
+    def start(self, host='127.0.0.1', port=0):
+        """Démarre le serveur dans un thread ; retourne l'URL de base de l'API (…/v19.0)"""
+        if not port:
+            with socket.socket() as sock:
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.build_app())
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.TCPSite(self._runner, host, port).start())
+            self._started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='whatsapp-mock', daemon=True)
+        self._thread.start()
+        self._started.wait(10)
+        self.base_url = f'http://{host}:{port}/v19.0'
+        return self.base_url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+
+def sign(body, app_secret):
+    return 'sha256=' + hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def status_payload(wamid, status, recipient, phone_number_id='123456789'):
+    """Corps d'un webhook de statut, au format de l'API Cloud"""
+    value = {
+        'messaging_product': 'whatsapp',
+        'metadata': {'display_phone_number': '22669628477', 'phone_number_id': phone_number_id},
+        'statuses': [{'id': wamid, 'status': status, 'timestamp': '1700000000', 'recipient_id': recipient}]
+    }
+    if status == 'failed':
+        value['statuses'][0]['errors'] = [{'code': 131026, 'title': 'Message undeliverable'}]
+    return {'object': 'whatsapp_business_account',
+            'entry': [{'id': 'WABA_ID', 'changes': [{'field': 'messages', 'value': value}]}]}
+
+
+def load_replay_payloads(path, activation_token=None):
+    """
+    Webhooks enregistrés (liste JSON) → corps bruts prêts à signer. Le texte
+    ACTIVATION_TOKEN des messages est remplacé par le token fourni.
+    """
+    with open(path, encoding='utf-8') as f:
+        payloads = json.load(f)
+    bodies = []
+    for payload in payloads:
+        body = json.dumps(payload, ensure_ascii=False)
+        if activation_token:
+            body = body.replace('ACTIVATION_TOKEN', activation_token)
+        bodies.append(body.encode('utf-8'))
+    return bodies
+
+
+async def replay_webhooks(url, bodies, app_secret, repeat=1, concurrency=20):
+    """Envoie les corps signés au webhook ; retourne (statuts HTTP, durée)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async with ClientSession() as session:
+        async def post(body):
+            async with semaphore:
+                async with session.post(url, data=body, headers={
+                    'Content-Type': 'application/json',
+                    'X-Hub-Signature-256': sign(body, app_secret)
+                }) as response:
+                    return response.status
+
+        statuses = await asyncio.gather(*(post(body) for _ in range(repeat) for body in bodies))
+    return statuses, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--token', default='test')
+    parser.add_argument('--app-secret', default='test-secret')
+    parser.add_argument('--webhook-url', default=None)
+    parser.add_argument('--latency', type=float, default=0.05, help='secondes par message')
+    parser.add_argument('--rate-limit-every', type=int, default=0)
+    parser.add_argument('--replay', metavar='FICHIER', help='rejoue des webhooks enregistrés puis quitte')
+    parser.add_argument('--activation-token', default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.replay:
+        if not args.webhook_url:
+            parser.error('--replay nécessite --webhook-url')
+        bodies = load_replay_payloads(args.replay, args.activation_token)
+        statuses, duration = asyncio.run(replay_webhooks(args.webhook_url, bodies, args.app_secret, args.repeat))
+        print(f"📨 {len(statuses)} webhooks en {duration:.2f}s ({len(statuses) / duration:.0f}/s), "
+              f"statuts: {dict((code, statuses.count(code)) for code in set(statuses))}")
+        return
+
+    server = MockWhatsAppServer(token=args.token, app_secret=args.app_secret, webhook_url=args.webhook_url,
+                                latency=args.latency, rate_limit_every=args.rate_limit_every, retry_after=1)
+    base_url = server.start(args.host, args.port)
+    print(f"📱 Faux WhatsApp Cloud API: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()